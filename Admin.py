@@ -2,6 +2,7 @@
 Модуль админской панели (режим организатора)
 
 Функционал:
+- Каталог соревнований: список, создание, открытие, удаление
 - Создание контрольных пунктов (КП)
 - Привязка QR-кодов к КП
 - Просмотр/редактирование списка КП
@@ -16,26 +17,58 @@ from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.label import Label
-from kivy.storage.jsonstore import JsonStore
 from kivy.metrics import dp
 from kivy.app import App
 from kivy.core.window import Window
 import os
 import re
 from datetime import datetime
+import Cryptography
+import Member
+import QR_codes
+import Storage
 
-# PIN-код для доступа к админ-панели
-ADMIN_PIN = "1"
+# PIN-код по умолчанию: из него создается проверочная запись при первом
+# запуске, сам PIN в данных не хранится
+DEFAULT_ADMIN_PIN = "1"
+# Имя ключа организатора в KeyManager
+ADMIN_KEY_NAME = 'admin'
+# Ключ app_data.json с идентификатором открытого в админ-панели соревнования
+ADMIN_RACE_KEY = 'admin_race'
+
+
+def get_admin_verifier():
+    """
+    Проверочная запись PIN организатора (создается при первом обращении)
+
+    В записи прежних версий дописываются действующие параметры KDF,
+    чтобы их не изменила будущая смена констант Cryptography.KDF_*.
+    """
+    store = Storage.get_store('app_data.json')
+    if not store.exists('admin'):
+        store.put('admin', verifier=Cryptography.make_secret_verifier(DEFAULT_ADMIN_PIN))
+    verifier = store.get('admin')['verifier']
+    params = Cryptography.verifier_params(verifier)
+    if verifier.get('params') != params:
+        verifier = dict(verifier, params=params)
+        store.put('admin', verifier=verifier)
+    return verifier
 
 
 def request_admin_access(callback_success, callback_failure=None):
     """
     Запрос PIN-кода для доступа к админ-панели
+
+    PIN запрашивается при каждом входе: ключ организатора в KeyManager
+    нужен только для шифрования и удаляется при уходе с экрана
+    админ-панели (AdminScreen.on_leave) и при сворачивании приложения.
     
     Args:
         callback_success: Функция, вызываемая при успешном вводе PIN
         callback_failure: Функция, вызываемая при неверном PIN (опционально)
     """
+    key_manager = Cryptography.get_key_manager()
+
     # Создаем содержимое диалога
     content = BoxLayout(
         orientation='vertical',
@@ -90,7 +123,7 @@ def request_admin_access(callback_success, callback_failure=None):
         """Проверка введенного PIN-кода"""
         entered_pin = pin_input.text.strip()
         
-        if entered_pin == ADMIN_PIN:
+        if key_manager.unlock(ADMIN_KEY_NAME, entered_pin, get_admin_verifier()):
             popup.dismiss()
             callback_success()
         else:
@@ -154,12 +187,144 @@ def request_admin_access(callback_success, callback_failure=None):
     return popup
 
 
+def show_confirm(title, message, on_confirm):
+    """
+    Диалог подтверждения действия
+
+    Args:
+        title: Заголовок окна
+        message: Текст вопроса
+        on_confirm: Функция, вызываемая при подтверждении
+    """
+    content = BoxLayout(orientation='vertical', spacing=dp(15), padding=dp(20))
+    text_label = Label(text=message, halign='center')
+    text_label.bind(size=text_label.setter('text_size'))
+    content.add_widget(text_label)
+
+    buttons_layout = BoxLayout(
+        orientation='horizontal',
+        spacing=dp(10),
+        size_hint_y=None,
+        height=dp(50)
+    )
+    popup = Popup(
+        title=title,
+        content=content,
+        size_hint=(0.8, 0.4),
+        auto_dismiss=False
+    )
+
+    def confirm(instance):
+        popup.dismiss()
+        on_confirm()
+
+    yes_btn = Button(
+        text='Да',
+        size_hint_x=0.5,
+        background_normal='',
+        background_color=(0.8, 0.2, 0.2, 1),
+        color=(1, 1, 1, 1)
+    )
+    yes_btn.bind(on_press=confirm)
+    buttons_layout.add_widget(yes_btn)
+
+    no_btn = Button(
+        text='Отмена',
+        size_hint_x=0.5,
+        background_normal='',
+        background_color=(0.7, 0.7, 0.7, 1),
+        color=(0.2, 0.2, 0.2, 1)
+    )
+    no_btn.bind(on_press=lambda x: popup.dismiss())
+    buttons_layout.add_widget(no_btn)
+
+    content.add_widget(buttons_layout)
+    popup.open()
+    return popup
+
+
+def _migrate_single_race(store, catalog):
+    """
+    Перенос соревнования из старого формата app_data.json в каталог
+
+    Раньше app_data.json хранил одно соревнование (ключи 'race' и
+    'checkpoints'). Оно добавляется в каталог и становится открытым.
+    """
+    if not store.exists('race'):
+        return
+    race = store.get('race')
+    checkpoints = []
+    if store.exists('checkpoints'):
+        checkpoints = store.get('checkpoints').get('items', [])
+    race_id = catalog.add_race({
+        'meta': {
+            'name': race.get('name', ''),
+            'date': race.get('date', ''),
+            'version': 0,
+            'created_at': race.get('created_at', '')
+        },
+        'checkpoints': checkpoints
+    })
+    store.put(ADMIN_RACE_KEY, race_id=race_id)
+    store.delete('race')
+    if store.exists('checkpoints'):
+        store.delete('checkpoints')
+
+
+def bind_scanned_codes(race_data, codes):
+    """
+    Привязка пачки отсканированных кодов к КП соревнования
+
+    Коды по порядку сканирования привязываются к КП без кода, для
+    оставшихся создаются новые КП со следующими номерами. Уже привязанные
+    коды пропускаются.
+
+    Args:
+        race_data: Данные соревнования (меняются на месте)
+        codes: Считанные коды (bytes или str)
+
+    Returns:
+        tuple: (привязано к существующим КП, создано новых КП)
+    """
+    checkpoints = race_data.setdefault('checkpoints', [])
+    known = {cp['code'] for cp in checkpoints if cp.get('code')}
+    without_code = [cp for cp in checkpoints if not cp.get('code')]
+    numbers = [
+        int(match.group(1)) for match in
+        (re.fullmatch(r'КП (\d+)', cp.get('name', '')) for cp in checkpoints)
+        if match
+    ]
+    next_number = max(numbers, default=0) + 1
+    bound = created = 0
+    for code in codes:
+        if isinstance(code, bytes):
+            code = code.decode('utf-8', errors='replace')
+        code = code.strip()
+        if not code or code in known:
+            continue
+        known.add(code)
+        if without_code:
+            without_code.pop(0)['code'] = code
+            bound += 1
+        else:
+            checkpoints.append({'name': f'КП {next_number}', 'code': code})
+            next_number += 1
+            created += 1
+    if bound or created:
+        meta = race_data.setdefault('meta', {})
+        meta['version'] = meta.get('version', 0) + 1
+    return bound, created
+
+
 class AdminScreen(Screen):
     """Экран админ-панели"""
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.name = 'admin'
+        # Принятые результаты открытого соревнования (Member.ResultLedger)
+        self._ledger = None
+        self._ledger_race_id = None
         self._build_ui()
     
     def _build_ui(self):
@@ -212,11 +377,19 @@ class AdminScreen(Screen):
         content_wrapper = FloatLayout()
         content = BoxLayout(orientation='vertical', padding=dp(20), spacing=dp(20))
         
-        # Проверяем наличие соревнования
-        self.store = JsonStore('app_data.json')
+        # Проверяем, открыто ли соревнование
+        self.store = Storage.get_store('app_data.json')
+        self.catalog = Storage.get_race_catalog()
+        _migrate_single_race(self.store, self.catalog)
+        self.race_id = None
+        if self.store.exists(ADMIN_RACE_KEY):
+            race_id = self.store.get(ADMIN_RACE_KEY)['race_id']
+            if self.catalog.exists(race_id):
+                self.race_id = race_id
         
-        if not self.store.exists('race'):
-            # Нет соревнования - показываем форму создания
+        if self.race_id is None:
+            # Нет открытого соревнования - список соревнований и форма создания
+            self._build_race_list(content)
             self._build_create_race_form(content)
         else:
             # Есть соревнование - показываем информацию о нем
@@ -233,6 +406,71 @@ class AdminScreen(Screen):
         self.header_rect.pos = instance.pos
         self.header_rect.size = instance.size
     
+    def _build_race_list(self, parent):
+        """Список соревнований каталога (данные соревнований не загружаются)"""
+        races = self.catalog.list_races()
+        if not races:
+            return
+        
+        list_label = Label(
+            text='Соревнования',
+            font_size=dp(20),
+            size_hint_y=None,
+            height=dp(40)
+        )
+        parent.add_widget(list_label)
+        
+        for race_id, meta in races:
+            row = BoxLayout(orientation='horizontal', size_hint_y=None, height=dp(50), spacing=dp(10))
+            open_btn = Button(
+                text=f"{meta.get('name', '')}  {meta.get('date', '')}",
+                background_normal='',
+                background_color=(0.9, 0.9, 0.9, 1),
+                color=(0.2, 0.2, 0.2, 1)
+            )
+            open_btn.bind(on_press=lambda x, rid=race_id: self._open_race(rid))
+            delete_btn = Button(
+                text='✕',
+                size_hint_x=None,
+                width=dp(50),
+                background_normal='',
+                background_color=(0.8, 0.2, 0.2, 1),
+                color=(1, 1, 1, 1)
+            )
+            delete_btn.bind(on_press=lambda x, rid=race_id, m=meta: self._confirm_delete_race(rid, m))
+            row.add_widget(open_btn)
+            row.add_widget(delete_btn)
+            parent.add_widget(row)
+    
+    def _open_race(self, race_id):
+        """Открытие соревнования из списка"""
+        self.store.put(ADMIN_RACE_KEY, race_id=race_id)
+        self._rebuild()
+    
+    def _close_race(self, instance):
+        """Возврат к списку соревнований"""
+        if self.race_id is not None:
+            self.catalog.close_race(self.race_id)
+        if self.store.exists(ADMIN_RACE_KEY):
+            self.store.delete(ADMIN_RACE_KEY)
+        self._rebuild()
+    
+    def _confirm_delete_race(self, race_id, meta):
+        """Удаление соревнования с подтверждением"""
+        def delete():
+            self.catalog.delete_race(race_id)
+            self._rebuild()
+        show_confirm(
+            'Удалить соревнование',
+            f"Удалить соревнование «{meta.get('name', '')}» ({meta.get('date', '')})?",
+            delete
+        )
+    
+    def _rebuild(self):
+        """Перестроение интерфейса после смены соревнования"""
+        self.clear_widgets()
+        self._build_ui()
+    
     def _build_create_race_form(self, parent):
         """Создание формы для создания соревнования"""
         form_label = Label(
@@ -296,8 +534,8 @@ class AdminScreen(Screen):
         parent.add_widget(Label(size_hint_y=1))
     
     def _build_race_info(self, parent):
-        """Отображение информации о существующем соревновании"""
-        race_data = self.store.get('race')
+        """Отображение информации об открытом соревновании"""
+        race_data = self.catalog.get_meta(self.race_id)
         
         # Оранжевая плашка с информацией о соревновании
         info_header = BoxLayout(
@@ -343,9 +581,108 @@ class AdminScreen(Screen):
         
         parent.add_widget(info_header)
         
+        # Кнопка возврата к списку соревнований
+        races_btn = Button(
+            text='Все соревнования',
+            size_hint_y=None,
+            height=dp(50),
+            background_normal='',
+            background_color=(0.9, 0.9, 0.9, 1),
+            color=(0.2, 0.2, 0.2, 1)
+        )
+        races_btn.bind(on_press=self._close_race)
+        parent.add_widget(races_btn)
+        
+        # Пакетная привязка кодов: КП без кода и новые КП
+        batch_btn = Button(
+            text='Привязать коды КП (пакетное сканирование)',
+            size_hint_y=None,
+            height=dp(50),
+            background_normal='',
+            background_color=(0.9, 0.9, 0.9, 1),
+            color=(0.2, 0.2, 0.2, 1)
+        )
+        batch_btn.bind(on_press=self._batch_bind_codes)
+        parent.add_widget(batch_btn)
+        
+        # Прием сдачи результатов с телефона экипажа
+        results_btn = Button(
+            text='Принять результаты',
+            size_hint_y=None,
+            height=dp(50),
+            background_normal='',
+            background_color=(0.2, 0.4, 0.8, 1),
+            color=(1, 1, 1, 1)
+        )
+        results_btn.bind(on_press=self._accept_results)
+        parent.add_widget(results_btn)
+        
         # TODO: Добавить остальной функционал админ-панели
         parent.add_widget(Label(size_hint_y=1))
     
+    def _batch_bind_codes(self, instance):
+        """Пакетное сканирование кодов КП подряд"""
+        race_data = self.catalog.open_race(self.race_id)
+        seen = [
+            cp['code'].encode('utf-8')
+            for cp in race_data.get('checkpoints', []) if cp.get('code')
+        ]
+        
+        def on_done(codes):
+            bound, created = bind_scanned_codes(race_data, codes)
+            if not bound and not created:
+                return
+            self.catalog.save_race(self.race_id)
+            self._rebuild()
+            Popup(
+                title='Привязка кодов',
+                content=Label(text=f'Привязано к КП: {bound}\nСоздано КП: {created}'),
+                size_hint=(0.7, 0.3),
+                auto_dismiss=True
+            ).open()
+        
+        QR_codes.open_batch_scanner_popup(
+            lambda data: None,
+            seen=seen,
+            callback_done=on_done,
+            title='Сканирование кодов КП'
+        )
+    
+    def _get_ledger(self):
+        """ResultLedger открытого соревнования (загружается при первом приеме)"""
+        if self._ledger is None or self._ledger_race_id != self.race_id:
+            audit_key = Cryptography.get_key_manager().subkey(
+                ADMIN_KEY_NAME, f'race:{self.race_id}:audit'
+            )
+            self._ledger = Member.open_ledger(self.catalog, self.race_id, audit_key)
+            self._ledger_race_id = self.race_id
+        return self._ledger
+    
+    def _accept_results(self, instance):
+        """Сканирование сдачи экипажа и показ подтверждения"""
+        ledger = self._get_ledger()
+        
+        def on_scanned(data):
+            try:
+                crew_id, added, _ = ledger.ingest(data)
+            except Member.ReplayRejected as e:
+                # Подпись и цепочка верны, но номер сдачи не принят: это
+                # не дубликат, а, например, переустановка приложения
+                self._show_error(f'Сдача отклонена как повтор: {e}')
+                return
+            except (ValueError, KeyError, TypeError) as e:
+                self._show_error(f'Сдача не принята: {e}')
+                return
+            if added:
+                title = f'Экипаж {crew_id}: принято новых записей {added}'
+            else:
+                title = f'Экипаж {crew_id}: сдача уже принята ранее'
+            # Участник сканирует подтверждение - его телефон перестает
+            # передавать принятые записи
+            QR_codes.open_qr_popup(ledger.build_ack(crew_id), title=title)
+        
+        QR_codes.open_scanner_popup(on_scanned, title='Сканирование сдачи результатов')
+    
     def _update_info_rect(self, instance, value):
         """Обновление позиции и размера фона плашки с информацией"""
         self.info_rect.pos = instance.pos
@@ -371,12 +708,17 @@ class AdminScreen(Screen):
             self._show_error('Неверный формат даты. Используйте ДД-ММ-ГГГГ')
             return
         
-        # Сохраняем данные соревнования
-        self.store.put('race', name=name, date=date, created_at=datetime.now().isoformat())
-        
-        # Обновляем интерфейс
-        self.clear_widgets()
-        self._build_ui()
+        # Добавляем соревнование в каталог и открываем его
+        race_id = self.catalog.add_race({
+            'meta': {
+                'name': name,
+                'date': date,
+                'version': 0,
+                'created_at': datetime.now().isoformat()
+            },
+            'checkpoints': []
+        })
+        self._open_race(race_id)
     
     def _show_error(self, message):
         """Показ сообщения об ошибке"""
@@ -612,29 +954,32 @@ class AdminScreen(Screen):
                 self._show_error('Неверный формат координат. Используйте формат: xx,xxxxx° yy,yyyyy°')
                 return
             
-            # Сохраняем КП
-            cp_name = f"КП {cp_number}"
-            if not self.store.exists('checkpoints'):
-                self.store.put('checkpoints', items=[])
-            
-            checkpoints = self.store.get('checkpoints').get('items', [])
-            checkpoints.append({
-                'name': cp_name,
+            # Сохраняем КП в файл открытого соревнования
+            race_data = self.catalog.open_race(self.race_id)
+            race_data.setdefault('checkpoints', []).append({
+                'name': f"КП {cp_number}",
                 'code': code,
                 'latitude': lat,
                 'longitude': lon,
                 'hint': hint
             })
-            self.store.put('checkpoints', items=checkpoints)
+            meta = race_data.setdefault('meta', {})
+            meta['version'] = meta.get('version', 0) + 1
+            self.catalog.save_race(self.race_id)
             
             popup.dismiss()
             # Обновляем интерфейс
-            self.clear_widgets()
-            self._build_ui()
+            self._rebuild()
         
         def cancel(instance):
             popup.dismiss()
         
+        def scan_code(instance):
+            """Считывание кода КП камерой"""
+            def on_scanned(data):
+                code_input.text = data.decode('utf-8', errors='replace')
+            QR_codes.open_scanner_popup(on_scanned, title='Сканирование кода КП')
+        
         save_btn = Button(
             text='Сохранить',
             size_hint_x=0.5,
@@ -679,10 +1024,14 @@ class AdminScreen(Screen):
         
         # Привязываем обработчики
         gps_btn.bind(on_press=get_gps_coords)
-        scan_btn.bind(on_press=lambda x: self._show_error('Сканирование QR будет реализовано позже'))
+        scan_btn.bind(on_press=scan_code)
         
         popup.open()
     
+    def on_leave(self, *args):
+        """Уход с экрана: ключ организатора удаляется из памяти"""
+        Cryptography.get_key_manager().invalidate(ADMIN_KEY_NAME)
+    
     def _on_back(self, instance):
         """Возврат на главный экран"""
         app = App.get_running_app()
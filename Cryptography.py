@@ -5,6 +5,1017 @@
 - Шифрования/расшифровки данных КП
 - Проверки целостности данных (HMAC)
 - Защиты от подделки результатов
+- Цепочки хешей взятых КП (доказательство, что отметки не правились задним числом)
+- Отдельного шифрования подсказки и задания каждого КП ключом из его кода
+- Управления ключами: медленный KDF один раз за сеанс, ключи в памяти
+- Проверки кодов КП без списка кодов (фильтр Блума)
+- Защиты от повторного приема результатов (окно номеров и недавние nonce)
+- Журнала действий только на дозапись с цепочкой хешей
 """
 
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import base64
+import hashlib
+import hmac
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import Storage
 
+# Подпись результатов: HMAC-SHA256, дописывается в конец данных
+SIGNATURE_SIZE = 32
+# Потоков для пакетной проверки подписей
+VERIFY_WORKERS = 4
+# Пул потоков используется для пакетов от этого объема и только при
+# крупных элементах: hashlib отпускает GIL лишь на данных от 2 КБ
+VERIFY_POOL_MIN_BYTES = 64 * 1024
+VERIFY_POOL_MIN_ITEM = 2048
+# Поля КП, которые участник видит только после сканирования кода КП
+CP_SECRET_FIELDS = ('hint', 'task')
+# Длина идентификатора зашифрованной записи КП и nonce AES-GCM (байт)
+CP_RECORD_ID_SIZE = 8
+NONCE_SIZE = 12
+# Стоимость KDF для PIN, паролей и кодов КП. scrypt: ~50 мс и 16 МБ памяти
+# на телефоне среднего уровня; PBKDF2 - для устройств без scrypt в OpenSSL
+KDF_SCRYPT_N = 2 ** 14
+KDF_SCRYPT_R = 8
+KDF_SCRYPT_P = 1
+KDF_PBKDF2_ITERATIONS = 200000
+# Доля случайных кодов, которые фильтр КП ошибочно примет за верные
+BLOOM_FALSE_POSITIVE_RATE = 0.001
+# Защита от повтора: ширина окна номеров сдач экипажа и число
+# запоминаемых nonce (отпечатков недавно принятых кодов)
+REPLAY_WINDOW = 64
+REPLAY_MAX_SEEN = 4096
+REPLAY_NONCE_SIZE = 8
+# Наибольший допустимый скачок номера сдачи: телефон участника делает
+# сдачи по одной, больший скачок - поддельный или испорченный номер
+REPLAY_MAX_JUMP = 1024
+# Журнал действий: сколько записей копится в памяти до записи на диск
+AUDIT_BATCH_SIZE = 64
+
+
+def sign_payload(key, data):
+    """
+    Подпись данных результатов
+
+    Args:
+        key: Ключ соревнования (bytes)
+        data: Данные (bytes)
+
+    Returns:
+        bytes: Данные с подписью в конце
+    """
+    return bytes(data) + hmac.new(key, data, hashlib.sha256).digest()
+
+
+def split_signed(signed):
+    """Разделение подписанных данных на (данные, подпись)"""
+    if len(signed) < SIGNATURE_SIZE:
+        raise ValueError('Нет подписи')
+    return bytes(signed[:-SIGNATURE_SIZE]), bytes(signed[-SIGNATURE_SIZE:])
+
+
+class ResultVerifier:
+    """
+    Проверка подписей результатов для одного соревнования
+
+    Внутреннее состояние HMAC (ключ, смешанный с ipad/opad) вычисляется
+    один раз при создании, и проверка каждой подписи начинается с его копии.
+    Пакет проверяется одним вызовом, при большом объеме - в пуле потоков.
+    """
+
+    def __init__(self, key, workers=VERIFY_WORKERS):
+        self._base = hmac.new(key, digestmod=hashlib.sha256)
+        self.workers = workers
+        self._pool = None
+
+    def verify(self, signed):
+        """
+        Проверка одной подписи
+
+        Args:
+            signed: Данные с подписью (результат sign_payload)
+
+        Returns:
+            bool: True, если подпись верна
+        """
+        if len(signed) < SIGNATURE_SIZE:
+            return False
+        mac = self._base.copy()
+        mac.update(memoryview(signed)[:-SIGNATURE_SIZE])
+        return hmac.compare_digest(mac.digest(), bytes(signed[-SIGNATURE_SIZE:]))
+
+    def verify_batch(self, items):
+        """
+        Проверка пакета подписей
+
+        Args:
+            items: Последовательность подписанных данных
+
+        Returns:
+            list: bool для каждого элемента в том же порядке
+        """
+        items = list(items)
+        total = sum(len(item) for item in items)
+        if (self.workers <= 1 or len(items) < 2 or total < VERIFY_POOL_MIN_BYTES
+                or total // len(items) < VERIFY_POOL_MIN_ITEM):
+            return [self.verify(item) for item in items]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='hmac-verify'
+            )
+        chunk = -(-len(items) // self.workers)
+        parts = [items[i:i + chunk] for i in range(0, len(items), chunk)]
+        results = []
+        for part in self._pool.map(lambda batch: [self.verify(item) for item in batch], parts):
+            results.extend(part)
+        return results
+
+    def close(self):
+        """Остановка пула потоков"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def _entry_bytes(entry):
+    """Каноническое представление записи цепочки"""
+    return json.dumps(
+        entry, ensure_ascii=False, sort_keys=True, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def crew_key(race_key, crew_id):
+    """
+    Ключ результатов экипажа: HMAC(ключ соревнования, номер экипажа)
+
+    Ключ соревнования есть только у организатора, участник получает ключ
+    своего экипажа в регистрационном QR. Подделать сдачу или подтверждение
+    другого экипажа с ним нельзя.
+    """
+    return hmac.new(race_key, b'fast-crew:' + str(crew_id).encode('utf-8'), hashlib.sha256).digest()
+
+
+def chain_genesis(key, crew_id):
+    """Начало цепочки экипажа (зависит от ключа соревнования и номера экипажа)"""
+    return hmac.new(key, b'fast-chain:' + str(crew_id).encode('utf-8'), hashlib.sha256).digest()
+
+
+def chain_step(key, head, entry):
+    """Следующая вершина цепочки: HMAC(ключ, вершина || SHA-256(запись))"""
+    entry_hash = hashlib.sha256(_entry_bytes(entry)).digest()
+    return hmac.new(key, head + entry_hash, hashlib.sha256).digest()
+
+
+def verify_chain_extension(key, base_head, entries, head):
+    """
+    Проверка продолжения цепочки без полной истории экипажа
+
+    Организатору достаточно вершины, принятой в прошлый раз
+    (или chain_genesis для первой сдачи).
+
+    Args:
+        key: Ключ соревнования
+        base_head: Вершина, от которой продолжается цепочка (bytes)
+        entries: Новые записи
+        head: Заявленная новая вершина (bytes)
+
+    Returns:
+        bool: True, если записи дают заявленную вершину
+    """
+    current = base_head
+    for entry in entries:
+        current = chain_step(key, current, entry)
+    return hmac.compare_digest(current, head)
+
+
+class CheckpointChain:
+    """
+    Цепочка хешей взятых КП экипажа
+
+    Каждое взятие КП продлевает цепочку за O(1): новая вершина зависит
+    от предыдущей и от записи, поэтому изменить или удалить старую
+    отметку без пересчета всех последующих нельзя. Для сдачи результатов
+    хранятся только записи после последней подтвержденной организатором
+    вершины - сдача несет эту вершину, новые записи и новую вершину.
+    """
+
+    def __init__(self, key, crew_id, state=None):
+        """
+        Args:
+            key: Ключ соревнования
+            crew_id: Номер экипажа
+            state: Сохраненное состояние (результат to_dict)
+        """
+        self.key = key
+        self.crew_id = crew_id
+        if state:
+            self.head = bytes.fromhex(state['head'])
+            self.length = state['length']
+            self.acked_head = bytes.fromhex(state['acked_head'])
+            self.acked_length = state['acked_length']
+            self.pending = list(state['pending'])
+        else:
+            self.head = chain_genesis(key, crew_id)
+            self.length = 0
+            self.acked_head = self.head
+            self.acked_length = 0
+            self.pending = []
+
+    def extend(self, entry):
+        """
+        Добавление записи (например, {'cp': 'КП 3', 'time': '12:01:02'})
+
+        Returns:
+            bytes: Новая вершина цепочки
+        """
+        self.head = chain_step(self.key, self.head, entry)
+        self.length += 1
+        self.pending.append(entry)
+        return self.head
+
+    def submission(self):
+        """
+        Данные для сдачи: только записи после подтвержденной вершины
+
+        Returns:
+            dict: {'crew', 'base', 'base_length', 'entries', 'head', 'length'}
+        """
+        return {
+            'crew': self.crew_id,
+            'base': self.acked_head.hex(),
+            'base_length': self.acked_length,
+            'entries': list(self.pending),
+            'head': self.head.hex(),
+            'length': self.length
+        }
+
+    def acknowledge(self, head):
+        """
+        Организатор принял сдачу с вершиной head
+
+        Записи до этой вершины больше не нужно передавать.
+        """
+        head = bytes.fromhex(head) if isinstance(head, str) else head
+        current = self.acked_head
+        for index, entry in enumerate(self.pending):
+            current = chain_step(self.key, current, entry)
+            if current == head:
+                self.acked_head = head
+                self.acked_length += index + 1
+                self.pending = self.pending[index + 1:]
+                return True
+        return False
+
+    def to_dict(self):
+        """Состояние для сохранения в хранилище"""
+        return {
+            'head': self.head.hex(),
+            'length': self.length,
+            'acked_head': self.acked_head.hex(),
+            'acked_length': self.acked_length,
+            'pending': list(self.pending)
+        }
+
+
+def verify_chain_submission(key, submission, accepted_head=None, accepted_length=0):
+    """
+    Проверка сдачи CheckpointChain.submission() организатором
+
+    Args:
+        key: Ключ соревнования
+        submission: Данные сдачи
+        accepted_head: Последняя принятая вершина экипажа (None - сдач не было)
+        accepted_length: Длина цепочки на момент этой вершины
+
+    Returns:
+        bool: True, если сдача продолжает принятую цепочку
+    """
+    if accepted_head is None:
+        accepted_head = chain_genesis(key, submission['crew'])
+    base = bytes.fromhex(submission['base'])
+    if base != accepted_head or submission['base_length'] != accepted_length:
+        return False
+    if submission['length'] != accepted_length + len(submission['entries']):
+        return False
+    return verify_chain_extension(
+        key, base, submission['entries'], bytes.fromhex(submission['head'])
+    )
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _normalize_code(code):
+    return str(code).strip().encode('utf-8')
+
+
+def kdf_params(kdf='scrypt', **params):
+    """
+    Полные параметры derive_key: заданные и значения по умолчанию
+
+    Сохраняются вместе с солью, чтобы изменение констант KDF_* в новой
+    версии приложения не меняло ключи, выведенные старой.
+    """
+    if kdf == 'scrypt':
+        result = {'n': KDF_SCRYPT_N, 'r': KDF_SCRYPT_R, 'p': KDF_SCRYPT_P}
+    elif kdf == 'pbkdf2':
+        result = {'iterations': KDF_PBKDF2_ITERATIONS}
+    else:
+        raise ValueError(f'Неизвестный KDF: {kdf}')
+    result['length'] = 32
+    result.update(params)
+    result['kdf'] = kdf
+    return result
+
+
+def cp_code_secret(salt, code, params=None):
+    """
+    Секрет кода КП - медленный KDF (derive_key) от кода и соли соревнования
+
+    Коды КП короткие (обычно 5 цифр), а соль передается участникам вместе
+    с записями КП. Быстрый HMAC от кода позволил бы перебрать все коды
+    за доли секунды; с scrypt каждая попытка стоит ~50 мс и 16 МБ, и
+    перебор 10^5 кодов занимает часы, а сканирование КП - одну попытку.
+
+    Args:
+        salt: Соль соревнования
+        code: Код КП
+        params: Параметры KDF (kdf_params; по умолчанию текущие)
+
+    Returns:
+        bytes: Секрет, из которого выводятся идентификатор и ключ записи
+    """
+    params = dict(params) if params else kdf_params()
+    return derive_key(_normalize_code(code), salt, **params)
+
+
+def cp_record_id(secret):
+    """Идентификатор зашифрованной записи КП (по нему не восстановить код)"""
+    digest = hmac.new(secret, b'cp-id', hashlib.sha256).digest()
+    return _b64encode(digest[:CP_RECORD_ID_SIZE])
+
+
+def cp_record_key(secret):
+    """Ключ AES-256 записи КП, выведенный из секрета кода (HKDF-SHA256)"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'fast-cp-record'
+    ).derive(secret)
+
+
+def cp_code_secrets(checkpoints, salt, params=None):
+    """Секреты кодов КП: {код: секрет} (KDF - один раз на код)"""
+    return {
+        cp['code']: cp_code_secret(salt, cp['code'], params)
+        for cp in checkpoints if cp.get('code')
+    }
+
+
+def encrypt_cp_records(checkpoints, salt=None, secrets=None):
+    """
+    Шифрование подсказок и заданий КП, каждого своим ключом
+
+    Args:
+        checkpoints: Список КП (с полями 'code' и, если есть, 'hint'/'task')
+        salt: Соль соревнования (по умолчанию случайная)
+        secrets: Готовые секреты кодов (cp_code_secrets с этой солью)
+
+    Returns:
+        dict: {'salt', 'kdf', 'records': {идентификатор: шифротекст}} -
+        раздел для передачи в данных соревнования
+    """
+    if salt is None:
+        salt = os.urandom(16)
+    params = kdf_params()
+    if secrets is None:
+        secrets = cp_code_secrets(checkpoints, salt, params)
+    records = {}
+    for cp in checkpoints:
+        code = cp.get('code')
+        if not code:
+            continue
+        secret = {field: cp[field] for field in CP_SECRET_FIELDS if cp.get(field)}
+        secret['name'] = cp['name']
+        record_id = cp_record_id(secrets[code])
+        nonce = os.urandom(NONCE_SIZE)
+        plaintext = json.dumps(secret, ensure_ascii=False).encode('utf-8')
+        ciphertext = AESGCM(cp_record_key(secrets[code])).encrypt(
+            nonce, plaintext, record_id.encode('ascii')
+        )
+        records[record_id] = _b64encode(nonce + ciphertext)
+    return {'salt': _b64encode(salt), 'kdf': params, 'records': records}
+
+
+def scanned_cp_secret(cp_secrets, code):
+    """Секрет отсканированного кода КП с солью и параметрами соревнования"""
+    return cp_code_secret(_b64decode(cp_secrets['salt']), code, cp_secrets.get('kdf'))
+
+
+def unlock_cp(cp_secrets, code, secret=None):
+    """
+    Расшифровка записи КП по отсканированному коду
+
+    Ищется и расшифровывается только одна запись - остальные КП
+    и данные соревнования не затрагиваются.
+
+    Args:
+        cp_secrets: Раздел из encrypt_cp_records
+        code: Отсканированный код КП
+        secret: Уже вычисленный scanned_cp_secret (чтобы не повторять KDF)
+
+    Returns:
+        dict: {'name', 'hint', 'task'} или None, если код не подходит
+    """
+    if secret is None:
+        secret = scanned_cp_secret(cp_secrets, code)
+    record_id = cp_record_id(secret)
+    record = cp_secrets['records'].get(record_id)
+    if record is None:
+        return None
+    data = _b64decode(record)
+    try:
+        plaintext = AESGCM(cp_record_key(secret)).decrypt(
+            data[:NONCE_SIZE], data[NONCE_SIZE:], record_id.encode('ascii')
+        )
+    except InvalidTag:
+        return None
+    return json.loads(plaintext)
+
+
+class CodeBloomFilter:
+    """
+    Фильтр Блума по секретам кодов КП (cp_code_secret)
+
+    Телефон участника отклоняет неверный код, не зная самих кодов:
+    фильтр на 40 КП при доле ложных срабатываний 0.1% занимает ~70 байт.
+    Позиции битов считаются от секрета кода, а не от кода: отдельного
+    ключа у фильтра нет, и проверить по нему любой код можно только
+    через медленный KDF - перебор кодов стоит столько же, сколько
+    перебор записей КП. Секрет вычисляется при сканировании один раз
+    и затем используется unlock_cp. Ложное срабатывание возможно,
+    окончательно код проверяет организатор (и unlock_cp - по записи КП).
+    """
+
+    def __init__(self, size_bits, hash_count, bits=None):
+        self.size_bits = max(8, size_bits)
+        self.hash_count = max(1, hash_count)
+        self.bits = bytearray(bits) if bits is not None else bytearray(-(-self.size_bits // 8))
+
+    @classmethod
+    def build(cls, secrets, fp_rate=BLOOM_FALSE_POSITIVE_RATE):
+        """
+        Фильтр под заданную долю ложных срабатываний
+
+        Args:
+            secrets: Секреты кодов КП (cp_code_secret)
+            fp_rate: Допустимая доля ложных срабатываний
+
+        Returns:
+            CodeBloomFilter: Заполненный фильтр
+        """
+        secrets = list(secrets)
+        count = max(1, len(secrets))
+        size_bits = math.ceil(-count * math.log(fp_rate) / math.log(2) ** 2)
+        # Простой размер: шаг двойного хеширования взаимно прост с ним,
+        # и k позиций не повторяются
+        while any(size_bits % d == 0 for d in range(2, math.isqrt(size_bits) + 1)):
+            size_bits += 1
+        hash_count = round(size_bits / count * math.log(2))
+        bloom = cls(size_bits, hash_count)
+        for secret in secrets:
+            bloom.add(secret)
+        return bloom
+
+    def _positions(self, secret):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного HMAC
+        digest = hmac.new(secret, b'cp-bloom', hashlib.sha256).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') % (self.size_bits - 1) + 1
+        return [(first + i * second) % self.size_bits for i in range(self.hash_count)]
+
+    def add(self, secret):
+        for position in self._positions(secret):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, secret):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(secret)
+        )
+
+    def to_dict(self):
+        """Представление для данных соревнования (без ключей и кодов)"""
+        return {
+            'm': self.size_bits,
+            'k': self.hash_count,
+            'bits': _b64encode(bytes(self.bits))
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['m'], data['k'], _b64decode(data['bits']))
+
+
+def race_for_participants(race_data, salt=None):
+    """
+    Данные соревнования для телефонов участников
+
+    Из КП убираются коды, подсказки и задания, вместо них добавляются
+    раздел 'cp_secrets' с отдельно зашифрованными записями КП и
+    'cp_filter' - фильтр Блума для проверки кодов при сканировании.
+
+    Args:
+        race_data: Данные соревнования организатора
+        salt: Соль соревнования (по умолчанию случайная)
+
+    Returns:
+        dict: Новый словарь (исходные данные не меняются)
+    """
+    if salt is None:
+        salt = os.urandom(16)
+    result = dict(race_data)
+    checkpoints = race_data.get('checkpoints', [])
+    # Медленный KDF - один раз на код: для записей и для фильтра
+    secrets = cp_code_secrets(checkpoints, salt)
+    result['cp_secrets'] = encrypt_cp_records(checkpoints, salt, secrets)
+    result['cp_filter'] = CodeBloomFilter.build(secrets.values()).to_dict()
+    hidden = ('code',) + CP_SECRET_FIELDS
+    result['checkpoints'] = [
+        {key: value for key, value in cp.items() if key not in hidden}
+        for cp in checkpoints
+    ]
+    return result
+
+
+def derive_key(secret, salt, kdf='scrypt', n=KDF_SCRYPT_N, r=KDF_SCRYPT_R,
+               p=KDF_SCRYPT_P, iterations=KDF_PBKDF2_ITERATIONS, length=32):
+    """
+    Вывод ключа из PIN или пароля медленным KDF
+
+    Args:
+        secret: PIN или пароль (str или bytes)
+        salt: Соль (bytes)
+        kdf: 'scrypt' или 'pbkdf2'
+        n, r, p: Параметры scrypt
+        iterations: Число итераций PBKDF2-SHA256
+        length: Длина ключа
+
+    Returns:
+        bytes: Ключ
+    """
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    if kdf == 'scrypt':
+        return hashlib.scrypt(
+            secret, salt=salt, n=n, r=r, p=p,
+            maxmem=128 * r * (n + p + 2), dklen=length
+        )
+    if kdf == 'pbkdf2':
+        return hashlib.pbkdf2_hmac('sha256', secret, salt, iterations, dklen=length)
+    raise ValueError(f'Неизвестный KDF: {kdf}')
+
+
+def make_secret_verifier(secret, kdf='scrypt', **params):
+    """
+    Проверочная запись для PIN или пароля (вместо хранения самого PIN)
+
+    Args:
+        secret: PIN или пароль
+        kdf: 'scrypt' или 'pbkdf2'
+        **params: Параметры derive_key (n, r, p, iterations)
+
+    Returns:
+        dict: {'kdf', 'salt', 'params', 'check'} - можно хранить в JsonStore;
+        'params' - все действующие параметры (kdf_params), а не только заданные
+    """
+    salt = os.urandom(16)
+    params = kdf_params(kdf, **params)
+    key = derive_key(secret, salt, **params)
+    return {
+        'kdf': kdf,
+        'salt': _b64encode(salt),
+        'params': params,
+        'check': _b64encode(hmac.new(key, b'fast-verifier', hashlib.sha256).digest())
+    }
+
+
+def verifier_params(verifier):
+    """
+    Параметры KDF проверочной записи
+
+    Записи прежних версий хранили только заданные параметры ({} для
+    значений по умолчанию) - недостающие берутся из текущих KDF_*.
+    """
+    return kdf_params(**{'kdf': verifier.get('kdf', 'scrypt'), **(verifier.get('params') or {})})
+
+
+class KeyManager:
+    """
+    Ключи текущего сеанса
+
+    Медленный KDF выполняется один раз при разблокировке (ввод PIN),
+    дальше ключ и выведенные из него ключи (HKDF, быстро) берутся из памяти.
+    Ключи живут до invalidate() - выхода из режима или закрытия приложения.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Имя -> главный ключ, (имя, назначение) -> выведенный ключ
+        self._keys = {}
+        self._subkeys = {}
+        self._verifiers = {}
+
+    def unlock(self, name, secret, verifier):
+        """
+        Проверка PIN/пароля и сохранение ключа на сеанс
+
+        Args:
+            name: Имя ключа (например, 'admin')
+            secret: Введенный PIN или пароль
+            verifier: Проверочная запись (make_secret_verifier)
+
+        Returns:
+            bool: True, если PIN верный
+        """
+        key = derive_key(secret, _b64decode(verifier['salt']), **verifier_params(verifier))
+        check = hmac.new(key, b'fast-verifier', hashlib.sha256).digest()
+        if not hmac.compare_digest(check, _b64decode(verifier['check'])):
+            return False
+        with self._lock:
+            self.invalidate(name)
+            self._keys[name] = key
+        return True
+
+    def set_key(self, name, key):
+        """Сохранение готового ключа (например, ключа соревнования из QR)"""
+        with self._lock:
+            self.invalidate(name)
+            self._keys[name] = bytes(key)
+
+    def is_unlocked(self, name):
+        with self._lock:
+            return name in self._keys
+
+    def get(self, name):
+        """Главный ключ (KeyError, если не разблокирован)"""
+        with self._lock:
+            return self._keys[name]
+
+    def subkey(self, name, purpose, length=32):
+        """
+        Ключ для отдельной задачи, выведенный из главного (HKDF-SHA256)
+
+        Args:
+            name: Имя главного ключа
+            purpose: Назначение, например 'race:<id>:storage'
+
+        Returns:
+            bytes: Ключ (вычисляется один раз за сеанс)
+        """
+        with self._lock:
+            cache_key = (name, purpose, length)
+            key = self._subkeys.get(cache_key)
+            if key is None:
+                key = HKDF(
+                    algorithm=hashes.SHA256(),
+                    length=length,
+                    salt=None,
+                    info=b'fast-subkey:' + purpose.encode('utf-8')
+                ).derive(self._keys[name])
+                self._subkeys[cache_key] = key
+            return key
+
+    def verifier(self, name, purpose):
+        """ResultVerifier на ключе subkey(name, purpose), общий на сеанс"""
+        with self._lock:
+            cache_key = (name, purpose)
+            verifier = self._verifiers.get(cache_key)
+            if verifier is None:
+                verifier = ResultVerifier(self.subkey(name, purpose))
+                self._verifiers[cache_key] = verifier
+            return verifier
+
+    def invalidate(self, name=None):
+        """
+        Удаление ключей из памяти
+
+        Args:
+            name: Имя ключа (None - все ключи сеанса)
+        """
+        with self._lock:
+            names = list(self._keys) if name is None else [name]
+            for key_name in names:
+                self._keys.pop(key_name, None)
+            for cache_key in [k for k in self._subkeys if k[0] in names]:
+                del self._subkeys[cache_key]
+            for cache_key in [k for k in self._verifiers if k[0] in names]:
+                self._verifiers.pop(cache_key).close()
+
+
+# Ключи сеанса, общие для всего приложения
+_key_manager = KeyManager()
+
+
+def get_key_manager():
+    """Общий KeyManager приложения"""
+    return _key_manager
+
+
+class ReplayGuard:
+    """
+    Защита от повторного приема результатов одного соревнования
+
+    Для каждого экипажа хранится наибольший принятый номер сдачи и битовая
+    маска REPLAY_WINDOW предыдущих номеров (как окно anti-replay в IPsec):
+    повтор или слишком старый номер отклоняется за O(1), а сдачи, пришедшие
+    не по порядку в пределах окна, принимаются. Дополнительно помнятся
+    отпечатки последних REPLAY_MAX_SEEN кодов - это ловит тот же QR,
+    показанный несколько раз подряд, еще до разбора номера.
+
+    Размер состояния ограничен: два числа на экипаж и фиксированное число
+    отпечатков. Файл состояния - RaceCatalog.sidecar_path(race_id, 'replay'),
+    он удаляется вместе с соревнованием, поэтому за сезон не накапливается.
+    """
+
+    def __init__(self, path=None, window=REPLAY_WINDOW, max_seen=REPLAY_MAX_SEEN,
+                 autosave=True, max_jump=REPLAY_MAX_JUMP):
+        """
+        Args:
+            path: Файл состояния (None - только в памяти)
+            window: Ширина окна номеров
+            max_seen: Сколько отпечатков кодов помнить
+            autosave: Записывать файл после каждого принятого кода
+            max_jump: Наибольший скачок номера сдачи
+        """
+        self.path = path
+        self.window = window
+        self.max_jump = max_jump
+        self.max_seen = max_seen
+        self.autosave = autosave
+        self._lock = threading.Lock()
+        # Экипаж -> [наибольший номер, маска номеров ниже него]
+        self._crews = {}
+        self._seen = OrderedDict()
+        if path:
+            Storage.recover(path)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as fd:
+                    data = fd.read()
+                if data:
+                    state = json.loads(data)
+                    self._crews = {crew: list(value) for crew, value in state['crews'].items()}
+                    self._seen = OrderedDict((bytes.fromhex(n), None) for n in state['seen'])
+
+    @staticmethod
+    def fingerprint(payload):
+        """Отпечаток кода (для данных без своего nonce)"""
+        return hashlib.sha256(payload).digest()[:REPLAY_NONCE_SIZE]
+
+    def accept(self, crew_id, sequence, nonce=None):
+        """
+        Проверка и запоминание сдачи
+
+        Args:
+            crew_id: Номер экипажа
+            sequence: Номер сдачи экипажа (растет с каждой сдачей)
+            nonce: Отпечаток или nonce кода (bytes, необязательно)
+
+        Returns:
+            bool: True, если сдача новая; False - повтор или неправдоподобный
+            номер (отрицательный или со скачком больше max_jump)
+        """
+        crew_id = str(crew_id)
+        if not isinstance(sequence, int) or sequence < 0:
+            return False
+        with self._lock:
+            if nonce is not None and nonce in self._seen:
+                self._seen.move_to_end(nonce)
+                return False
+            state = self._crews.get(crew_id)
+            top, mask = state if state is not None else (-1, 0)
+            if sequence - top > self.max_jump:
+                return False
+            if state is None:
+                state = self._crews[crew_id] = [top, mask]
+            if sequence > top:
+                shift = sequence - top
+                # Бит i маски - номер top - 1 - i. Сдвиг не больше окна,
+                # иначе маска из старых номеров целиком выходит за окно
+                if top < 0 or shift > self.window:
+                    mask = 0
+                else:
+                    mask = ((mask << shift) | (1 << (shift - 1))) & ((1 << self.window) - 1)
+                state[0], state[1] = sequence, mask
+            else:
+                offset = top - sequence - 1
+                if sequence == top or offset >= self.window or mask >> offset & 1:
+                    return False
+                state[1] = mask | (1 << offset)
+            if nonce is not None:
+                self._seen[nonce] = None
+                if len(self._seen) > self.max_seen:
+                    self._seen.popitem(last=False)
+            if self.autosave:
+                self._save()
+            return True
+
+    def forget_crew(self, crew_id):
+        """Сброс состояния экипажа (например, экипаж снят)"""
+        with self._lock:
+            self._crews.pop(str(crew_id), None)
+            if self.autosave:
+                self._save()
+
+    def save(self):
+        """Запись состояния на диск"""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        Storage.atomic_write(self.path, json.dumps({
+            'window': self.window,
+            'crews': self._crews,
+            'seen': [nonce.hex() for nonce in self._seen]
+        }))
+
+
+def _audit_hash(key, prev, body):
+    """Хеш записи журнала: зависит от предыдущего хеша и текста записи"""
+    if key is None:
+        return hashlib.sha256(prev + body).digest()
+    return hmac.new(key, prev + body, hashlib.sha256).digest()
+
+
+class AuditLog:
+    """
+    Журнал сканирований КП, отметок СКП и действий судей (только дозапись)
+
+    Каждая строка - "<хеш> <json>\n", где хеш считается от хеша предыдущей
+    строки и текста записи (HMAC, если задан ключ). Исправить, удалить
+    или переставить запись в середине нельзя без пересчета всех
+    последующих хешей, а с ключом - без ключа организатора.
+
+    Записи копятся в памяти и пишутся пачкой одним write и одним fsync
+    (каждые AUDIT_BATCH_SIZE записей или при flush()).
+    """
+
+    def __init__(self, path, key=None, batch_size=AUDIT_BATCH_SIZE):
+        self.path = path
+        self.key = key
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self.head = b'\0' * 32
+        self.count = 0
+        self._load_tail()
+
+    def _load_tail(self):
+        """Последний хеш файла; недописанная при сбое строка отрезается"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as fd:
+            data = fd.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                fd.truncate(end)
+                print(f"Журнал {self.path}: отрезана недописанная запись")
+        lines = data[:end].splitlines()
+        self.count = len(lines)
+        if lines:
+            self.head = bytes.fromhex(lines[-1][:64].decode('ascii'))
+
+    def record(self, action, **fields):
+        """
+        Добавление записи
+
+        Args:
+            action: Тип действия ('cp_scan', 'skp', 'stage_move', ...)
+            **fields: Данные действия (экипаж, КП, время, судья)
+
+        Returns:
+            str: Хеш записи (hex)
+        """
+        entry = {'action': action, 'time': datetime.now().isoformat(timespec='seconds')}
+        entry.update(fields)
+        body = json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self.head = _audit_hash(self.key, self.head, body)
+            self.count += 1
+            self._pending.append(self.head.hex().encode('ascii') + b' ' + body + b'\n')
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            return self.head.hex()
+
+    def flush(self):
+        """Запись накопленных записей на диск"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with open(self.path, 'ab') as fd:
+            fd.write(b''.join(self._pending))
+            fd.flush()
+            os.fsync(fd.fileno())
+        self._pending = []
+
+    def close(self):
+        self.flush()
+
+
+# Общие журналы: один экземпляр на файл, иначе хеши записей из разных
+# экземпляров не сложились бы в одну цепочку
+_audit_logs = {}
+_audit_lock = threading.Lock()
+
+
+def get_audit_log(path, key=None):
+    """
+    Общий журнал AuditLog для файла
+
+    Args:
+        path: Путь к журналу
+        key: Ключ HMAC журнала (используется при первом открытии)
+
+    Returns:
+        AuditLog: Журнал, общий для всего приложения
+    """
+    with _audit_lock:
+        log = _audit_logs.get(path)
+        if log is None:
+            log = _audit_logs[path] = AuditLog(path, key)
+        return log
+
+
+def flush_audit_logs():
+    """Запись накопленных записей всех открытых журналов"""
+    with _audit_lock:
+        logs = list(_audit_logs.values())
+    for log in logs:
+        try:
+            log.flush()
+        except OSError as e:
+            print(f"Ошибка записи {log.path}: {e}")
+
+
+def close_audit_logs():
+    """Закрытие всех журналов с записью оставшихся записей"""
+    with _audit_lock:
+        logs = list(_audit_logs.values())
+        _audit_logs.clear()
+    for log in logs:
+        try:
+            log.close()
+        except OSError as e:
+            print(f"Ошибка записи {log.path}: {e}")
+
+
+def verify_audit_log(path, key=None, expected_head=None):
+    """
+    Проверка журнала AuditLog за один проход по файлу
+
+    JSON записей не разбирается: хеш считается по байтам строки, поэтому
+    журнал дня в десятки тысяч записей проверяется за доли секунды.
+
+    Args:
+        path: Путь к журналу
+        key: Ключ, с которым журнал писался
+        expected_head: Известный последний хеш (hex) - ловит удаление
+                       записей с конца
+
+    Returns:
+        tuple: (ok, число проверенных записей, номер первой плохой строки или None)
+    """
+    prev = b'\0' * 32
+    count = 0
+    with open(path, 'rb') as fd:
+        for number, line in enumerate(fd, 1):
+            if not line.endswith(b'\n') or line[64:65] != b' ':
+                return False, count, number
+            prev = _audit_hash(key, prev, line[65:-1])
+            if prev.hex().encode('ascii') != line[:64]:
+                return False, count, number
+            count += 1
+    if expected_head is not None and prev.hex() != expected_head:
+        return False, count, None
+    return True, count, None
@@ -17,6 +17,10 @@ from kivy.core.window import Window
 from kivy.metrics import dp
 import os
 import Admin
+import Cryptography
+import Member
+import QR_codes
+import Storage
 
 # Версия приложения
 APP_VERSION = "1.0.0"
@@ -267,19 +271,56 @@ class MainScreen(Screen):
     
     def _on_submit_results(self):
         """Обработчик пункта меню 'Сдать результаты'"""
-        print("Сдача результатов...")
-        # TODO: Реализовать сдачу результатов
+        submitter = Member.load_submitter()
+        if submitter is None:
+            self._show_message('Сдача результатов', 'Экипаж не зарегистрирован: сдавать нечего')
+            return
+        QR_codes.open_qr_popup(
+            submitter.build_submission(),
+            title=f'Сдача результатов: новых записей {submitter.pending_count}'
+        )
     
     def _on_delete_race(self):
         """Обработчик пункта меню 'Удалить соревнование'"""
-        print("Удаление соревнования...")
-        # TODO: Реализовать удаление соревнования с подтверждением
+        catalog = Storage.get_race_catalog()
+        race_id = Member.member_race_id()
+        if race_id is None or not catalog.exists(race_id):
+            self._show_message('Удаление соревнования', 'Соревнование не загружено')
+            return
+        meta = catalog.get_meta(race_id)
+        Admin.show_confirm(
+            'Удалить соревнование',
+            f"Удалить соревнование «{meta.get('name', '')}» вместе с результатами экипажа?",
+            Member.delete_member_race
+        )
+    
+    def _show_message(self, title, message):
+        """Показ сообщения"""
+        label = Label(text=message, halign='center')
+        label.bind(size=label.setter('text_size'))
+        Popup(
+            title=title,
+            content=label,
+            size_hint=(0.8, 0.3),
+            auto_dismiss=True
+        ).open()
     
     def _on_scan_qr(self, instance):
         """Обработчик нажатия на кнопку сканирования QR-кода"""
-        # TODO: Реализовать открытие камеры для сканирования QR
-        print("Открытие камеры для сканирования QR-кода...")
-        # Здесь будет вызов функции из QR_codes.py
+        QR_codes.open_scanner_popup(self._on_qr_scanned)
+    
+    def _on_qr_scanned(self, data):
+        """
+        Обработчик считанного QR-кода: регистрация соревнования и экипажа,
+        взятие КП (код с листа КП) или подтверждение сдачи результатов
+        с экрана организатора
+        """
+        try:
+            message = Member.handle_scanned(data)
+        except (ValueError, KeyError) as e:
+            self._show_message('QR-код', f'QR-код не принят: {e}')
+            return
+        self._show_message('QR-код', message)
 
 
 class FastMemberApp(App):
@@ -302,6 +343,24 @@ class FastMemberApp(App):
         sm.current = 'main'
         
         return sm
+    
+    def on_pause(self):
+        """
+        Сохранение данных и журналов и закрытие админ-панели
+        при сворачивании приложения
+        """
+        Storage.flush_all()
+        Cryptography.flush_audit_logs()
+        Cryptography.get_key_manager().invalidate(Admin.ADMIN_KEY_NAME)
+        if self.root is not None and self.root.current == 'admin':
+            self.root.current = 'main'
+        return True
+    
+    def on_stop(self):
+        """Сохранение данных и журналов, удаление ключей сеанса при закрытии приложения"""
+        Storage.close_all()
+        Cryptography.close_audit_logs()
+        Cryptography.get_key_manager().invalidate()
 
 
 # Главная функция запуска
@@ -4,10 +4,712 @@
 Функционал:
 - Сканирование QR на регистрации (загрузка данных экипажа и КП)
 - Сканирование QR на контрольных пунктах
-- Отметка взятия КП
+- Отметка взятия КП (запись в цепочку результатов для сдачи)
 - Отображение заданий (если КП с заданием)
 - Просмотр взятых КП
 - Сдача результатов (генерация QR-кода)
+
+Сдача результатов идет частями: каждая сдача несет только взятия КП
+и события этапов после последней сдачи, принятой организатором,
+с номером сдачи и подписью HMAC ключом экипажа. Ключ экипажа выводится
+из ключа результатов соревнования (он есть только у организатора)
+и передается только в регистрационном QR этого экипажа.
+Каждая запись несет ключ идемпотентности 'id' - порядковый номер записи
+экипажа, то есть ее позицию в цепочке: организатор применяет запись,
+только если эта позиция у него еще не занята.
 """
 
+import base64
+import json
+import os
+from datetime import datetime
+import Cryptography
+import QR_codes
+import Storage
+
+# Ключи хранилища: загруженное соревнование (id в каталоге),
+# регистрация экипажа и состояние сдач
+MEMBER_RACE_KEY = 'member_race'
+CREW_STORE_KEY = 'crew'
+RESULTS_STORE_KEY = 'results'
+# Размер ключа результатов соревнования и ключа экипажа (байт)
+RESULTS_KEY_SIZE = 32
+
+
+def _now():
+    return datetime.now().strftime('%H:%M:%S')
+
+
+def _checked(value, required, what):
+    """
+    Проверка структуры данных из QR-кода: словарь с нужными ключами
+
+    Raises:
+        ValueError: Данные другой структуры (чужой или поддельный QR)
+    """
+    if not isinstance(value, dict) or any(key not in value for key in required):
+        raise ValueError(f'Неверный формат данных: {what}')
+    return value
+
+
+def _key_size(text):
+    """Длина ключа в hex-строке (None - не hex)"""
+    try:
+        return len(bytes.fromhex(text))
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultSubmitter:
+    """
+    Результаты экипажа на телефоне участника
+
+    Взятия КП и события этапов дописываются в CheckpointChain, поэтому
+    сдача содержит только записи после подтвержденной вершины цепочки
+    и остается маленькой при повторных сдачах на СКП и на финише.
+    """
+
+    def __init__(self, key, crew_id, store=None):
+        """
+        Args:
+            key: Ключ экипажа (bytes, из регистрационного QR)
+            crew_id: Номер экипажа
+            store: Хранилище состояния (по умолчанию app_data.json)
+        """
+        self.key = key
+        self.crew_id = crew_id
+        self.store = store if store is not None else Storage.get_store('app_data.json')
+        state = None
+        self.sequence = 0
+        if self.store.exists(RESULTS_STORE_KEY):
+            saved = self.store.get(RESULTS_STORE_KEY)
+            if saved.get('crew') == crew_id:
+                state = saved['chain']
+                self.sequence = saved['sequence']
+        self.chain = Cryptography.CheckpointChain(key, crew_id, state)
+
+    def _save(self):
+        self.store.put(
+            RESULTS_STORE_KEY,
+            crew=self.crew_id,
+            sequence=self.sequence,
+            chain=self.chain.to_dict()
+        )
+
+    def take_cp(self, cp_name, time=None):
+        """Отметка взятия КП"""
+        self.chain.extend({'id': self.chain.length + 1, 'cp': cp_name, 'time': time or _now()})
+        self._save()
+
+    def stage_event(self, stage, action, time=None):
+        """Событие этапа (старт, СКП, финиш)"""
+        self.chain.extend({
+            'id': self.chain.length + 1,
+            'stage': stage,
+            'action': action,
+            'time': time or _now()
+        })
+        self._save()
+
+    @property
+    def pending_count(self):
+        """Сколько записей еще не подтверждено организатором"""
+        return len(self.chain.pending)
+
+    def build_submission(self):
+        """
+        Подписанная сдача с записями после последней подтвержденной
+
+        Каждая сдача получает следующий номер (для защиты от повтора
+        на стороне организатора), даже если новых записей нет.
+
+        Returns:
+            bytes: Данные для QR-кода
+        """
+        self.sequence += 1
+        submission = self.chain.submission()
+        submission['seq'] = self.sequence
+        self._save()
+        return Cryptography.sign_payload(self.key, QR_codes.encode_payload(submission))
+
+    def acknowledge(self, head):
+        """
+        Организатор принял сдачу с вершиной head (из его QR-кода или вручную)
+
+        Returns:
+            bool: True, если вершина найдена среди неподтвержденных записей
+        """
+        if self.chain.acknowledge(head):
+            self._save()
+            return True
+        return False
+
+
+def load_submitter(store=None):
+    """
+    ResultSubmitter зарегистрированного экипажа
+
+    Returns:
+        ResultSubmitter или None, если экипаж еще не зарегистрирован
+        или организатор не выдал ключ результатов
+    """
+    store = store if store is not None else Storage.get_store('app_data.json')
+    if not store.exists(CREW_STORE_KEY):
+        return None
+    crew = store.get(CREW_STORE_KEY)
+    if not crew.get('results_key'):
+        return None
+    return ResultSubmitter(bytes.fromhex(crew['results_key']), crew['crew_id'], store)
+
+
+def member_race_id(store=None):
+    """Идентификатор соревнования участника в каталоге (None - не загружено)"""
+    store = store if store is not None else Storage.get_store('app_data.json')
+    if not store.exists(MEMBER_RACE_KEY):
+        return None
+    return store.get(MEMBER_RACE_KEY)['race_id']
+
+
+def register_scanned(data, store=None, catalog=None):
+    """
+    Обработка QR-кода, считанного на регистрации
+
+    Блок соревнования (encode_payload, обычно серией QR) сохраняется
+    в каталог вместе с исходными байтами - по ним строится RaceDictionary
+    для QR экипажа. QR экипажа (RaceDictionary.encode_crew) расшифровывается
+    словарем загруженного блока и сохраняется как регистрация.
+
+    Args:
+        data: Данные QR-кода или собранной серии (bytes)
+
+    Returns:
+        str: Сообщение для участника
+
+    Raises:
+        ValueError: Неизвестный QR-код или QR экипажа без загруженного
+                    соревнования
+    """
+    store = store if store is not None else Storage.get_store('app_data.json')
+    catalog = catalog if catalog is not None else Storage.get_race_catalog()
+    if not data:
+        raise ValueError('Пустой QR-код')
+
+    if data[0] == QR_codes.PAYLOAD_FORMAT:
+        race = _checked(QR_codes.decode_payload(data), ('meta',), 'соревнование')
+        _checked(race['meta'], (), 'параметры соревнования')
+        # Блок соревнования организатора прежних версий нес общий ключ
+        # результатов - участнику он не нужен
+        race['meta'].pop('results_key', None)
+        race_id = member_race_id(store)
+        if race_id is not None and catalog.exists(race_id):
+            catalog.save_race(race_id, race)
+        else:
+            race_id = catalog.add_race(race)
+        store.put(
+            MEMBER_RACE_KEY,
+            race_id=race_id,
+            race_block=base64.b64encode(bytes(data)).decode('ascii')
+        )
+        name = race['meta'].get('name', '')
+        return f'Загружено соревнование «{name}». Отсканируйте QR экипажа'
+
+    if data[0] == QR_codes.CREW_FORMAT:
+        if not store.exists(MEMBER_RACE_KEY):
+            raise ValueError('Сначала отсканируйте QR соревнования')
+        saved = store.get(MEMBER_RACE_KEY)
+        race_block = base64.b64decode(saved['race_block'])
+        crew = QR_codes.RaceDictionary.from_race_block(race_block).decode_crew(data)
+        _checked(crew, ('номер',), 'экипаж')
+        if not isinstance(crew['номер'], (str, int)) or isinstance(crew['номер'], bool):
+            raise ValueError('Неверный формат данных: номер экипажа')
+        results_key = crew.pop('results_key', None)
+        if _key_size(results_key) != RESULTS_KEY_SIZE:
+            raise ValueError('В QR экипажа нет ключа результатов')
+        store.put(
+            CREW_STORE_KEY,
+            crew_id=crew['номер'],
+            results_key=results_key,
+            data=crew
+        )
+        return f"Экипаж {crew['номер']} зарегистрирован"
+
+    raise ValueError('QR-код не относится к регистрации')
+
+
+def delete_member_race(store=None, catalog=None):
+    """
+    Удаление соревнования участника вместе с регистрацией и результатами
+
+    Файл соревнования удаляется через RaceCatalog.delete_race,
+    остальные соревнования каталога не затрагиваются.
+    """
+    store = store if store is not None else Storage.get_store('app_data.json')
+    catalog = catalog if catalog is not None else Storage.get_race_catalog()
+    race_id = member_race_id(store)
+    if race_id is not None and catalog.exists(race_id):
+        catalog.delete_race(race_id)
+    for key in (MEMBER_RACE_KEY, CREW_STORE_KEY, RESULTS_STORE_KEY):
+        if store.exists(key):
+            store.delete(key)
+
+
+class ReplayRejected(ValueError):
+    """
+    Сдача с верной подписью и цепочкой отклонена защитой от повтора:
+    ее номер уже использован, вышел за окно или неправдоподобно велик
+    (например, телефон участника начал нумерацию сдач заново)
+    """
+
+
+class ResultLedger:
+    """
+    Принятые результаты соревнования на телефоне организатора
+
+    Сдачи и подтверждения подписываются ключом экипажа (crew_key от ключа
+    соревнования), поэтому участник не может подписать сдачу другого
+    экипажа. Для каждого экипажа хранятся принятые записи и вершины цепочки
+    после каждой из них (entries[i] и heads[i + 1] всегда дописываются
+    вместе). Сдача объединяется идемпотентно по позиции в цепочке: записи
+    на уже занятых позициях (та же сдача, отсканированная повторно, или
+    сдача, перекрывающаяся с предыдущей из-за неполученного подтверждения)
+    только сверяются с вершинами, новые - дописываются.
+    """
+
+    def __init__(self, key, replay_guard=None, path=None, audit=None):
+        """
+        Args:
+            key: Ключ результатов соревнования (race_results_key)
+            replay_guard: Cryptography.ReplayGuard (необязательно)
+            path: Файл принятых записей (None - только в памяти), обычно
+                  RaceCatalog.sidecar_path(race_id, 'results')
+            audit: Cryptography.AuditLog для принятых взятий КП и событий
+                   этапов (необязательно)
+        """
+        self.key = key
+        self.replay_guard = replay_guard
+        self.path = path
+        self.audit = audit
+        # Во время ingest_many файлы пишутся один раз в конце пачки
+        self._deferred = False
+        # Экипаж -> {'key': ключ экипажа, 'verifier': ResultVerifier,
+        #            'entries': [...], 'heads': [вершина после 0, 1, ... записей]}
+        self.crews = {}
+        if path:
+            self._load()
+
+    def _crew(self, crew_id):
+        crew_id = str(crew_id)
+        crew = self.crews.get(crew_id)
+        if crew is None:
+            key = Cryptography.crew_key(self.key, crew_id)
+            crew = self.crews[crew_id] = {
+                'key': key,
+                'verifier': None,
+                'entries': [],
+                'heads': [Cryptography.chain_genesis(key, crew_id)]
+            }
+        return crew
+
+    def _verifier(self, crew_id):
+        """ResultVerifier на ключе экипажа (создается при первой сдаче)"""
+        crew = self._crew(crew_id)
+        if crew['verifier'] is None:
+            crew['verifier'] = Cryptography.ResultVerifier(crew['key'])
+        return crew['verifier']
+
+    def _load(self):
+        """
+        Загрузка принятых записей
+
+        Хранятся только записи, вершины пересчитываются по ним - так файл
+        заодно проверяется: запись, измененная вне приложения, меняет
+        вершины, и следующая сдача экипажа не сойдется с принятыми.
+        """
+        Storage.recover(self.path)
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as fd:
+            data = fd.read()
+        if not data:
+            return
+        for crew_id, entries in json.loads(data)['crews'].items():
+            crew = self._crew(crew_id)
+            head = crew['heads'][-1]
+            for entry in entries:
+                head = Cryptography.chain_step(crew['key'], head, entry)
+                crew['heads'].append(head)
+                crew['entries'].append(entry)
+
+    def save(self):
+        """
+        Запись принятых записей на диск (атомарно)
+
+        Журнал сбрасывается первым: принятая запись не может оказаться
+        на диске без своей строки в журнале.
+        """
+        if self.audit is not None:
+            self.audit.flush()
+        if not self.path:
+            return
+        Storage.atomic_write(self.path, json.dumps({
+            'crews': {
+                crew_id: crew['entries']
+                for crew_id, crew in self.crews.items() if crew['entries']
+            }
+        }, ensure_ascii=False))
+
+    def ingest(self, signed):
+        """
+        Прием сдачи
+
+        Повторно отсканированная сдача ничего не меняет: ее записи уже
+        приняты, что видно по сверке с принятыми вершинами (0 новых записей).
+
+        Args:
+            signed: Данные из QR-кода (результат build_submission)
+
+        Returns:
+            tuple: (номер экипажа, число новых записей, вершина для подтверждения)
+
+        Raises:
+            ReplayRejected: Новые записи с уже использованным или
+                            неправдоподобным номером сдачи
+            ValueError: Сдача повреждена, подпись неверна (в том числе
+                        ключом другого экипажа) или сдача не продолжает
+                        принятую цепочку
+        """
+        submission = self._decode(signed)
+        if not self._verifier(submission['crew']).verify(signed):
+            raise ValueError('Неверная подпись результатов')
+        return self._ingest_verified(signed, submission)
+
+    @staticmethod
+    def _decode(signed):
+        """
+        Данные сдачи до проверки подписи (нужен номер экипажа - по нему
+        выбирается ключ), поэтому структура проверяется полностью
+        """
+        payload, _ = Cryptography.split_signed(signed)
+        submission = _checked(
+            QR_codes.decode_payload(payload),
+            ('crew', 'base', 'base_length', 'entries', 'head', 'length', 'seq'),
+            'сдача'
+        )
+        numbers = (submission['base_length'], submission['length'], submission['seq'])
+        if (not isinstance(submission['crew'], (str, int))
+                or isinstance(submission['crew'], bool)
+                or not all(isinstance(n, int) and not isinstance(n, bool) and n >= 0
+                           for n in numbers)
+                or not isinstance(submission['base'], str)
+                or not isinstance(submission['head'], str)
+                or not isinstance(submission['entries'], list)
+                or not all(isinstance(entry, dict) for entry in submission['entries'])):
+            raise ValueError('Неверный формат данных: сдача')
+        return submission
+
+    def _ingest_verified(self, signed, submission):
+        """Прием сдачи с уже проверенной подписью"""
+        crew_id = str(submission['crew'])
+        crew = self._crew(crew_id)
+        heads = crew['heads']
+        position = submission['base_length']
+        entries = submission['entries']
+        length = submission['length']
+        if (position >= len(heads) or heads[position].hex() != submission['base']
+                or length != position + len(entries)):
+            raise ValueError(f'Экипаж {crew_id}: сдача не продолжает принятые результаты')
+        if length < len(heads):
+            # Все записи уже приняты - достаточно сверить вершину, O(1)
+            if heads[length].hex() != submission['head']:
+                raise ValueError(f'Экипаж {crew_id}: сдача расходится с принятыми результатами')
+            return crew_id, 0, heads[-1].hex()
+
+        # Уже принятые записи пропускаются без хеширования: цепочка
+        # продолжается от принятой вершины, и совпадение заявленной
+        # вершины подтверждает всю сдачу. Данные меняются только после проверки
+        known = len(heads) - 1
+        current = heads[known]
+        computed = []
+        for entry in entries[known - position:]:
+            current = Cryptography.chain_step(crew['key'], current, entry)
+            computed.append(current)
+        if current.hex() != submission['head']:
+            raise ValueError(f'Экипаж {crew_id}: вершина цепочки не сходится')
+
+        # Номер сдачи учитывается только у сдачи, прошедшей проверку,
+        # иначе неверная сдача заняла бы номер следующей настоящей.
+        # Повторно отсканированная сдача сюда не доходит (ее записи уже
+        # приняты), поэтому отказ здесь - не дубликат, а отдельный случай
+        if self.replay_guard is not None and not self.replay_guard.accept(
+                crew_id, submission['seq'],
+                Cryptography.ReplayGuard.fingerprint(signed)):
+            if self.audit is not None:
+                self.audit.record('replay_rejected', crew=crew_id, seq=submission['seq'],
+                                  base_length=position, length=length)
+                if not self._deferred:
+                    self.audit.flush()
+            raise ReplayRejected(
+                f"Экипаж {crew_id}: сдача №{submission['seq']} отклонена защитой от "
+                f"повтора (номер уже использован или неправдоподобен)"
+            )
+
+        new_entries = entries[known - position:]
+        if self.audit is not None:
+            self._record(crew_id, known, new_entries)
+        heads.extend(computed)
+        crew['entries'].extend(new_entries)
+        if not self._deferred:
+            self.save()
+        return crew_id, len(new_entries), heads[-1].hex()
+
+    def _record(self, crew_id, known, entries):
+        """Строки журнала для принятых записей (позиция - номер в цепочке)"""
+        for position, entry in enumerate(entries, known + 1):
+            if 'cp' in entry:
+                self.audit.record('cp_scan', crew=crew_id, position=position,
+                                  cp=entry['cp'], at=entry.get('time'))
+            else:
+                action = entry.get('action', '')
+                self.audit.record('skp' if 'skp' in action else 'stage_move',
+                                  crew=crew_id, position=position, stage=entry.get('stage'),
+                                  event=action, at=entry.get('time'))
+
+    def ingest_many(self, submissions):
+        """
+        Прием пачки сдач (например, повторный импорт всех сдач соревнования)
+
+        Подписи проверяются вызовом verify_batch на экипаж, повторы и уже
+        принятые записи пропускаются за O(1), а файл результатов, состояние
+        replay_guard и журнал пишутся один раз на пачку, а не после каждой
+        сдачи, поэтому время линейно по числу сдач. Сдачи применяются по порядку позиций в цепочке
+        экипажа (base_length), а не в порядке на входе: более поздняя
+        сдача, пришедшая раньше предыдущей, не отклоняется.
+
+        Returns:
+            list: (номер экипажа, число новых записей, вершина) или
+            исключение ValueError для каждой сдачи, в порядке на входе
+        """
+        submissions = list(submissions)
+        results = [None] * len(submissions)
+        by_crew = {}
+        for index, signed in enumerate(submissions):
+            try:
+                submission = self._decode(signed)
+            except ValueError as e:
+                results[index] = ValueError(f'Поврежденная сдача: {e}')
+                continue
+            by_crew.setdefault(str(submission['crew']), []).append((index, submission))
+        decoded = []
+        for crew_id, items in by_crew.items():
+            valid = self._verifier(crew_id).verify_batch(submissions[index] for index, _ in items)
+            for (index, submission), ok in zip(items, valid):
+                if not ok:
+                    results[index] = ValueError('Неверная подпись результатов')
+                    continue
+                order = (crew_id, submission['base_length'], submission['length'])
+                decoded.append((order, index, submission))
+        decoded.sort(key=lambda item: item[:2])
+        guard_autosave = self.replay_guard is not None and self.replay_guard.autosave
+        if guard_autosave:
+            self.replay_guard.autosave = False
+        self._deferred = True
+        try:
+            for _, index, submission in decoded:
+                try:
+                    results[index] = self._ingest_verified(submissions[index], submission)
+                except ValueError as e:
+                    results[index] = e
+        finally:
+            self._deferred = False
+            if guard_autosave:
+                self.replay_guard.autosave = True
+                self.replay_guard.save()
+            self.save()
+        return results
+
+    def results(self, crew_id):
+        """Принятые записи экипажа"""
+        return list(self._crew(crew_id)['entries'])
+
+    def build_ack(self, crew_id):
+        """
+        Подтверждение для телефона участника: подписанная вершина
+        принятой цепочки экипажа (показывается QR-кодом после приема)
+
+        Returns:
+            bytes: Данные для QR-кода
+        """
+        crew = self._crew(crew_id)
+        ack = {'crew': str(crew_id), 'ack': crew['heads'][-1].hex()}
+        return Cryptography.sign_payload(crew['key'], QR_codes.encode_payload(ack))
+
+
+def race_results_key(catalog, race_id):
+    """
+    Ключ результатов соревнования - только на телефоне организатора
+
+    Хранится в служебном файле соревнования, а не в meta: meta уходит
+    всем участникам в блоке соревнования. Участник получает только ключ
+    своего экипажа (crew_registration_qr). Ключ в meta прежних версий
+    видели все участники, поэтому он удаляется, а не переносится.
+    """
+    path = catalog.sidecar_path(race_id, 'results_key')
+    Storage.recover(path)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as fd:
+            data = fd.read()
+        if data:
+            return bytes.fromhex(json.loads(data)['key'])
+    race_data = catalog.open_race(race_id)
+    if race_data.get('meta', {}).pop('results_key', None):
+        catalog.save_race(race_id)
+    key = os.urandom(RESULTS_KEY_SIZE)
+    Storage.atomic_write(path, json.dumps({'key': key.hex()}))
+    return key
+
+
+def registration_dictionary(catalog, race_id):
+    """
+    RaceDictionary для регистрационных QR соревнования организатора
+
+    Блок соревнования (dictionary.race_block) одинаков для всех экипажей
+    и не содержит ключей результатов.
+    """
+    race_data = catalog.open_race(race_id)
+    meta = {key: value for key, value in race_data.get('meta', {}).items()
+            if key != 'results_key'}
+    return QR_codes.RaceDictionary(dict(race_data, meta=meta))
+
+
+def crew_registration_qr(catalog, race_id, dictionary, crew):
+    """
+    Регистрационный QR экипажа с ключом результатов этого экипажа
+
+    Args:
+        dictionary: registration_dictionary соревнования
+        crew: Данные экипажа (элемент members)
+
+    Returns:
+        bytes: Данные для QR-кода
+    """
+    key = Cryptography.crew_key(race_results_key(catalog, race_id), crew['номер'])
+    return dictionary.encode_crew(dict(crew, results_key=key.hex()))
+
+
+def open_ledger(catalog, race_id, audit_key=None):
+    """
+    ResultLedger соревнования организатора с состоянием и журналом
+    в служебных файлах каталога (удаляются вместе с соревнованием)
+
+    Args:
+        audit_key: Ключ HMAC журнала (например, подключ ключа организатора)
+    """
+    return ResultLedger(
+        race_results_key(catalog, race_id),
+        Cryptography.ReplayGuard(catalog.sidecar_path(race_id, 'replay')),
+        catalog.sidecar_path(race_id, 'results'),
+        Cryptography.get_audit_log(catalog.sidecar_path(race_id, 'audit'), audit_key)
+    )
+
+
+def apply_ack(data, store=None):
+    """
+    Подтверждение организатора, считанное с его экрана
+
+    Returns:
+        int или None: Сколько записей осталось неподтвержденными;
+        None - это не подтверждение для этого экипажа
+
+    Raises:
+        ValueError: Подтверждение не совпадает с записями экипажа
+    """
+    submitter = load_submitter(store)
+    if submitter is None or not Cryptography.ResultVerifier(submitter.key).verify(data):
+        return None
+    payload, _ = Cryptography.split_signed(data)
+    ack = QR_codes.decode_payload(payload)
+    if (not isinstance(ack, dict) or not isinstance(ack.get('ack'), str)
+            or ack.get('crew') != str(submitter.crew_id)):
+        return None
+    if not submitter.acknowledge(ack['ack']) and submitter.chain.acked_head.hex() != ack['ack']:
+        raise ValueError('Подтверждение не относится к сданным результатам')
+    return submitter.pending_count
+
+
+def find_checkpoint(race_data, code):
+    """
+    КП соревнования по отсканированному коду
+
+    Для данных из Cryptography.race_for_participants код проверяется
+    фильтром КП и расшифровывает запись КП (один медленный KDF),
+    иначе сравнивается с содержимым QR-кода КП (код или название).
+
+    Returns:
+        dict: {'name', ...} или None, если код не относится к КП
+    """
+    cp_secrets = race_data.get('cp_secrets')
+    if cp_secrets:
+        secret = Cryptography.scanned_cp_secret(cp_secrets, code)
+        cp_filter = race_data.get('cp_filter')
+        if cp_filter and secret not in Cryptography.CodeBloomFilter.from_dict(cp_filter):
+            return None
+        return Cryptography.unlock_cp(cp_secrets, code, secret)
+    for cp in race_data.get('checkpoints', []):
+        if isinstance(cp, dict) and cp.get('name') and QR_codes.cp_qr_content(cp) == code:
+            return cp
+    return None
+
+
+def take_scanned_cp(data, store=None, catalog=None):
+    """
+    Взятие КП по QR-коду с листа КП: запись в цепочку результатов экипажа
+
+    Returns:
+        str или None: Сообщение для участника (с подсказкой и заданием КП);
+        None - код не относится к КП загруженного соревнования
+    """
+    store = store if store is not None else Storage.get_store('app_data.json')
+    catalog = catalog if catalog is not None else Storage.get_race_catalog()
+    try:
+        code = bytes(data).decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return None
+    race_id = member_race_id(store)
+    if not code or race_id is None or not catalog.exists(race_id):
+        return None
+    cp = find_checkpoint(catalog.open_race(race_id), code)
+    if cp is None:
+        return None
+    submitter = load_submitter(store)
+    if submitter is None:
+        raise ValueError('Сначала отсканируйте QR экипажа')
+    submitter.take_cp(cp['name'])
+    lines = [f"Взят {cp['name']}"]
+    for field, title in (('hint', 'Подсказка'), ('task', 'Задание')):
+        if cp.get(field):
+            lines.append(f'{title}: {cp[field]}')
+    return '\n'.join(lines)
+
+
+def handle_scanned(data, store=None, catalog=None):
+    """
+    QR-код, считанный участником: подтверждение сдачи, код КП
+    или регистрация
+
+    Returns:
+        str: Сообщение для участника
 
+    Raises:
+        ValueError: QR-код не принят (неизвестный, поврежденный или
+                    с данными неверной структуры)
+    """
+    pending = apply_ack(data, store)
+    if pending is not None:
+        if pending:
+            return f'Результаты приняты. Не сдано записей: {pending}'
+        return 'Результаты приняты полностью'
+    if data and data[0] not in (QR_codes.PAYLOAD_FORMAT, QR_codes.CREW_FORMAT):
+        message = take_scanned_cp(data, store, catalog)
+        if message is not None:
+            return message
+    return register_scanned(data, store, catalog)
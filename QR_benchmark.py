@@ -0,0 +1,444 @@
+"""
+Замер производительности сканирования QR-кодов
+
+Прогоняет через конвейер декодирования QR_codes.py последовательности
+кадров - записанные (каталог с картинками) или синтетические
+(разный размер кода, наклон, размытие и освещение) - и выводит:
+- кадров в секунду
+- время до первого успешного считывания
+- долю кадров, в которых код считан верно
+- для анимированной серии - время до полной сборки данных
+
+Синтетические кадры строятся для трех видов содержимого: короткий
+текст кода КП, двоичный блок соревнования (encode_payload) и серия
+кадров FountainEncoder, которую приложение показывает для больших данных.
+
+Режим --check проверяет, что данные приложения (текст КП, блок
+соревнования, QR экипажа, кадры серии) проходят QR туда и обратно через
+каждый доступный декодер без искажений.
+
+Работает без камеры и без окна (подходит для Linux-сервера):
+    python QR_benchmark.py
+    python QR_benchmark.py --check --race race_v297.json
+    python QR_benchmark.py --fixtures recorded/ --expect "КП 12"
+    python QR_benchmark.py --mode pipeline --fps 30 --json
+    python QR_benchmark.py --content fountain --race race_v297.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import QR_codes
+
+# Сценарии синтетических кадров: (название, размер модуля, угол, размытие, яркость)
+SCENARIOS = [
+    ('крупный', 8, 0, 0, 1.0),
+    ('мелкий', 3, 0, 0, 1.0),
+    ('наклон 20°', 6, 20, 0, 1.0),
+    ('наклон 45°', 6, 45, 0, 1.0),
+    ('размытие', 6, 0, 5, 1.0),
+    ('сумерки', 6, 0, 0, 0.35),
+    ('блик', 6, 0, 0, 1.8),
+    ('наклон + размытие + сумерки', 5, 15, 3, 0.5),
+]
+
+FRAME_SIZE = (1280, 720)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def synthetic_frames(payload, count, module_px, angle, blur, brightness,
+                     frame_size=FRAME_SIZE, seed=0):
+    """
+    Синтетические кадры камеры с QR-кодом
+
+    Код немного смещается от кадра к кадру (дрожание рук),
+    на кадр накладывается шум сенсора.
+
+    Args:
+        payload: Содержимое кода или список содержимого по кадрам
+                 (кадры анимированной серии, повторяются по кругу)
+        count: Число кадров
+        module_px: Размер модуля QR в пикселях
+        angle: Наклон кода в градусах
+        blur: Размер ядра размытия по Гауссу (0 - без размытия)
+        brightness: Множитель яркости (<1 - темнее, >1 - пересвет)
+        frame_size: (ширина, высота) кадра
+        seed: Начальное значение генератора шума
+
+    Returns:
+        list: Кадры BGR (numpy)
+    """
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    payloads = payload if isinstance(payload, list) else [payload]
+    codes = [
+        np.kron(QR_codes.qr_matrix(item), np.ones((module_px, module_px), dtype=np.uint8))
+        for item in payloads
+    ]
+    width, height = frame_size
+
+    frames = []
+    for index in range(count):
+        code = codes[index % len(codes)]
+        side = code.shape[0]
+        frame = np.full((height, width), 170, dtype=np.uint8)
+        jitter_x, jitter_y = rng.integers(-20, 21, size=2)
+        x = max(0, min(width - side, (width - side) // 2 + int(jitter_x)))
+        y = max(0, min(height - side, (height - side) // 2 + int(jitter_y)))
+        frame[y:y + side, x:x + side] = code
+
+        if angle:
+            center = (x + side / 2, y + side / 2)
+            rotation = cv2.getRotationMatrix2D(center, angle + index % 3, 1.0)
+            frame = cv2.warpAffine(frame, rotation, (width, height), borderValue=170)
+        if blur:
+            kernel = blur | 1
+            frame = cv2.GaussianBlur(frame, (kernel, kernel), 0)
+
+        noisy = frame.astype(np.float32) * brightness + rng.normal(0, 6, frame.shape)
+        frame = np.clip(noisy, 0, 255).astype(np.uint8)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    return frames
+
+
+def load_fixture_frames(folder):
+    """Записанные кадры из каталога (по имени файла)"""
+    import cv2
+
+    names = sorted(
+        name for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    frames = []
+    for name in names:
+        frame = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+        if frame is not None:
+            frames.append(frame)
+    return frames
+
+
+class ReplaySource:
+    """
+    Источник кадров для QRScanner из заранее подготовленного списка
+
+    При заданном fps кадры отдаются с частотой камеры, иначе - сразу.
+    """
+
+    def __init__(self, frames, fps=None):
+        self.frames = frames
+        self.interval = 1.0 / fps if fps else 0.0
+        self.exhausted = False
+        self._index = 0
+        self._next_time = None
+
+    def read(self):
+        if self._index >= len(self.frames):
+            self.exhausted = True
+            return None
+        if self.interval:
+            now = time.perf_counter()
+            if self._next_time is None:
+                self._next_time = now
+            delay = self._next_time - now
+            if delay > 0:
+                time.sleep(delay)
+            self._next_time += self.interval
+        frame = self.frames[self._index]
+        self._index += 1
+        return frame
+
+    def close(self):
+        pass
+
+
+class ScanCounter:
+    """
+    Подсчет верных считываний
+
+    expected - ожидаемые данные (bytes) или множество допустимых данных
+    (кадры серии). Для серии считанные кадры собираются FountainDecoder,
+    и запоминается время полной сборки.
+    """
+
+    def __init__(self, expected, fountain=False):
+        self.expected = expected if isinstance(expected, (set, frozenset)) else {expected}
+        self.fountain = QR_codes.FountainDecoder() if fountain else None
+        self.successes = 0
+        self.first_decode = None
+        self.assembled = None
+        self.start = time.perf_counter()
+
+    def add(self, detections):
+        matched = [d.data for d in detections if d.data in self.expected]
+        if not matched:
+            return
+        now = time.perf_counter() - self.start
+        self.successes += 1
+        if self.first_decode is None:
+            self.first_decode = now
+        if self.fountain is not None and self.assembled is None:
+            if any(self.fountain.add_frame(data) for data in matched):
+                self.assembled = now
+
+    def result(self, frames, decoded, elapsed):
+        result = {
+            'frames': frames,
+            'fps': decoded / elapsed if elapsed else 0.0,
+            'first_decode': self.first_decode,
+            'success_rate': self.successes / decoded if decoded else 0.0,
+        }
+        if self.fountain is not None:
+            result['assembled'] = self.assembled
+        return result
+
+
+def run_direct(frames, expected, decoder, fountain=False):
+    """
+    Декодирование кадров подряд в текущем потоке
+
+    Returns:
+        dict: fps, время до первого считывания (сек), доля успешных кадров,
+        для серии - время сборки данных
+    """
+    counter = ScanCounter(expected, fountain)
+    for frame in frames:
+        counter.add(decoder(frame))
+    elapsed = time.perf_counter() - counter.start
+    return counter.result(len(frames), len(frames), elapsed)
+
+
+def run_pipeline(frames, expected, decoder, fps, fountain=False):
+    """
+    Прогон через многопоточный QRScanner с подачей кадров с частотой камеры
+
+    Returns:
+        dict: fps декодера, время до первого считывания, доля успешных
+        декодированных кадров и число отброшенных кадров
+    """
+    counter = ScanCounter(expected, fountain)
+
+    def counting_decoder(frame):
+        detections = decoder(frame)
+        counter.add(detections)
+        return detections
+
+    scanner = QR_codes.QRScanner(
+        lambda detection: None,
+        source=ReplaySource(frames, fps),
+        decoder=counting_decoder,
+        post=None,
+        debounce=False
+    )
+    scanner.start()
+    scanner.join()
+    elapsed = time.perf_counter() - counter.start
+    scanner.stop()
+
+    result = counter.result(len(frames), scanner.frames_decoded, elapsed)
+    result['dropped'] = scanner.frames_dropped
+    return result
+
+
+def sample_race(crews=60, seed=1):
+    """
+    Синтетическое соревнование для замеров без файла соревнования
+
+    Экипажей достаточно, чтобы полные данные не помещались в один
+    экранный QR и передавались серией.
+    """
+    rng = random.Random(seed)
+    surnames = ['Иванов', 'Петров', 'Сидоров', 'Кузнецов', 'Смирнов', 'Попов']
+    cars = ['Kia Rio', 'Lada Niva', 'УАЗ Патриот', 'Renault Duster']
+    return {
+        'meta': {'name': 'Проверка', 'date': '01-01-2025', 'version': 1},
+        'checkpoints': [
+            {'name': f'КП {i}', 'score': i % 5 + 1, 'code': f'{i:04}'} for i in range(1, 41)
+        ],
+        'members': [
+            {
+                'номер': str(number),
+                'пилот': f'{rng.choice(surnames)} {rng.choice("АБВГДЕЖЗ")}.',
+                'штурман': f'{rng.choice(surnames)} {rng.choice("АБВГДЕЖЗ")}.',
+                'авто': rng.choice(cars),
+                'гос.номер': f'А{rng.randint(100, 999)}ВС{rng.randint(10, 199)}',
+                'контактный_телефон_пилота': f'+7925{rng.randint(1000000, 9999999)}',
+                'зачет': rng.choice(['Спорт', 'Туризм']),
+            }
+            for number in range(1, crews + 1)
+        ],
+    }
+
+
+def content_payloads(text, race_data, frames):
+    """
+    Содержимое синтетических кадров по видам
+
+    Returns:
+        dict: вид -> (содержимое для synthetic_frames, ожидаемые данные,
+        True для серии)
+    """
+    race = {key: value for key, value in race_data.items() if key != 'members'}
+    race_block = QR_codes.encode_payload(race)
+    encoder = QR_codes.FountainEncoder(QR_codes.encode_payload(race_data))
+    series = [encoder.frame(seed) for seed in range(frames)]
+    expected_text = text.encode('utf-8')
+    return {
+        'text': (text, expected_text, False),
+        'race': (race_block, race_block, False),
+        'fountain': (series, frozenset(series), True),
+    }
+
+
+def check_payloads(race_data):
+    """
+    Данные приложения для проверки QR туда и обратно
+
+    Returns:
+        list: Пары (название, данные) - str для печатного кода КП,
+        bytes для двоичных данных
+    """
+    race = {key: value for key, value in race_data.items() if key != 'members'}
+    race_block = QR_codes.encode_payload(race)
+    payloads = [
+        ('код КП', 'FAST-CP-0123456789'),
+        ('блок соревнования', race_block),
+        ('двоичные байты 0-255', bytes(range(256)) * 4),
+    ]
+    members = race_data.get('members') or []
+    if members:
+        dictionary = QR_codes.RaceDictionary.from_race_block(race_block)
+        payloads.append(('QR экипажа', dictionary.encode_crew(members[0])))
+    encoder = QR_codes.FountainEncoder(QR_codes.encode_payload(race_data))
+    payloads += [(f'кадр серии {seed}', encoder.frame(seed)) for seed in range(3)]
+    return payloads
+
+
+def run_check(race_data, decoder_names, module_px=4):
+    """
+    Проверка QR туда и обратно через настоящие декодеры
+
+    Returns:
+        bool: True, если все данные считаны без искажений
+    """
+    import cv2
+    import numpy as np
+
+    ok = True
+    for decoder_name in decoder_names:
+        decoder = make_decoder(decoder_name, False)
+        for name, payload in check_payloads(race_data):
+            expected = payload.encode('utf-8') if isinstance(payload, str) else payload
+            code = np.kron(QR_codes.qr_matrix(payload),
+                           np.ones((module_px, module_px), dtype=np.uint8))
+            try:
+                detections = decoder(cv2.cvtColor(code, cv2.COLOR_GRAY2BGR))
+            except (ImportError, OSError) as e:
+                print(f'{decoder_name:<8} недоступен: {e}')
+                break
+            passed = any(d.data == expected for d in detections)
+            ok = ok and passed
+            print(f"{decoder_name:<8} {name:<24} {len(expected):6} байт  "
+                  f"{'OK' if passed else 'ОШИБКА'}")
+    return ok
+
+
+def make_decoder(name, preprocess):
+    if name == 'pyzbar':
+        base = QR_codes.pyzbar_decoder
+    elif name == 'opencv':
+        base = QR_codes.opencv_decoder
+    else:
+        base = QR_codes.default_decoder()
+    if preprocess:
+        return QR_codes.FramePreprocessor(base)
+    return base
+
+
+def format_row(name, result):
+    first = result['first_decode']
+    first_text = f"{first * 1000:8.1f} мс" if first is not None else '        —  '
+    line = (
+        f"{name:<40} {result['fps']:7.1f} к/с  "
+        f"первое: {first_text}  успех: {result['success_rate'] * 100:5.1f}%"
+    )
+    if 'assembled' in result:
+        assembled = result['assembled']
+        line += (f"  сборка: {assembled * 1000:8.1f} мс" if assembled is not None
+                 else '  сборка:     —      ')
+    if 'dropped' in result:
+        line += f"  отброшено: {result['dropped']}"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замер скорости сканирования QR-кодов')
+    parser.add_argument('--fixtures', help='Каталог с записанными кадрами')
+    parser.add_argument('--expect', help='Ожидаемое содержимое кода в записанных кадрах')
+    parser.add_argument('--payload', default='FAST-CP-0123456789',
+                        help='Содержимое кода в синтетических кадрах')
+    parser.add_argument('--frames', type=int, default=60, help='Кадров на сценарий')
+    parser.add_argument('--decoder', choices=['auto', 'pyzbar', 'opencv'], default='auto')
+    parser.add_argument('--raw', action='store_true',
+                        help='Без подготовки кадров (FramePreprocessor)')
+    parser.add_argument('--mode', choices=['direct', 'pipeline'], default='direct')
+    parser.add_argument('--fps', type=float, default=30.0,
+                        help='Частота подачи кадров в режиме pipeline')
+    parser.add_argument('--json', action='store_true', help='Вывод в JSON')
+    parser.add_argument('--content', choices=['all', 'text', 'race', 'fountain'],
+                        default='all', help='Содержимое синтетических кадров')
+    parser.add_argument('--check', action='store_true',
+                        help='Проверка данных приложения QR туда и обратно')
+    parser.add_argument('--race', help='Файл соревнования (по умолчанию синтетическое)')
+    args = parser.parse_args(argv)
+
+    race_data = sample_race()
+    if args.race:
+        with open(args.race, encoding='utf-8') as fd:
+            race_data = json.load(fd)
+
+    if args.check:
+        names = ['pyzbar', 'opencv'] if args.decoder == 'auto' else [args.decoder]
+        return 0 if run_check(race_data, names) else 1
+
+    if args.fixtures:
+        if not args.expect:
+            parser.error('--fixtures требует --expect')
+        runs = [(os.path.basename(os.path.normpath(args.fixtures)),
+                 load_fixture_frames(args.fixtures), args.expect.encode('utf-8'), False)]
+    else:
+        contents = content_payloads(args.payload, race_data, args.frames)
+        kinds = list(contents) if args.content == 'all' else [args.content]
+        runs = [
+            (f'{kind}: {name}',
+             synthetic_frames(contents[kind][0], args.frames, module_px, angle, blur, brightness),
+             contents[kind][1], contents[kind][2])
+            for kind in kinds
+            for name, module_px, angle, blur, brightness in SCENARIOS
+        ]
+
+    results = {}
+    for name, frames, expected, fountain in runs:
+        # Новый декодер на сценарий: отслеживание области не переносится
+        decoder = make_decoder(args.decoder, not args.raw)
+        if args.mode == 'pipeline':
+            result = run_pipeline(frames, expected, decoder, args.fps, fountain)
+        else:
+            result = run_direct(frames, expected, decoder, fountain)
+        results[name] = result
+        if not args.json:
+            print(format_row(name, result))
+
+    if args.json:
+        json.dump(results, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
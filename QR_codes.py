@@ -6,6 +6,1996 @@
 - Сканирования QR-кодов
 - Работы со штрих-кодами
 - Работы с NFC (заготовка)
+- Компактного двоичного кодирования данных соревнования и экипажей для QR
+- Передачи больших данных серией QR-кодов (фонтанный код)
+- Сканирования камерой в фоновых потоках с доставкой результата в UI
+- Подготовки кадров (оттенки серого, уменьшение, бинаризация)
+  и отслеживания области QR-кода между кадрами
+- Пакетного сканирования (листы КП, очередь на финише)
+- Подавления повторных считываний одного и того же кода
+- Отрисовки QR-кода прямо в текстуру Kivy (без PIL и файлов)
+- Пакетной генерации листов с QR-кодами КП для печати
+- Регистрационных QR экипажей со ссылкой на общий блок соревнования
 """
 
+import hashlib
+import math
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
 
+# Двоичные данные передаются в QR текстом base45 (буквенно-цифровой режим
+# QR): декодеры отдают только текст, а байты вне UTF-8 портят при
+# перекодировке. Текст начинается с метки, обычные коды КП идут как есть
+QR_TEXT_PREFIX = 'FQ:'
+# Максимальный объем данных в одном QR-коде: версия 40, уровень коррекции M,
+# 3391 буквенно-цифровой символ, base45 - 3 символа на 2 байта
+QR_MAX_BYTES = 2250
+
+# Первый байт полезной нагрузки: формат и версия кодека
+PAYLOAD_FORMAT = 0xF1
+# Первый байт регистрационного QR экипажа (ссылается на блок соревнования)
+CREW_FORMAT = 0xF3
+# Первый байт кадра серии QR-кодов (фонтанный код)
+FOUNTAIN_FORMAT = 0xF2
+# Размер блока данных в одном кадре серии: QR такого объема
+# уверенно считывается с экрана телефона
+FOUNTAIN_BLOCK_SIZE = 256
+# Наибольшее число блоков в серии (4096 блоков по 256 байт - 1 МБ):
+# заголовок кадра приходит с камеры, и без предела чужой QR с огромной
+# длиной заставил бы приемник выделить память под миллиарды блоков
+FOUNTAIN_MAX_BLOCKS = 4096
+# Сколько кадров камеры может ждать декодирования (лишние отбрасываются)
+SCAN_QUEUE_SIZE = 1
+# Длинная сторона кадра, до которой он уменьшается перед поиском кода
+SCAN_MAX_SIDE = 960
+# Минимальный размер QR-кода в пикселях после уменьшения
+SCAN_MIN_QR_SIDE = 120
+# При пакетном сканировании кодов в кадре много и они мелкие -
+# кадр почти не уменьшается
+BATCH_SCAN_MAX_SIDE = 1920
+# Сколько секунд повторное считывание того же кода считается дублем
+SCAN_DEBOUNCE_TTL = 2.0
+# Больше этого объема на экране телефона показывается анимированная серия
+SCREEN_QR_MAX_BYTES = 1000
+# Кадров серии в секунду при показе анимированного QR
+ANIMATED_QR_FPS = 5
+# Сколько текстур QR-кодов хранится в кеше
+QR_TEXTURE_CACHE_SIZE = 16
+# Листы КП для печати: A4 при 300 dpi, сетка кодов и размер модуля
+SHEET_PAGE_SIZE = (2480, 3508)
+SHEET_GRID = (3, 4)
+SHEET_MODULE_PX = 12
+SHEET_MARGIN_PX = 120
+SHEET_LABEL_PX = 60
+
+# Теги значений двоичного формата
+_T_NULL = 0
+_T_FALSE = 1
+_T_TRUE = 2
+_T_INT = 3          # неотрицательное целое (varint)
+_T_NEG_INT = 4      # отрицательное целое (varint от -n-1)
+_T_FLOAT = 5        # double, 8 байт
+_T_FLOAT_E6 = 6     # float с не более чем 6 знаками после запятой (zigzag varint)
+_T_STR_NEW = 7      # новая строка: длина + UTF-8, добавляется в таблицу строк
+_T_STR_REF = 8      # ссылка на строку из таблицы
+_T_LIST = 9
+_T_DICT = 10
+_T_NUM_STR = 11     # строка из цифр: "37"
+_T_TIME_HM = 12     # "ЧЧ:ММ"
+_T_TIME_HMS = 13    # "ЧЧ:ММ:СС"
+_T_DATE = 14        # "ДД-ММ-ГГГГ"
+_T_DATETIME_M = 15  # "ГГГГ-ММ-ДД ЧЧ:ММ"
+_T_DATETIME_S = 16  # "ГГГГ-ММ-ДД ЧЧ:ММ:СС"
+_T_PHONE = 17       # "+79991234567"
+_T_CP_LIST = 18     # список КП в схемном представлении
+
+# Флаги КП в схемном представлении
+_CP_CLASSIFICATIONS = 1
+_CP_SCORE = 2
+_CP_STAGES = 4
+_CP_EMPTY_FALSE_FOR = 8
+_CP_EXTRA = 16
+
+_NUM_STR_RE = re.compile(r'(0|[1-9][0-9]{0,17})\Z')
+_PHONE_RE = re.compile(r'\+[1-9][0-9]{0,17}\Z')
+_TIME_RE = re.compile(r'([0-9]{2}):([0-5][0-9])(?::([0-5][0-9]))?\Z')
+_DATE_RE = re.compile(r'[0-9]{2}-[0-9]{2}-[0-9]{4}\Z')
+_DATETIME_RE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}(:[0-9]{2})?\Z')
+_EPOCH = datetime(1900, 1, 1)
+# Не больше 10 байт на varint (64 бита): длиннее бывает только в поврежденном QR
+_VARINT_MAX_BYTES = 10
+
+# Словарь частых слов соревнований для предварительной настройки zlib.
+# Слова записаны так же, как они встречаются в потоке (тег + длина + UTF-8),
+# самые частые - в конце (zlib дешевле ссылается на близкие данные).
+_ZDICT_WORDS = [
+    'адрес_электронной_почты', 'субъект', 'Москва', 'пассажиры',
+    'общее_количество', 'до_18_лет', 'авто', 'гос.номер',
+    'привод_автомобиля', 'Передний', 'Задний', 'Полный',
+    'дата_рождения_пилота', 'дата_рождения_штурмана',
+    'контактный_телефон_пилота', 'контактный_телефон_штурмана',
+    'пол_пилота', 'пол_штурмана', 'Мужской', 'Женский',
+    'капитан', 'Пилот', 'Штурман', 'пилот', 'штурман', 'место',
+    'время_регистрации', 'время_брифинга', 'время_старта',
+    'время_закрытия_трассы', 'время_награждения', 'количество_кп',
+    'бальность_кп', 'зачет1', 'зачет2', 'расчетное_время_трассы',
+    'common_start', 'penalty_type', 'penalty_value', 'false_cp_penalty',
+    'staged', 'neutralization_type', 'max_neutral_time', 'stages_count',
+    'skp_settings', 'open_time', 'close_time', 'late_action',
+    'Перенос на след. этап', 'На каждом СКП', 'DNF', 'time_limit',
+    'meta', 'version', 'created_at', 'date', 'params', 'checkpoints',
+    'members', 'logic_params', 'stages', 'classifications', 'score',
+    'false_for', 'latitude', 'longitude', 'hint', 'code',
+    'registered', 'registration_time', 'started', 'start_time',
+    'current_stage', 'current_skp', 'total_score', 'check_completed',
+    'finished', 'finish_time', 'skp_entries', 'entry_time', 'exit_time',
+    'duration', 'skp', 'auto_move_skp_closed', 'manual_move', 'enter_skp',
+    'stage_history', 'stage', 'action', 'cancelled', 'from', 'to', 'type',
+    'number', 'time', 'taken_cps', 'номер', 'зачет', 'name',
+    'Карта', 'Легенда', 'Спорт', 'Туризм', 'КП ',
+]
+
+
+def _build_zdict(words):
+    parts = []
+    for word in words:
+        raw = word.encode('utf-8')
+        parts.append(bytes([_T_STR_NEW, len(raw)]) + raw)
+    return b''.join(parts)
+
+
+_ZDICT = _build_zdict(_ZDICT_WORDS)
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    result = 0
+    for shift in range(0, 7 * _VARINT_MAX_BYTES, 7):
+        if pos >= len(data):
+            raise ValueError('Обрезанные данные QR-кода')
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+    raise ValueError('Слишком длинное число в QR-коде')
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -(value >> 1) - 1
+
+
+def _datetime_seconds(text):
+    """Секунды от _EPOCH для строки даты-времени или None"""
+    fmt = '%Y-%m-%d %H:%M:%S' if len(text) == 19 else '%Y-%m-%d %H:%M'
+    try:
+        moment = datetime.strptime(text, fmt)
+    except ValueError:
+        return None
+    if moment.strftime(fmt) != text:
+        return None
+    delta = moment - _EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+    return seconds if seconds >= 0 else None
+
+
+class _Encoder:
+    """Кодировщик значений в двоичный поток с таблицей строк"""
+
+    def __init__(self):
+        self.out = bytearray()
+        self.strings = {}
+
+    def write_str(self, text):
+        index = self.strings.get(text)
+        if index is not None:
+            self.out.append(_T_STR_REF)
+            _write_varint(self.out, index)
+            return
+        raw = text.encode('utf-8')
+        self.strings[text] = len(self.strings)
+        self.out.append(_T_STR_NEW)
+        _write_varint(self.out, len(raw))
+        self.out += raw
+
+    def write_text_value(self, text):
+        """Строковое значение: по возможности упакованное по шаблону"""
+        out = self.out
+        if _NUM_STR_RE.match(text):
+            out.append(_T_NUM_STR)
+            _write_varint(out, int(text))
+            return
+        if _PHONE_RE.match(text):
+            out.append(_T_PHONE)
+            _write_varint(out, int(text[1:]))
+            return
+        match = _TIME_RE.match(text)
+        if match:
+            hours, minutes, seconds = match.groups()
+            total = int(hours) * 60 + int(minutes)
+            if seconds is None:
+                out.append(_T_TIME_HM)
+            else:
+                out.append(_T_TIME_HMS)
+                total = total * 60 + int(seconds)
+            _write_varint(out, total)
+            return
+        if _DATE_RE.match(text):
+            seconds = _datetime_seconds(f'{text[6:]}-{text[3:5]}-{text[:2]} 00:00')
+            if seconds is not None:
+                out.append(_T_DATE)
+                _write_varint(out, seconds // 86400)
+                return
+        if _DATETIME_RE.match(text):
+            seconds = _datetime_seconds(text)
+            if seconds is not None:
+                out.append(_T_DATETIME_S if len(text) == 19 else _T_DATETIME_M)
+                _write_varint(out, seconds if len(text) == 19 else seconds // 60)
+                return
+        self.write_str(text)
+
+    def write(self, value):
+        out = self.out
+        if value is None:
+            out.append(_T_NULL)
+        elif value is True:
+            out.append(_T_TRUE)
+        elif value is False:
+            out.append(_T_FALSE)
+        elif isinstance(value, int):
+            if value >= 0:
+                out.append(_T_INT)
+                _write_varint(out, value)
+            else:
+                out.append(_T_NEG_INT)
+                _write_varint(out, -value - 1)
+        elif isinstance(value, float):
+            # Координаты и подобные числа с малым числом знаков - varint
+            if abs(value) < 1e9 and round(value * 1000000) / 1000000 == value:
+                scaled = round(value * 1000000)
+                out.append(_T_FLOAT_E6)
+                _write_varint(out, _zigzag(scaled))
+            else:
+                out.append(_T_FLOAT)
+                out += struct.pack('<d', value)
+        elif isinstance(value, str):
+            self.write_text_value(value)
+        elif isinstance(value, dict):
+            out.append(_T_DICT)
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                self.write_str(key)
+                if key == 'checkpoints' and _is_cp_list(item):
+                    self.write_cp_list(item)
+                else:
+                    self.write(item)
+        elif isinstance(value, (list, tuple)):
+            out.append(_T_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self.write(item)
+        else:
+            raise TypeError(f'Тип {type(value).__name__} не поддерживается')
+
+    def write_cp_list(self, checkpoints):
+        """
+        Список КП: зачеты и этапы один раз в таблицах, у каждого КП - битовые
+        маски, балл - числом, все нестандартные поля - обычным словарем
+        """
+        classes = []
+        stages = []
+        for cp in checkpoints:
+            for name in cp.get('classifications') or {}:
+                if isinstance(name, str) and name not in classes:
+                    classes.append(name)
+            cp_stages = cp.get('stages')
+            if isinstance(cp_stages, list):
+                for name in cp_stages:
+                    if isinstance(name, str) and name not in stages:
+                        stages.append(name)
+
+        out = self.out
+        out.append(_T_CP_LIST)
+        for table in (classes, stages):
+            _write_varint(out, len(table))
+            for name in table:
+                self.write_str(name)
+        _write_varint(out, len(checkpoints))
+
+        for cp in checkpoints:
+            extra = dict(cp)
+            del extra['name']
+            flags = 0
+            masks = []
+
+            classifications = extra.get('classifications')
+            if (isinstance(classifications, dict)
+                    and all(isinstance(v, bool) for v in classifications.values())):
+                present = 0
+                values = 0
+                for index, name in enumerate(classes):
+                    if name in classifications:
+                        present |= 1 << index
+                        if classifications[name]:
+                            values |= 1 << index
+                flags |= _CP_CLASSIFICATIONS
+                masks += [present, values]
+                del extra['classifications']
+
+            score = extra.get('score')
+            if isinstance(score, str) and _NUM_STR_RE.match(score):
+                flags |= _CP_SCORE
+                masks.append(int(score))
+                del extra['score']
+
+            cp_stages = extra.get('stages')
+            if isinstance(cp_stages, list) and all(isinstance(s, str) for s in cp_stages):
+                ordered = [name for name in stages if name in cp_stages]
+                if ordered == cp_stages:
+                    flags |= _CP_STAGES
+                    masks.append(sum(1 << stages.index(name) for name in cp_stages))
+                    del extra['stages']
+
+            if extra.get('false_for') == [] and isinstance(extra['false_for'], list):
+                flags |= _CP_EMPTY_FALSE_FOR
+                del extra['false_for']
+
+            if extra:
+                flags |= _CP_EXTRA
+
+            self.write_str(cp['name'])
+            _write_varint(out, flags)
+            for mask in masks:
+                _write_varint(out, mask)
+            if extra:
+                self.write(extra)
+
+
+def _is_cp_list(value):
+    return (
+        isinstance(value, list)
+        and all(isinstance(cp, dict) and isinstance(cp.get('name'), str) for cp in value)
+    )
+
+
+class _Decoder:
+    """Декодер двоичного потока _Encoder"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.strings = []
+
+    def varint(self):
+        value, self.pos = _read_varint(self.data, self.pos)
+        return value
+
+    def read_str(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        return self._str_body(tag)
+
+    def _str_body(self, tag):
+        if tag == _T_STR_REF:
+            return self.strings[self.varint()]
+        if tag != _T_STR_NEW:
+            raise ValueError(f'Ожидалась строка, получен тег {tag}')
+        length = self.varint()
+        end = self.pos + length
+        text = bytes(self.data[self.pos:end]).decode('utf-8')
+        self.pos = end
+        self.strings.append(text)
+        return text
+
+    def read(self):
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == _T_STR_NEW or tag == _T_STR_REF:
+            return self._str_body(tag)
+        if tag == _T_DICT:
+            result = {}
+            for _ in range(self.varint()):
+                key = self.read_str()
+                result[key] = self.read()
+            return result
+        if tag == _T_LIST:
+            return [self.read() for _ in range(self.varint())]
+        if tag == _T_NUM_STR:
+            return str(self.varint())
+        if tag == _T_INT:
+            return self.varint()
+        if tag == _T_TRUE:
+            return True
+        if tag == _T_FALSE:
+            return False
+        if tag == _T_NULL:
+            return None
+        if tag == _T_TIME_HM:
+            value = self.varint()
+            return f'{value // 60:02d}:{value % 60:02d}'
+        if tag == _T_TIME_HMS:
+            value = self.varint()
+            return f'{value // 3600:02d}:{value // 60 % 60:02d}:{value % 60:02d}'
+        if tag == _T_CP_LIST:
+            return self.read_cp_list()
+        if tag == _T_NEG_INT:
+            return -self.varint() - 1
+        if tag == _T_FLOAT_E6:
+            return _unzigzag(self.varint()) / 1000000
+        if tag == _T_FLOAT:
+            value = struct.unpack_from('<d', self.data, self.pos)[0]
+            self.pos += 8
+            return value
+        if tag == _T_PHONE:
+            return f'+{self.varint()}'
+        if tag == _T_DATE:
+            return (_EPOCH + timedelta(days=self.varint())).strftime('%d-%m-%Y')
+        if tag == _T_DATETIME_M:
+            return (_EPOCH + timedelta(minutes=self.varint())).strftime('%Y-%m-%d %H:%M')
+        if tag == _T_DATETIME_S:
+            return (_EPOCH + timedelta(seconds=self.varint())).strftime('%Y-%m-%d %H:%M:%S')
+        raise ValueError(f'Неизвестный тег {tag}')
+
+    def read_cp_list(self):
+        classes = [self.read_str() for _ in range(self.varint())]
+        stages = [self.read_str() for _ in range(self.varint())]
+        checkpoints = []
+        for _ in range(self.varint()):
+            cp = {'name': self.read_str()}
+            flags = self.varint()
+            if flags & _CP_CLASSIFICATIONS:
+                present = self.varint()
+                values = self.varint()
+                cp['classifications'] = {
+                    name: bool(values >> index & 1)
+                    for index, name in enumerate(classes)
+                    if present >> index & 1
+                }
+            if flags & _CP_SCORE:
+                cp['score'] = str(self.varint())
+            if flags & _CP_STAGES:
+                mask = self.varint()
+                cp['stages'] = [
+                    name for index, name in enumerate(stages) if mask >> index & 1
+                ]
+            if flags & _CP_EMPTY_FALSE_FOR:
+                cp['false_for'] = []
+            if flags & _CP_EXTRA:
+                cp.update(self.read())
+            checkpoints.append(cp)
+        return checkpoints
+
+
+def _compress(body, zdict):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _decompress(data, zdict):
+    decompressor = zlib.decompressobj(-15, zdict)
+    try:
+        return decompressor.decompress(data) + decompressor.flush()
+    except zlib.error as e:
+        raise ValueError(f'Поврежденные данные QR-кода: {e}')
+
+
+def _decode_body(body):
+    """
+    Разбор распакованного тела QR-кода
+
+    Ошибки разбора обрезанных и поврежденных данных приводятся к ValueError,
+    который вызывающий код показывает пользователю.
+    """
+    decoder = _Decoder(body)
+    try:
+        result = decoder.read()
+    except (IndexError, OverflowError, UnicodeDecodeError, TypeError, RecursionError,
+            struct.error) as e:
+        raise ValueError(f'Поврежденные данные QR-кода: {e}')
+    if decoder.pos != len(body):
+        raise ValueError('Лишние данные в QR-коде')
+    return result
+
+
+def encode_payload(data):
+    """
+    Компактное двоичное представление данных соревнования или экипажа для QR
+
+    Схема: значения с тегами и varint-числами, строки (в т.ч. названия КП)
+    хранятся один раз и дальше передаются ссылками, числа, время и даты
+    в строках упаковываются в числа, зачеты и этапы КП - в битовые маски.
+    Результат сжимается raw deflate со словарем частых слов соревнования.
+
+    Args:
+        data: JSON-совместимые данные (dict, list, str, числа, bool, None)
+
+    Returns:
+        bytes: Полезная нагрузка для QR-кода
+    """
+    encoder = _Encoder()
+    encoder.write(data)
+    return bytes([PAYLOAD_FORMAT]) + _compress(bytes(encoder.out), _ZDICT)
+
+
+def decode_payload(payload):
+    """
+    Восстановление данных из полезной нагрузки encode_payload
+
+    Args:
+        payload: bytes из QR-кода
+
+    Returns:
+        Исходные данные
+
+    Raises:
+        ValueError: Неизвестный формат, обрезанные или поврежденные данные
+    """
+    if not payload or payload[0] != PAYLOAD_FORMAT:
+        raise ValueError('Неизвестный формат QR-кода')
+    return _decode_body(_decompress(bytes(payload[1:]), _ZDICT))
+
+
+class RaceDictionary:
+    """
+    Общий блок соревнования для регистрационных QR экипажей
+
+    Данные соревнования без списка экипажей (КП, этапы, параметры)
+    передаются один раз - блоком race_block (QR, серия QR или заранее
+    загруженный файл). QR экипажа содержит только данные экипажа и ссылку
+    на блок: номер версии и первые байты SHA-256 блока. Данные экипажа
+    сжимаются со словарем из самого блока соревнования, поэтому названия
+    КП, зачетов и этапов в них почти ничего не стоят.
+
+    Формат QR экипажа: CREW_FORMAT, 8 байт ссылки, varint версии, raw deflate.
+    """
+
+    REF_SIZE = 8
+
+    def __init__(self, race_data, race_block=None):
+        """
+        Args:
+            race_data: Данные соревнования (список экипажей не используется)
+            race_block: Полученный блок соревнования (по умолчанию
+                        кодируется из race_data)
+        """
+        race = {key: value for key, value in race_data.items() if key != 'members'}
+        self.version = race.get('meta', {}).get('version', 0)
+        if race_block is None:
+            race_block = encode_payload(race)
+        # Ссылка и словарь считаются по байтам самого блока, а не по
+        # повторно закодированным данным: у организатора и участника
+        # они совпадают, даже если кодек сериализует данные иначе
+        self.race_block = bytes(race_block)
+        self.ref = hashlib.sha256(self.race_block).digest()[:self.REF_SIZE]
+
+        # Словарь zlib: общие слова и несжатое тело блока соревнования
+        # (оно ближе - на него ссылки дешевле). zlib использует последние 32 КБ.
+        body = _decompress(self.race_block[1:], _ZDICT)
+        self._zdict = (_ZDICT + body)[-32768:]
+
+        header = bytearray([CREW_FORMAT])
+        header += self.ref
+        _write_varint(header, self.version)
+        self._header = bytes(header)
+
+    @classmethod
+    def from_race_block(cls, race_block):
+        """Словарь по считанному блоку соревнования"""
+        return cls(decode_payload(race_block), race_block)
+
+    def encode_crew(self, crew):
+        """
+        Регистрационный QR экипажа
+
+        Args:
+            crew: Данные экипажа (элемент members)
+
+        Returns:
+            bytes: Полезная нагрузка для QR-кода
+        """
+        encoder = _Encoder()
+        encoder.write(crew)
+        return self._header + _compress(bytes(encoder.out), self._zdict)
+
+    def decode_crew(self, payload):
+        """
+        Данные экипажа из регистрационного QR
+
+        Raises:
+            ValueError: QR относится к другому соревнованию или его версии
+        """
+        ref, version = crew_payload_ref(payload)
+        if ref != self.ref or version != self.version:
+            raise ValueError(
+                f'QR экипажа для другой версии соревнования ({version}), '
+                f'загружена версия {self.version}'
+            )
+        return _decode_body(_decompress(bytes(payload[len(self._header):]), self._zdict))
+
+
+def crew_payload_ref(payload):
+    """
+    Ссылка регистрационного QR экипажа на блок соревнования
+
+    Returns:
+        tuple: (8 байт хеша блока, номер версии соревнования)
+    """
+    if not payload or payload[0] != CREW_FORMAT:
+        raise ValueError('Это не регистрационный QR экипажа')
+    ref_end = 1 + RaceDictionary.REF_SIZE
+    ref = bytes(payload[1:ref_end])
+    version, _ = _read_varint(payload, ref_end)
+    return ref, version
+
+
+def fits_single_qr(payload):
+    """Помещается ли полезная нагрузка в один QR-код"""
+    return len(payload) <= QR_MAX_BYTES
+
+
+# Заголовок кадра: формат, CRC32 данных, длина данных, размер блока, номер кадра
+_FRAME_HEADER = struct.Struct('<BIIHI')
+_MASK64 = (1 << 64) - 1
+
+
+class _FramePRNG:
+    """
+    Генератор псевдослучайных чисел SplitMix64
+
+    Свой, а не random.Random: передающий и принимающий телефоны должны
+    получать одинаковые последовательности независимо от версии Python.
+    """
+
+    def __init__(self, seed):
+        self.state = seed & _MASK64
+
+    def next(self):
+        self.state = (self.state + 0x9E3779B97F4A7C15) & _MASK64
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return z ^ (z >> 31)
+
+    def uniform(self):
+        return self.next() / 2.0 ** 64
+
+
+def _robust_soliton_cdf(block_count, c=0.1, delta=0.5):
+    """Функция распределения степеней кадров (robust soliton)"""
+    k = block_count
+    if k == 1:
+        return [1.0]
+    r = c * math.log(k / delta) * math.sqrt(k)
+    spike = max(1, min(k, int(round(k / r))))
+    weights = []
+    for d in range(1, k + 1):
+        rho = 1.0 / k if d == 1 else 1.0 / (d * (d - 1))
+        if d < spike:
+            tau = r / (d * k)
+        elif d == spike:
+            tau = r * math.log(r / delta) / k
+        else:
+            tau = 0.0
+        weights.append(rho + max(tau, 0.0))
+    total = sum(weights)
+    cdf = []
+    acc = 0.0
+    for weight in weights:
+        acc += weight / total
+        cdf.append(acc)
+    cdf[-1] = 1.0
+    return cdf
+
+
+def _frame_whitening(seed, block_size):
+    """
+    Псевдослучайная маска данных кадра
+
+    XOR двух одинаковых блоков дает длинные серии нулей, на которых
+    генератор qrcode падает (glog(0) в коде Рида-Соломона). Маска,
+    зависящая от номера кадра, убирает такие серии и снимается приемником.
+    """
+    prng = _FramePRNG(~seed)
+    words = -(-block_size // 8)
+    value = 0
+    for i in range(words):
+        value |= prng.next() << (64 * i)
+    return value & ((1 << (8 * block_size)) - 1)
+
+
+def _frame_blocks(seed, block_count, cdf):
+    """Номера блоков, XOR которых передается в кадре с данным номером"""
+    prng = _FramePRNG(seed)
+    degree = bisect_left(cdf, prng.uniform()) + 1
+    if degree * 2 > block_count:
+        indices = list(range(block_count))
+        for i in range(block_count - 1, 0, -1):
+            j = prng.next() % (i + 1)
+            indices[i], indices[j] = indices[j], indices[i]
+        return indices[:degree]
+    chosen = []
+    seen = set()
+    while len(chosen) < degree:
+        index = prng.next() % block_count
+        if index not in seen:
+            seen.add(index)
+            chosen.append(index)
+    return chosen
+
+
+class FountainEncoder:
+    """
+    Разбиение данных на бесконечную серию кадров для анимированного QR
+
+    Используется фонтанный (LT) код: каждый кадр - XOR нескольких блоков
+    данных, и данные восстанавливаются из любых примерно block_count
+    (с запасом в несколько процентов) кадров в любом порядке. Пропущенный
+    из-за блика кадр не нужно ждать - подойдет любой следующий.
+    """
+
+    def __init__(self, payload, block_size=FOUNTAIN_BLOCK_SIZE):
+        self.payload = bytes(payload)
+        self.block_size = block_size
+        self.block_count = max(1, -(-len(self.payload) // block_size))
+        if self.block_count > FOUNTAIN_MAX_BLOCKS:
+            raise ValueError(f'Слишком большие данные для серии QR: {len(self.payload)} байт')
+        self.checksum = zlib.crc32(self.payload)
+        padded = self.payload.ljust(self.block_count * block_size, b'\0')
+        self._blocks = [
+            int.from_bytes(padded[i:i + block_size], 'little')
+            for i in range(0, len(padded), block_size)
+        ]
+        self._cdf = _robust_soliton_cdf(self.block_count)
+
+    def frame(self, seed):
+        """
+        Кадр с заданным номером
+
+        Args:
+            seed: Номер кадра (0, 1, 2, ...)
+
+        Returns:
+            bytes: Содержимое одного QR-кода серии
+        """
+        value = _frame_whitening(seed, self.block_size)
+        for index in _frame_blocks(seed, self.block_count, self._cdf):
+            value ^= self._blocks[index]
+        header = _FRAME_HEADER.pack(
+            FOUNTAIN_FORMAT, self.checksum, len(self.payload),
+            self.block_size, seed
+        )
+        return header + value.to_bytes(self.block_size, 'little')
+
+    def frames(self, start=0):
+        """Бесконечный генератор кадров, начиная с номера start"""
+        seed = start
+        while True:
+            yield self.frame(seed)
+            seed += 1
+
+
+def is_fountain_frame(data):
+    """Является ли считанный QR кадром серии"""
+    return len(data) > _FRAME_HEADER.size and data[0] == FOUNTAIN_FORMAT
+
+
+class FountainDecoder:
+    """
+    Сборка данных из кадров FountainEncoder
+
+    Кадры принимаются в любом порядке, повторы и кадры чужой серии
+    игнорируются. Декодирование - "распутывание": кадр из одного
+    неизвестного блока сразу дает этот блок, который затем вычитается
+    из всех ожидающих кадров. Если распутывание застряло, а кадров уже
+    достаточно, оставшиеся блоки находятся методом Гаусса над GF(2).
+    """
+
+    def __init__(self):
+        self.checksum = None
+        self.length = None
+        self.block_size = None
+        self.block_count = None
+        self._cdf = None
+        self._known = {}
+        # Ожидающие кадры: [множество неизвестных блоков, значение]
+        self._pending = []
+        # Блок -> ожидающие кадры, в которые он входит
+        self._waiting = {}
+        self._seen_seeds = set()
+        self._payload = None
+
+    @property
+    def is_complete(self):
+        return self._payload is not None
+
+    @property
+    def progress(self):
+        """Доля восстановленных блоков (0.0 - 1.0)"""
+        if not self.block_count:
+            return 0.0
+        return len(self._known) / self.block_count
+
+    @property
+    def payload(self):
+        """Собранные данные (None, пока сборка не завершена)"""
+        return self._payload
+
+    def add_frame(self, frame):
+        """
+        Добавление считанного кадра
+
+        Args:
+            frame: bytes из QR-кода
+
+        Returns:
+            bool: True, если данные собраны полностью
+        """
+        if self._payload is not None:
+            return True
+        if not is_fountain_frame(frame):
+            return False
+        _, checksum, length, block_size, seed = _FRAME_HEADER.unpack_from(frame)
+        data = frame[_FRAME_HEADER.size:]
+        if len(data) != block_size or block_size == 0:
+            return False
+        if -(-length // block_size) > FOUNTAIN_MAX_BLOCKS:
+            return False
+
+        if self.checksum is None:
+            self.checksum = checksum
+            self.length = length
+            self.block_size = block_size
+            self.block_count = max(1, -(-length // block_size))
+            self._cdf = _robust_soliton_cdf(self.block_count)
+        elif (checksum, length, block_size) != (self.checksum, self.length, self.block_size):
+            # Кадр другой серии (например, соседний экипаж)
+            return False
+
+        if seed in self._seen_seeds:
+            return False
+        self._seen_seeds.add(seed)
+
+        value = int.from_bytes(data, 'little') ^ _frame_whitening(seed, block_size)
+        unknown = set()
+        for index in _frame_blocks(seed, self.block_count, self._cdf):
+            known = self._known.get(index)
+            if known is None:
+                unknown.add(index)
+            else:
+                value ^= known
+
+        if len(unknown) == 1:
+            self._resolve(unknown.pop(), value)
+        elif unknown:
+            entry = [unknown, value]
+            self._pending.append(entry)
+            for index in unknown:
+                self._waiting.setdefault(index, []).append(entry)
+
+        if len(self._known) < self.block_count:
+            self._pending = [entry for entry in self._pending if entry[0]]
+            if len(self._pending) >= self.block_count - len(self._known):
+                self._solve()
+        if len(self._known) == self.block_count:
+            self._finish()
+        return self._payload is not None
+
+    def _solve(self):
+        """Метод Гаусса по ожидающим кадрам (маски блоков - целые числа)"""
+        pivots = {}
+        for blocks, value in self._pending:
+            mask = 0
+            for index in blocks:
+                mask |= 1 << index
+            while mask:
+                low = mask & -mask
+                pivot = pivots.get(low)
+                if pivot is None:
+                    pivots[low] = (mask, value)
+                    break
+                mask ^= pivot[0]
+                value ^= pivot[1]
+        if len(pivots) < self.block_count - len(self._known):
+            return
+
+        # Обратный ход: у каждой опорной строки младший бит - ее блок,
+        # остальные биты старше и уже найдены
+        solved = {}
+        for low in sorted(pivots, reverse=True):
+            mask, value = pivots[low]
+            rest = mask ^ low
+            while rest:
+                bit = rest & -rest
+                value ^= solved[bit]
+                rest ^= bit
+            solved[low] = value
+        for low, value in solved.items():
+            self._resolve(low.bit_length() - 1, value)
+
+    def _resolve(self, index, value):
+        """Блок стал известен: вычитаем его из ожидающих кадров"""
+        stack = [(index, value)]
+        while stack:
+            index, value = stack.pop()
+            if index in self._known:
+                continue
+            self._known[index] = value
+            for entry in self._waiting.pop(index, ()):
+                blocks = entry[0]
+                if index not in blocks:
+                    continue
+                blocks.discard(index)
+                entry[1] ^= value
+                if len(blocks) == 1:
+                    last = blocks.pop()
+                    stack.append((last, entry[1]))
+
+    def _finish(self):
+        data = b''.join(
+            self._known[i].to_bytes(self.block_size, 'little')
+            for i in range(self.block_count)
+        )[:self.length]
+        if zlib.crc32(data) != self.checksum:
+            # Поврежденный кадр: начинаем сборку заново
+            self.__init__()
+            return
+        self._payload = data
+        self._pending = []
+        self._waiting = {}
+
+
+_BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+_BASE45_VALUES = {char: value for value, char in enumerate(_BASE45_ALPHABET)}
+
+
+def base45_encode(data):
+    """Кодирование байтов в base45 (RFC 9285)"""
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        value = data[i] * 256 + data[i + 1]
+        value, c = divmod(value, 45)
+        e, d = divmod(value, 45)
+        chars += (_BASE45_ALPHABET[c], _BASE45_ALPHABET[d], _BASE45_ALPHABET[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (_BASE45_ALPHABET[c], _BASE45_ALPHABET[d])
+    return ''.join(chars)
+
+
+def base45_decode(text):
+    """
+    Декодирование base45
+
+    Raises:
+        ValueError: Текст не является base45
+    """
+    try:
+        values = [_BASE45_VALUES[char] for char in text]
+    except KeyError:
+        raise ValueError('Недопустимый символ base45')
+    if len(values) % 3 == 1:
+        raise ValueError('Неверная длина base45')
+    out = bytearray()
+    for i in range(0, len(values), 3):
+        chunk = values[i:i + 3]
+        if len(chunk) == 3:
+            value = chunk[0] + chunk[1] * 45 + chunk[2] * 2025
+            if value > 0xFFFF:
+                raise ValueError('Неверный блок base45')
+            out += value.to_bytes(2, 'big')
+        else:
+            value = chunk[0] + chunk[1] * 45
+            if value > 0xFF:
+                raise ValueError('Неверный блок base45')
+            out.append(value)
+    return bytes(out)
+
+
+def qr_text(data):
+    """
+    Содержимое QR-кода для данных
+
+    bytes передаются текстом QR_TEXT_PREFIX + base45, str - как есть
+    (например, код КП на печатном листе).
+    """
+    if isinstance(data, str):
+        return data
+    return QR_TEXT_PREFIX + base45_encode(bytes(data))
+
+
+def qr_data(text):
+    """
+    Данные из считанного текста QR-кода (обратное qr_text)
+
+    Args:
+        text: Считанный текст (str или bytes в UTF-8)
+
+    Returns:
+        bytes: Исходные данные, для кода без метки - его текст в UTF-8
+    """
+    if isinstance(text, bytes):
+        raw = text
+        text = text.decode('utf-8', errors='replace')
+    else:
+        raw = text.encode('utf-8')
+    if text.startswith(QR_TEXT_PREFIX):
+        try:
+            return base45_decode(text[len(QR_TEXT_PREFIX):])
+        except ValueError:
+            pass
+    return raw
+
+
+# Найденный в кадре код: данные (bytes) и прямоугольник (x, y, ширина, высота)
+QRDetection = namedtuple('QRDetection', ['data', 'rect'])
+
+
+def pyzbar_decoder(frame):
+    """
+    Поиск QR-кодов в кадре через pyzbar
+
+    Args:
+        frame: Кадр (numpy-массив, цветной BGR или оттенки серого)
+
+    Returns:
+        list: Найденные коды (QRDetection), данные уже без обертки qr_text
+    """
+    from pyzbar import pyzbar
+
+    results = pyzbar.decode(frame, symbols=[pyzbar.ZBarSymbol.QRCODE])
+    return [
+        QRDetection(
+            qr_data(item.data),
+            (item.rect.left, item.rect.top, item.rect.width, item.rect.height)
+        )
+        for item in results
+    ]
+
+
+def opencv_decoder(frame):
+    """
+    Поиск QR-кодов в кадре встроенным детектором OpenCV
+
+    Используется, если в системе нет библиотеки zbar (например, на Android
+    без собранного libzbar). Возвращает то же, что pyzbar_decoder.
+    """
+    import cv2
+
+    detector = getattr(_opencv_local, 'detector', None)
+    if detector is None:
+        # Детектор на основе ArUco надежнее классического: тот не находит
+        # часть больших кодов в зависимости от маски
+        factory = getattr(cv2, 'QRCodeDetectorAruco', cv2.QRCodeDetector)
+        detector = _opencv_local.detector = factory()
+    ok, texts, points, _ = detector.detectAndDecodeMulti(frame)
+    if not ok:
+        return []
+    detections = []
+    for text, corners in zip(texts, points):
+        if not text:
+            continue
+        xs = corners[:, 0]
+        ys = corners[:, 1]
+        x, y = int(xs.min()), int(ys.min())
+        rect = (x, y, int(xs.max()) - x, int(ys.max()) - y)
+        detections.append(QRDetection(qr_data(text), rect))
+    return detections
+
+
+# Детектор OpenCV не потокобезопасен - свой в каждом потоке
+_opencv_local = threading.local()
+
+
+def default_decoder():
+    """pyzbar, если доступна библиотека zbar, иначе детектор OpenCV"""
+    try:
+        from pyzbar import pyzbar  # noqa: F401
+    except (ImportError, OSError):
+        return opencv_decoder
+    return pyzbar_decoder
+
+
+class FramePreprocessor:
+    """
+    Подготовка кадра перед декодированием и отслеживание области кода
+
+    Кадр переводится в оттенки серого и уменьшается, поэтому декодер
+    получает в несколько раз меньше данных. После первого найденного кода
+    декодируется только область вокруг него (с запасом на движение руки):
+    уменьшение подбирается по размеру кода, а область бинаризуется (Otsu) -
+    в ней почти нет фона, и порог по гистограмме получается точным.
+    Если в области код не находится roi_max_misses кадров подряд,
+    поиск снова идет по всему кадру.
+
+    Объект вызывается как декодер: кадр -> список QRDetection
+    с координатами в исходном кадре. При track=False каждый кадр
+    просматривается целиком (пакетное сканирование).
+    """
+
+    def __init__(self, decoder=None, max_side=SCAN_MAX_SIDE, min_qr_side=SCAN_MIN_QR_SIDE,
+                 binarize=True, roi_margin=0.5, roi_max_misses=3, track=True):
+        self.decoder = decoder or default_decoder()
+        self.track = track
+        self.max_side = max_side
+        self.min_qr_side = min_qr_side
+        self.binarize = binarize
+        self.roi_margin = roi_margin
+        self.roi_max_misses = roi_max_misses
+        # Область последнего кода (x, y, w, h) в координатах кадра
+        self.roi = None
+        self._roi_misses = 0
+        # Масштаб, при котором код найден во всем кадре: область не
+        # уменьшается сильнее, иначе у плотного кода (блок соревнования,
+        # кадр серии) модуль становится меньше пикселя
+        self._roi_min_scale = 0.0
+        self._last_scale = 1.0
+
+    def reset(self):
+        """Сброс отслеживания (например, при наведении на другой лист)"""
+        self.roi = None
+        self._roi_misses = 0
+        self._roi_min_scale = 0.0
+
+    def prepare(self, frame, scale, binarize=False):
+        """Серое, уменьшенное и (по запросу) бинаризованное изображение"""
+        import cv2
+
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            height, width = frame.shape[:2]
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if binarize:
+            _, frame = cv2.threshold(frame, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return frame
+
+    def _crop_rect(self, frame_height, frame_width):
+        x, y, w, h = self.roi
+        margin_x = int(w * self.roi_margin)
+        margin_y = int(h * self.roi_margin)
+        left = max(0, x - margin_x)
+        top = max(0, y - margin_y)
+        right = min(frame_width, x + w + margin_x)
+        bottom = min(frame_height, y + h + margin_y)
+        return left, top, right, bottom
+
+    def _scale_for(self, width, height):
+        if self.roi is not None:
+            qr_side = max(self.roi[2], self.roi[3], 1)
+            return min(1.0, max(self.min_qr_side / qr_side, self._roi_min_scale))
+        return min(1.0, self.max_side / max(width, height))
+
+    def _decode_region(self, frame, left, top, right, bottom):
+        region = frame[top:bottom, left:right]
+        height, width = region.shape[:2]
+        scale = self._last_scale = self._scale_for(width, height)
+        binarize = self.binarize and self.roi is not None
+        detections = self.decoder(self.prepare(region, scale, binarize))
+        result = []
+        for detection in detections:
+            x, y, w, h = detection.rect
+            rect = (
+                left + int(x / scale), top + int(y / scale),
+                int(w / scale), int(h / scale)
+            )
+            result.append(QRDetection(detection.data, rect))
+        return result
+
+    def __call__(self, frame):
+        height, width = frame.shape[:2]
+        if self.roi is not None:
+            detections = self._decode_region(frame, *self._crop_rect(height, width))
+            if detections:
+                self._roi_misses = 0
+                self._track(detections)
+                return detections
+            self._roi_misses += 1
+            if self._roi_misses < self.roi_max_misses:
+                return []
+            self.reset()
+
+        detections = self._decode_region(frame, 0, 0, width, height)
+        if detections:
+            self._roi_min_scale = self._last_scale
+            self._track(detections)
+        return detections
+
+    def _track(self, detections):
+        """Область, охватывающая все найденные коды"""
+        if not self.track:
+            return
+        left = min(d.rect[0] for d in detections)
+        top = min(d.rect[1] for d in detections)
+        right = max(d.rect[0] + d.rect[2] for d in detections)
+        bottom = max(d.rect[1] + d.rect[3] for d in detections)
+        self.roi = (left, top, right - left, bottom - top)
+
+
+class ScanDebounceCache:
+    """
+    Кеш недавно считанных кодов
+
+    Камера, наведенная на QR КП, считывает его десятки раз в секунду.
+    Повтор того же содержимого в течение ttl секунд (отсчет от последнего
+    считывания) отбрасывается до проверки, криптографии и записи в хранилище.
+    Ключ - хеш содержимого, поэтому большие коды не хранятся целиком.
+    """
+
+    def __init__(self, ttl=SCAN_DEBOUNCE_TTL, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, data, now=None):
+        """
+        Проверка и запоминание кода
+
+        Args:
+            data: Содержимое кода (bytes)
+            now: Текущее время (time.monotonic()), для тестов
+
+        Returns:
+            bool: True, если код новый и его нужно обработать
+        """
+        if now is None:
+            now = time.monotonic()
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            entries = self._entries
+            # Записи упорядочены по времени - устаревшие в начале
+            while entries:
+                oldest_key, oldest_time = next(iter(entries.items()))
+                if now - oldest_time < self.ttl and len(entries) < self.max_entries:
+                    break
+                del entries[oldest_key]
+
+            repeat = key in entries
+            entries[key] = now
+            entries.move_to_end(key)
+            if repeat:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return not repeat
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        """Счетчики: {'hits', 'misses', 'size'}"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class CameraSource:
+    """Источник кадров с камеры через OpenCV"""
+
+    def __init__(self, index=0, width=None, height=None):
+        import cv2
+
+        self._capture = cv2.VideoCapture(index)
+        if width:
+            self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self._capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if not self._capture.isOpened():
+            raise OSError(f'Камера {index} недоступна')
+
+    def read(self):
+        """Следующий кадр или None, если камера не отдала кадр"""
+        ok, frame = self._capture.read()
+        return frame if ok else None
+
+    def close(self):
+        self._capture.release()
+
+
+def kivy_post(callback, *args):
+    """Вызов callback в главном потоке Kivy"""
+    from kivy.clock import Clock
+
+    Clock.schedule_once(lambda dt: callback(*args))
+
+
+class QRScanner:
+    """
+    Конвейер сканирования QR-кодов
+
+    Поток захвата читает кадры из источника и кладет их в очередь
+    ограниченного размера. Если декодер не успевает, старые кадры
+    выбрасываются - декодируется всегда самый свежий кадр, а задержка
+    не накапливается. Поток декодирования ищет коды и передает
+    результаты в главный поток через post (по умолчанию Clock Kivy),
+    поэтому предпросмотр не подтормаживает, а декодер работает
+    так быстро, как позволяет процессор.
+    """
+
+    def __init__(self, on_result, source=None, decoder=None, on_frame=None,
+                 post=kivy_post, queue_size=SCAN_QUEUE_SIZE, debounce=True):
+        """
+        Args:
+            on_result: Вызывается для каждого найденного кода (QRDetection)
+            source: Объект с методами read() и close() (по умолчанию камера 0)
+            decoder: Функция кадр -> список QRDetection (по умолчанию FramePreprocessor())
+            on_frame: Вызывается с каждым кадром для предпросмотра (опционально)
+            post: Функция доставки вызова в главный поток (None - вызывать из потока декодера)
+            queue_size: Сколько кадров может ждать декодирования
+            debounce: ScanDebounceCache, True - новый кеш, False - без подавления повторов
+        """
+        self.on_result = on_result
+        self.on_frame = on_frame
+        self.source = source
+        self.decoder = decoder or FramePreprocessor()
+        self.post = post
+        if debounce is True:
+            debounce = ScanDebounceCache()
+        self.debounce = debounce or None
+        self._frames = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._threads = []
+        # Кадр предпросмотра, еще не отрисованный главным потоком
+        self._preview_pending = False
+
+        self.frames_captured = 0
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stop.is_set()
+
+    def start(self):
+        """Запуск потоков захвата и декодирования"""
+        if self.running:
+            return
+        if self.source is None:
+            self.source = CameraSource()
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name='qr-capture', daemon=True),
+            threading.Thread(target=self._decode_loop, name='qr-decode', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def join(self, timeout=None):
+        """
+        Ожидание завершения потоков, например когда конечный источник
+        кадров (source.exhausted) закончился
+
+        Args:
+            timeout: Общее время ожидания в секундах (None - без ограничения)
+
+        Returns:
+            bool: True, если потоки завершились
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in list(self._threads):
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            thread.join(remaining)
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def stop(self):
+        """Остановка потоков и освобождение камеры"""
+        self._stop.set()
+        current = threading.current_thread()
+        for thread in self._threads:
+            if thread is not current:
+                thread.join(timeout=2)
+        self._threads = []
+        if self.source is not None:
+            self.source.close()
+
+    def _deliver(self, callback, *args):
+        if self.post is None:
+            callback(*args)
+        else:
+            self.post(callback, *args)
+
+    def _capture_loop(self):
+        while not self._stop.is_set():
+            frame = self.source.read()
+            if frame is None:
+                if getattr(self.source, 'exhausted', False):
+                    break
+                time.sleep(0.01)
+                continue
+            self.frames_captured += 1
+
+            if self.on_frame is not None and not self._preview_pending:
+                self._preview_pending = True
+                self._deliver(self._show_preview, frame)
+
+            try:
+                self._frames.put_nowait(frame)
+            except queue.Full:
+                # Декодер занят: заменяем ожидающий кадр свежим
+                try:
+                    self._frames.get_nowait()
+                    self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+                try:
+                    self._frames.put_nowait(frame)
+                except queue.Full:
+                    self.frames_dropped += 1
+
+    def _show_preview(self, frame):
+        self._preview_pending = False
+        self.on_frame(frame)
+
+    def _decode_loop(self):
+        while not self._stop.is_set():
+            try:
+                frame = self._frames.get(timeout=0.1)
+            except queue.Empty:
+                if not any(t.is_alive() for t in self._threads[:1]):
+                    break
+                continue
+            detections = self.decoder(frame)
+            self.frames_decoded += 1
+            for detection in detections:
+                if self.debounce is not None and not self.debounce.check(detection.data):
+                    continue
+                self._deliver(self.on_result, detection)
+
+
+class BatchScanSession:
+    """
+    Пакетное сканирование: все коды в кадре без повторов
+
+    Используется как on_result сканера. Каждый новый код сразу
+    передается в on_code, повторы (в том числе коды, известные до начала
+    сканирования) и коды, отклоненные проверкой accept, отбрасываются.
+    Так лист из 40 КП регистрируется за один проход камерой.
+    """
+
+    def __init__(self, on_code, seen=(), accept=None):
+        """
+        Args:
+            on_code: Вызывается с каждым новым кодом (QRDetection)
+            seen: Уже известные коды (bytes), например коды существующих КП
+            accept: Проверка кода: data -> bool (опционально)
+        """
+        self.on_code = on_code
+        self.accept = accept
+        self.seen = set(seen)
+        self.codes = []
+        self.duplicates = 0
+        self.rejected = 0
+
+    def __call__(self, detection):
+        data = detection.data
+        if data in self.seen:
+            self.duplicates += 1
+            return
+        if self.accept is not None and not self.accept(data):
+            self.rejected += 1
+            return
+        self.seen.add(data)
+        self.codes.append(data)
+        self.on_code(detection)
+
+
+def start_batch_scan(on_code, seen=(), accept=None, source=None, on_frame=None,
+                     post=kivy_post):
+    """
+    Запуск пакетного сканирования
+
+    Args:
+        on_code: Вызывается в главном потоке с каждым новым кодом
+        seen: Коды, которые уже известны и не должны повторяться
+        accept: Проверка кода (опционально)
+        source: Источник кадров (по умолчанию камера)
+        on_frame: Предпросмотр (опционально)
+        post: Доставка вызовов в главный поток
+
+    Returns:
+        tuple: (QRScanner, BatchScanSession) - сканер уже запущен
+    """
+    session = BatchScanSession(on_code, seen=seen, accept=accept)
+    scanner = QRScanner(
+        session,
+        source=source,
+        decoder=FramePreprocessor(max_side=BATCH_SCAN_MAX_SIDE, track=False),
+        on_frame=on_frame,
+        post=post
+    )
+    scanner.start()
+    return scanner, session
+
+
+def frame_to_texture(frame, texture=None):
+    """
+    Отрисовка кадра камеры (BGR, numpy) в текстуру Kivy
+
+    Args:
+        frame: Кадр OpenCV
+        texture: Текстура для повторного использования (если размер совпадает)
+
+    Returns:
+        Texture: Текстура с кадром
+    """
+    from kivy.graphics.texture import Texture
+
+    height, width = frame.shape[:2]
+    colorfmt = 'luminance' if frame.ndim == 2 else 'bgr'
+    if texture is None or texture.size != (width, height) or texture.colorfmt != colorfmt:
+        texture = Texture.create(size=(width, height), colorfmt=colorfmt)
+        # Кадр OpenCV начинается сверху, текстура Kivy - снизу
+        texture.flip_vertical()
+    texture.blit_buffer(frame.tobytes(), colorfmt=colorfmt, bufferfmt='ubyte')
+    return texture
+
+
+def open_scanner_popup(callback_success, title='Сканирование QR-кода', source=None):
+    """
+    Окно сканирования с предпросмотром камеры
+
+    Закрывается после первого найденного кода. Кадры анимированной
+    серии (FountainEncoder) собираются, пока данные не восстановятся
+    полностью, прогресс показывается в заголовке.
+
+    Args:
+        callback_success: Функция, вызываемая с данными кода или серии (bytes)
+        title: Заголовок окна
+        source: Источник кадров (по умолчанию камера)
+
+    Returns:
+        Popup: Открытое окно или None, если камера недоступна
+    """
+    from kivy.uix.popup import Popup
+    from kivy.uix.boxlayout import BoxLayout
+    from kivy.uix.button import Button
+    from kivy.uix.image import Image
+    from kivy.uix.label import Label
+    from kivy.metrics import dp
+
+    content = BoxLayout(orientation='vertical', spacing=dp(10), padding=dp(10))
+    preview = Image(allow_stretch=True)
+    content.add_widget(preview)
+
+    cancel_btn = Button(
+        text='Отмена',
+        size_hint_y=None,
+        height=dp(50),
+        background_normal='',
+        background_color=(0.7, 0.7, 0.7, 1),
+        color=(0.2, 0.2, 0.2, 1)
+    )
+    content.add_widget(cancel_btn)
+
+    popup = Popup(
+        title=title,
+        content=content,
+        size_hint=(0.9, 0.8),
+        auto_dismiss=False
+    )
+
+    def show_frame(frame):
+        preview.texture = frame_to_texture(frame, preview.texture)
+        preview.canvas.ask_update()
+
+    fountain = FountainDecoder()
+
+    def on_result(detection):
+        if not scanner.running:
+            return
+        data = detection.data
+        if is_fountain_frame(data):
+            if not fountain.add_frame(data):
+                popup.title = f'{title}: {int(fountain.progress * 100)}%'
+                return
+            data = fountain.payload
+        scanner.stop()
+        popup.dismiss()
+        callback_success(data)
+
+    try:
+        scanner = QRScanner(on_result, source=source or CameraSource(), on_frame=show_frame)
+    except (ImportError, OSError) as e:
+        Popup(
+            title='Ошибка',
+            content=Label(text=f'Камера недоступна: {e}'),
+            size_hint=(0.7, 0.3),
+            auto_dismiss=True
+        ).open()
+        return None
+
+    cancel_btn.bind(on_press=lambda x: popup.dismiss())
+    popup.bind(on_dismiss=lambda x: scanner.stop())
+    popup.open()
+    scanner.start()
+    return popup
+
+
+def open_batch_scanner_popup(on_code, seen=(), accept=None, callback_done=None,
+                             title='Пакетное сканирование', source=None):
+    """
+    Окно пакетного сканирования с предпросмотром и счетчиком кодов
+
+    Args:
+        on_code: Вызывается с данными каждого нового кода (bytes)
+        seen: Уже известные коды (bytes)
+        accept: Проверка кода (опционально)
+        callback_done: Вызывается со списком новых кодов при закрытии окна
+        title: Заголовок окна
+        source: Источник кадров (по умолчанию камера)
+
+    Returns:
+        Popup: Открытое окно или None, если камера недоступна
+    """
+    from kivy.uix.popup import Popup
+    from kivy.uix.boxlayout import BoxLayout
+    from kivy.uix.button import Button
+    from kivy.uix.image import Image
+    from kivy.uix.label import Label
+    from kivy.metrics import dp
+
+    content = BoxLayout(orientation='vertical', spacing=dp(10), padding=dp(10))
+    preview = Image(allow_stretch=True)
+    content.add_widget(preview)
+
+    counter_label = Label(text='Найдено кодов: 0', size_hint_y=None, height=dp(30))
+    content.add_widget(counter_label)
+
+    done_btn = Button(
+        text='Готово',
+        size_hint_y=None,
+        height=dp(50),
+        background_normal='',
+        background_color=(0.2, 0.4, 0.8, 1),
+        color=(1, 1, 1, 1)
+    )
+    content.add_widget(done_btn)
+
+    popup = Popup(
+        title=title,
+        content=content,
+        size_hint=(0.9, 0.8),
+        auto_dismiss=False
+    )
+
+    def show_frame(frame):
+        preview.texture = frame_to_texture(frame, preview.texture)
+        preview.canvas.ask_update()
+
+    def on_new_code(detection):
+        counter_label.text = f'Найдено кодов: {len(session.codes)}'
+        on_code(detection.data)
+
+    try:
+        scanner, session = start_batch_scan(
+            on_new_code,
+            seen=seen,
+            accept=accept,
+            source=source or CameraSource(),
+            on_frame=show_frame
+        )
+    except (ImportError, OSError) as e:
+        Popup(
+            title='Ошибка',
+            content=Label(text=f'Камера недоступна: {e}'),
+            size_hint=(0.7, 0.3),
+            auto_dismiss=True
+        ).open()
+        return None
+
+    def on_dismiss(instance):
+        scanner.stop()
+        if callback_done:
+            callback_done(list(session.codes))
+
+    done_btn.bind(on_press=lambda x: popup.dismiss())
+    popup.bind(on_dismiss=on_dismiss)
+    popup.open()
+    return popup
+
+
+def qr_matrix(data, border=4):
+    """
+    Матрица модулей QR-кода: один модуль - один пиксель
+
+    Args:
+        data: Содержимое (bytes - двоичные данные, см. qr_text; str - текст)
+        border: Ширина белой рамки в модулях
+
+    Returns:
+        numpy.ndarray: uint8, 0 - черный модуль, 255 - белый
+    """
+    import numpy as np
+    import qrcode
+
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        border=border
+    )
+    qr.add_data(qr_text(data))
+    qr.make(fit=True)
+    modules = np.array(qr.get_matrix(), dtype=bool)
+    return np.where(modules, 0, 255).astype(np.uint8)
+
+
+def matrix_to_texture(matrix):
+    """
+    Текстура Kivy из матрицы модулей
+
+    Текстура размером в один пиксель на модуль растягивается виджетом
+    с фильтром nearest, поэтому края модулей остаются четкими.
+    """
+    import numpy as np
+    from kivy.graphics.texture import Texture
+
+    height, width = matrix.shape
+    # RGBA: строки всегда выровнены по 4 байта, что требует OpenGL ES
+    pixels = np.repeat(np.flipud(matrix)[:, :, None], 4, axis=2)
+    pixels[:, :, 3] = 255
+    texture = Texture.create(size=(width, height), colorfmt='rgba')
+    texture.mag_filter = 'nearest'
+    texture.min_filter = 'nearest'
+    texture.blit_buffer(pixels.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+    return texture
+
+
+class QRTextureCache:
+    """LRU-кеш текстур QR-кодов по содержимому"""
+
+    def __init__(self, max_size=QR_TEXTURE_CACHE_SIZE):
+        self.max_size = max_size
+        self._textures = OrderedDict()
+
+    def get(self, data, border=4):
+        """Текстура для содержимого (строится при первом запросе)"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        key = (data, border)
+        texture = self._textures.get(key)
+        if texture is not None:
+            self._textures.move_to_end(key)
+            return texture
+        texture = matrix_to_texture(qr_matrix(data, border))
+        self._textures[key] = texture
+        while len(self._textures) > self.max_size:
+            self._textures.popitem(last=False)
+        return texture
+
+    def clear(self):
+        self._textures.clear()
+
+
+_texture_cache = QRTextureCache()
+
+
+def qr_texture(data, border=4):
+    """
+    Текстура QR-кода из общего кеша
+
+    Args:
+        data: Содержимое (bytes или str)
+        border: Ширина белой рамки в модулях
+
+    Returns:
+        Texture: Текстура Kivy (один пиксель на модуль)
+    """
+    return _texture_cache.get(data, border)
+
+
+def open_qr_popup(payload, title='QR-код'):
+    """
+    Показ QR-кода на экране
+
+    Небольшие данные показываются одним QR-кодом, большие - анимированной
+    серией кадров FountainEncoder, которую принимающий телефон собирает
+    из любых считанных кадров.
+
+    Args:
+        payload: Данные для передачи (bytes или str)
+        title: Заголовок окна
+
+    Returns:
+        Popup: Открытое окно
+    """
+    from kivy.clock import Clock
+    from kivy.uix.popup import Popup
+    from kivy.uix.boxlayout import BoxLayout
+    from kivy.uix.button import Button
+    from kivy.uix.image import Image
+    from kivy.metrics import dp
+
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    content = BoxLayout(orientation='vertical', spacing=dp(10), padding=dp(10))
+    image = Image(allow_stretch=True, keep_ratio=True)
+    content.add_widget(image)
+
+    close_btn = Button(
+        text='Закрыть',
+        size_hint_y=None,
+        height=dp(50),
+        background_normal='',
+        background_color=(0.7, 0.7, 0.7, 1),
+        color=(0.2, 0.2, 0.2, 1)
+    )
+    content.add_widget(close_btn)
+
+    popup = Popup(
+        title=title,
+        content=content,
+        size_hint=(0.95, 0.8),
+        auto_dismiss=False
+    )
+
+    animation = None
+    if len(payload) <= SCREEN_QR_MAX_BYTES:
+        image.texture = qr_texture(payload)
+    else:
+        frames = FountainEncoder(payload).frames()
+
+        def next_frame(dt):
+            # Кадры серии не повторяются - в кеш их не кладем
+            image.texture = matrix_to_texture(qr_matrix(next(frames)))
+
+        next_frame(0)
+        animation = Clock.schedule_interval(next_frame, 1.0 / ANIMATED_QR_FPS)
+
+    def on_dismiss(instance):
+        if animation is not None:
+            animation.cancel()
+
+    close_btn.bind(on_press=lambda x: popup.dismiss())
+    popup.bind(on_dismiss=on_dismiss)
+    popup.open()
+    return popup
+
+
+def cp_qr_content(cp):
+    """Содержимое QR-кода КП: код КП, а если он не задан - название"""
+    return cp.get('code') or cp['name']
+
+
+def _cp_image_key(content, module_px):
+    """Имя файла в кеше: хеш содержимого и параметров отрисовки"""
+    digest = hashlib.sha256(f'{module_px}:{content}'.encode('utf-8')).hexdigest()
+    return digest[:32]
+
+
+def _render_cp_image(job):
+    """
+    Отрисовка одного QR-кода КП в PNG (выполняется в процессе пула)
+
+    Args:
+        job: (содержимое, размер модуля в пикселях, путь к файлу)
+    """
+    import numpy as np
+    from PIL import Image as PILImage
+
+    content, module_px, path = job
+    matrix = qr_matrix(content)
+    pixels = np.kron(matrix, np.ones((module_px, module_px), dtype=np.uint8))
+    tmp_path = path + '.tmp'
+    PILImage.fromarray(pixels, mode='L').save(tmp_path, format='PNG')
+    os.replace(tmp_path, path)
+    return path
+
+
+def _load_font(font_path, size):
+    from PIL import ImageFont
+
+    for candidate in (font_path, 'DejaVuSans.ttf', 'Roboto-Regular.ttf'):
+        if not candidate:
+            continue
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1: шрифт по умолчанию без выбора размера
+        return ImageFont.load_default()
+
+
+def export_cp_sheets(checkpoints, out_dir, cache_dir=None, workers=None,
+                     module_px=SHEET_MODULE_PX, font_path=None):
+    """
+    Листы с QR-кодами всех КП для печати
+
+    QR-коды рисуются параллельно в пуле процессов и кешируются по хешу
+    содержимого, поэтому после правки одного КП заново рисуется только
+    его код, а листы лишь пересобираются из готовых картинок.
+
+    Args:
+        checkpoints: Список КП (словари с 'name' и, если есть, 'code')
+        out_dir: Каталог для листов (page_001.png, ...)
+        cache_dir: Каталог кеша QR-кодов (по умолчанию out_dir/cache)
+        workers: Число процессов (None - по числу ядер, 1 - без пула)
+        module_px: Размер модуля QR в пикселях
+        font_path: Шрифт TTF для подписей (нужна кириллица)
+
+    Returns:
+        list: Пути к файлам листов
+    """
+    from PIL import Image as PILImage
+    from PIL import ImageDraw
+
+    if cache_dir is None:
+        cache_dir = os.path.join(out_dir, 'cache')
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    items = []
+    jobs = {}
+    for cp in checkpoints:
+        content = cp_qr_content(cp)
+        path = os.path.join(cache_dir, _cp_image_key(content, module_px) + '.png')
+        items.append((cp['name'], path))
+        if not os.path.exists(path):
+            jobs[path] = (content, module_px, path)
+
+    if len(jobs) > 1 and workers != 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_render_cp_image, jobs.values()))
+    else:
+        for job in jobs.values():
+            _render_cp_image(job)
+
+    page_width, page_height = SHEET_PAGE_SIZE
+    columns, rows = SHEET_GRID
+    cell_width = (page_width - 2 * SHEET_MARGIN_PX) // columns
+    cell_height = (page_height - 2 * SHEET_MARGIN_PX) // rows
+    qr_side = min(cell_width, cell_height - SHEET_LABEL_PX) - SHEET_MARGIN_PX // 2
+    font = _load_font(font_path, SHEET_LABEL_PX * 2 // 3)
+
+    pages = []
+    per_page = columns * rows
+    for page_index in range(0, len(items), per_page):
+        page = PILImage.new('L', SHEET_PAGE_SIZE, 255)
+        draw = ImageDraw.Draw(page)
+        for cell, (name, path) in enumerate(items[page_index:page_index + per_page]):
+            row, column = divmod(cell, columns)
+            left = SHEET_MARGIN_PX + column * cell_width
+            top = SHEET_MARGIN_PX + row * cell_height
+            with PILImage.open(path) as image:
+                # Увеличение в целое число раз, чтобы модули остались одинаковыми
+                factor = qr_side / image.width
+                if factor >= 2:
+                    side = image.width * int(factor)
+                    image = image.resize((side, side), PILImage.NEAREST)
+                elif factor < 1:
+                    image = image.resize((qr_side, qr_side), PILImage.NEAREST)
+                page.paste(image, (left + (cell_width - image.width) // 2, top))
+                label_top = top + image.height + 4
+            text_width = draw.textlength(name, font=font)
+            draw.text((left + (cell_width - text_width) / 2, label_top), name, fill=0, font=font)
+
+        page_path = os.path.join(out_dir, f'page_{len(pages) + 1:03d}.png')
+        page.save(page_path, format='PNG')
+        pages.append(page_path)
+    return pages
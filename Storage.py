@@ -0,0 +1,1276 @@
+"""
+Модуль хранения данных
+
+Функционал:
+- Отложенная запись (write-behind) JsonStore в фоновом потоке
+- Атомарная запись файлов (временный файл + переименование) и
+  групповой fsync для нескольких изменений
+- Восстановление файлов данных после сбоя при старте
+- Общие экземпляры хранилищ для всего приложения
+- Каталог соревнований с ленивой загрузкой данных каждого соревнования
+- Хранилище версий соревнования с дедупликацией неизмененных частей
+- Структурные патчи между версиями соревнования
+- Шифрование файлов на диске по записям (разделы, экипажи, КП; AES-GCM):
+  правка перешифровывает только измененные записи
+"""
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from kivy.storage.jsonstore import JsonStore
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+
+# Пауза после последнего изменения, после которой данные пишутся на диск (сек)
+FLUSH_DELAY = 0.5
+# Максимальное время жизни несохраненных изменений при непрерывной записи (сек)
+FLUSH_MAX_DELAY = 3.0
+# Суффиксы служебных файлов атомарной записи и восстановления
+TMP_SUFFIX = '.tmp'
+CORRUPT_SUFFIX = '.corrupt'
+# Каталог соревнований и файл его индекса
+RACES_DIR = 'races'
+RACE_INDEX_FILE = 'index.json'
+# Поля, по которым элементы списков сопоставляются между версиями
+# (КП - по названию, экипажи - по номеру, СКП - по номеру)
+PATCH_KEY_FIELDS = ('name', 'номер', 'number')
+# Шифрованные файлы: суффикс журнала незавершенной записи
+# и расширение файлов соревнований
+JOURNAL_SUFFIX = '.journal'
+ENCRYPTED_EXTENSION = '.enc'
+# Разделы соревнования, которые шифруются по записи на элемент
+RACE_ITEM_SECTIONS = ('members', 'checkpoints')
+
+
+def _fsync_dir(folder):
+    """Сброс на диск записи каталога (нужно после переименования файла)"""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        # Например, Windows не позволяет открыть каталог
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data, fsync=True):
+    """
+    Атомарная запись файла
+
+    Данные пишутся во временный файл рядом с целевым, сбрасываются на диск
+    и переименовываются поверх него. При сбое на диске остается либо старая,
+    либо новая версия файла целиком, но не обрезанная.
+
+    Args:
+        path: Путь к файлу
+        data: Содержимое (bytes или str, str пишется в UTF-8)
+        fsync: Сбрасывать ли данные на диск перед переименованием
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    tmp_path = path + TMP_SUFFIX
+    with open(tmp_path, 'wb') as fd:
+        fd.write(data)
+        fd.flush()
+        if fsync:
+            os.fsync(fd.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        _fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+def _is_valid_json(path):
+    """Проверка, что файл существует и содержит полный JSON"""
+    try:
+        with open(path, encoding='utf-8') as fd:
+            data = fd.read()
+    except (OSError, UnicodeDecodeError):
+        return False
+    if not data:
+        # Пустой файл JsonStore считает пустым хранилищем
+        return True
+    try:
+        json.loads(data)
+    except ValueError:
+        return False
+    return True
+
+
+def recover(path):
+    """
+    Восстановление JSON-файла после сбоя записи
+
+    - Если основной файл отсутствует или поврежден, а временный файл
+      записан полностью, временный файл становится основным
+      (сбой произошел между fsync и переименованием).
+    - Недописанный временный файл удаляется.
+    - Поврежденный основной файл без замены переименовывается
+      в *.corrupt, чтобы приложение стартовало с пустыми данными,
+      а старые данные можно было разобрать вручную.
+
+    Args:
+        path: Путь к файлу данных
+
+    Returns:
+        bool: True, если файл пришлось восстанавливать
+    """
+    tmp_path = path + TMP_SUFFIX
+    main_ok = os.path.exists(path) and _is_valid_json(path)
+    repaired = False
+
+    if os.path.exists(tmp_path):
+        if not main_ok and _is_valid_json(tmp_path):
+            os.replace(tmp_path, path)
+            main_ok = True
+        else:
+            os.remove(tmp_path)
+        repaired = True
+
+    if not main_ok and os.path.exists(path):
+        os.replace(path, path + CORRUPT_SUFFIX)
+        print(f"Файл {path} поврежден, сохранен как {path + CORRUPT_SUFFIX}")
+        repaired = True
+
+    if repaired:
+        _fsync_dir(os.path.dirname(os.path.abspath(path)))
+    return repaired
+
+
+class WriteBehindJsonStore(JsonStore):
+    """
+    JsonStore с отложенной записью на диск
+
+    put/delete меняют данные в памяти и сразу возвращаются. Файл пишет
+    фоновый поток, когда поток изменений затихнет на flush_delay секунд
+    (но не позже flush_max_delay после первого несохраненного изменения),
+    поэтому серия быстрых правок превращается в одну запись.
+
+    Файл пишется атомарно, а при открытии восстанавливается после сбоя
+    (см. recover). Если изменение должно гарантированно попасть на диск
+    (например, регистрация экипажа), вызовите commit(): все вызовы commit,
+    пришедшие во время текущей записи, разделят следующий fsync.
+    """
+
+    def __init__(self, filename, flush_delay=FLUSH_DELAY,
+                 flush_max_delay=FLUSH_MAX_DELAY, **kwargs):
+        self.flush_delay = flush_delay
+        self.flush_max_delay = flush_max_delay
+        # Защищает _data и флаги изменений
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        # Упорядочивает записи файла (фоновый поток и явный flush)
+        self._write_lock = threading.Lock()
+        self._dirty_since = None
+        self._last_change = None
+        self._closed = False
+        # Номер последнего изменения и последнего изменения, записанного на диск
+        self._generation = 0
+        self._durable_generation = 0
+        self._commit_requested = False
+        super().__init__(filename, **kwargs)
+
+        self._worker = threading.Thread(
+            target=self._flush_loop,
+            name=f'write-behind:{filename}',
+            daemon=True
+        )
+        self._worker.start()
+
+    def store_load(self):
+        recover(self.filename)
+        super().store_load()
+
+    def store_put(self, key, value):
+        with self._lock:
+            self._generation += 1
+            return super().store_put(key, value)
+
+    def store_delete(self, key):
+        with self._lock:
+            self._generation += 1
+            return super().store_delete(key)
+
+    def store_sync(self):
+        """Планирование записи вместо немедленной записи файла"""
+        with self._lock:
+            if not self._is_changed:
+                return
+            now = time.monotonic()
+            if self._dirty_since is None:
+                self._dirty_since = now
+            self._last_change = now
+            self._changed.notify_all()
+
+    def flush(self):
+        """
+        Немедленная запись несохраненных изменений на диск
+
+        Returns:
+            bool: True, если файл был записан
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._is_changed:
+                    self._dirty_since = None
+                    self._durable_generation = self._generation
+                    return False
+                data = self._serialize()
+                generation = self._generation
+                self._is_changed = False
+                self._dirty_since = None
+                self._commit_requested = False
+
+            try:
+                self._write_file(data)
+            except OSError:
+                # Возвращаем флаг изменений, чтобы запись повторилась
+                with self._lock:
+                    self._is_changed = True
+                    if self._dirty_since is None:
+                        self._dirty_since = time.monotonic()
+                raise
+
+            with self._lock:
+                self._durable_generation = max(self._durable_generation, generation)
+                self._changed.notify_all()
+            return True
+
+    def commit(self, timeout=None):
+        """
+        Ожидание записи на диск всех изменений, сделанных до вызова
+
+        Запись запускается сразу, без паузы debounce. Несколько вызовов
+        commit подряд или из разных потоков объединяются в одну запись.
+
+        Args:
+            timeout: Максимальное время ожидания в секундах (None - без ограничения)
+
+        Returns:
+            bool: True, если изменения записаны на диск
+        """
+        with self._lock:
+            target = self._generation
+            if self._durable_generation >= target:
+                return True
+            if not self._closed:
+                self._commit_requested = True
+                if self._dirty_since is None:
+                    self._dirty_since = self._last_change = time.monotonic()
+                self._changed.notify_all()
+                return self._changed.wait_for(
+                    lambda: self._durable_generation >= target,
+                    timeout
+                )
+        # Фоновый поток остановлен - пишем сами
+        self.flush()
+        return True
+
+    def _serialize(self):
+        """Снимок данных для записи (вызывается под блокировкой)"""
+        return json.dumps(self._data, indent=self.indent, sort_keys=self.sort_keys)
+
+    def _write_file(self, data):
+        """Атомарная запись сериализованных данных в файл"""
+        atomic_write(self.filename, data)
+
+    def close(self):
+        """Остановка фонового потока с записью оставшихся изменений"""
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+        self._worker.join()
+        self.flush()
+
+    def _flush_loop(self):
+        """Фоновый поток: запись после затихания изменений"""
+        while True:
+            with self._lock:
+                while not self._closed and self._dirty_since is None:
+                    self._changed.wait()
+                if self._closed:
+                    return
+                if self._commit_requested:
+                    delay = 0
+                else:
+                    deadline = min(
+                        self._last_change + self.flush_delay,
+                        self._dirty_since + self.flush_max_delay
+                    )
+                    delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._changed.wait(delay)
+                    continue
+
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Ошибка записи {self.filename}: {e}")
+                # Не повторяем запись чаще, чем раз в flush_max_delay
+                time.sleep(self.flush_max_delay)
+
+
+# Заголовок шифрованного файла: метка, идентификатор файла, смещение
+# и размер манифеста, nonce и тег, подтверждающий заголовок
+_ENC_MAGIC = b'FER1'
+_ENC_HEADER = struct.Struct('>4s16sQI12s16s')
+_ENC_NONCE_SIZE = 12
+_ENC_TAG_SIZE = 16
+# Запись манифеста: смещение и размер зашифрованной записи, SHA-256 открытого текста
+_ENC_MANIFEST_ENTRY = struct.Struct('>QI32s')
+_ENC_MANIFEST_AAD = b'manifest'
+
+
+class EncryptedRecordFile:
+    """
+    Файл из отдельно зашифрованных записей (AES-GCM)
+
+    Данные хранятся списком записей - разделов JSON, экипажей, КП
+    (см. json_records), а не блоками фиксированного размера: изменение
+    длины одной записи не сдвигает остальные, и правка перешифровывает
+    только измененные записи. Запись адресуется хешем своего открытого
+    текста, он вместе с идентификатором файла входит в проверяемые данные,
+    поэтому записи нельзя подменить или перенести в другой файл.
+
+    Порядок записей задает манифест - тоже зашифрованная запись, на
+    которую указывает заголовок, подтвержденный тем же ключом. Новые
+    записи и манифест дописываются в конец файла, затем переключается
+    заголовок (через журнал), поэтому сбой посреди записи оставляет
+    предыдущую версию целой. Когда неиспользуемых байт становится больше,
+    чем используемых, файл переписывается целиком - без перешифрования,
+    зашифрованные записи копируются как есть.
+    """
+
+    def __init__(self, path, key):
+        """
+        Args:
+            path: Путь к файлу
+            key: Ключ AES (16, 24 или 32 байта)
+        """
+        self.path = path
+        self._aead = AESGCM(key)
+        self._lock = threading.RLock()
+        self.file_id = os.urandom(16)
+        # Хеш записи -> (смещение, размер) ее зашифрованного слота
+        self._slots = {}
+        # Записи текущей версии: (смещение, размер, хеш)
+        self._entries = []
+        self._manifest = None
+        self._end = _ENC_HEADER.size
+        # Недописанная новая версия (создание или сжатие файла) - мусор
+        if os.path.exists(path + TMP_SUFFIX):
+            os.remove(path + TMP_SUFFIX)
+        self._replay_journal()
+        file_size = os.path.getsize(path) if os.path.exists(path) else 0
+        if 0 < file_size < _ENC_HEADER.size:
+            # Сбой при создании файла: ни одна версия не была записана
+            print(f"Файл {self.path}: недописанный заголовок, файл пуст")
+        elif file_size:
+            with open(path, 'rb') as fd:
+                header = fd.read(_ENC_HEADER.size)
+                self.file_id, offset, size = self._parse_header(header)
+                if size:
+                    fd.seek(offset)
+                    manifest = self._decrypt(fd.read(size), _ENC_MANIFEST_AAD)
+            # Манифест (0, 0) - пустой файл (так создавали файл прежние версии)
+            if size:
+                self._manifest = (offset, size)
+                self._entries = [
+                    _ENC_MANIFEST_ENTRY.unpack_from(manifest, position)
+                    for position in range(0, len(manifest), _ENC_MANIFEST_ENTRY.size)
+                ]
+                self._slots = {digest: (offset, size) for offset, size, digest in self._entries}
+            # Хвост после сбоя до переключения заголовка считается мусором
+            self._end = file_size
+
+    @property
+    def live_size(self):
+        """Байт, занятых записями текущей версии и манифестом"""
+        total = _ENC_HEADER.size + sum(size for _, size in self._slots.values())
+        if self._manifest is not None:
+            total += self._manifest[1]
+        return total
+
+    def _header(self, manifest_offset, manifest_size):
+        fields = _ENC_MAGIC, self.file_id, manifest_offset, manifest_size
+        nonce = os.urandom(_ENC_NONCE_SIZE)
+        tag = self._aead.encrypt(nonce, b'', _ENC_HEADER.pack(*fields, b'', b''))
+        return _ENC_HEADER.pack(*fields, nonce, tag)
+
+    def _parse_header(self, header):
+        if len(header) != _ENC_HEADER.size:
+            raise ValueError(f'{self.path}: нет заголовка')
+        magic, file_id, offset, size, nonce, tag = _ENC_HEADER.unpack(header)
+        if magic != _ENC_MAGIC:
+            raise ValueError(f'{self.path}: не зашифрованный файл')
+        fields = _ENC_HEADER.pack(magic, file_id, offset, size, b'', b'')
+        try:
+            self._aead.decrypt(nonce, tag, fields)
+        except InvalidTag:
+            raise ValueError(f'{self.path}: неверный ключ или заголовок поврежден')
+        return file_id, offset, size
+
+    def _encrypt(self, data, aad):
+        nonce = os.urandom(_ENC_NONCE_SIZE)
+        return nonce + self._aead.encrypt(nonce, data, self.file_id + aad)
+
+    def _decrypt(self, slot, aad):
+        try:
+            return self._aead.decrypt(
+                slot[:_ENC_NONCE_SIZE], slot[_ENC_NONCE_SIZE:], self.file_id + aad
+            )
+        except InvalidTag:
+            raise ValueError(f'{self.path}: запись повреждена')
+
+    def read_records(self):
+        """
+        Записи текущей версии по порядку
+
+        Returns:
+            list: Открытый текст записей (bytes)
+        """
+        with self._lock:
+            if not self._entries:
+                return []
+            with open(self.path, 'rb') as fd:
+                records = []
+                for offset, size, digest in self._entries:
+                    fd.seek(offset)
+                    records.append(self._decrypt(fd.read(size), digest))
+            return records
+
+    def write_records(self, records):
+        """
+        Замена содержимого списком записей
+
+        Шифруются только записи, которых нет в файле (по хешу), остальные
+        остаются на месте, даже если их порядок изменился.
+
+        Returns:
+            int: Сколько записей зашифровано
+        """
+        with self._lock:
+            slots = {}
+            appended = []
+            entries = []
+            end = self._end
+            for record in records:
+                record = bytes(record)
+                digest = hashlib.sha256(record).digest()
+                slot = self._slots.get(digest) or slots.get(digest)
+                if slot is None:
+                    blob = self._encrypt(record, digest)
+                    slot = (end, len(blob))
+                    appended.append(blob)
+                    end += len(blob)
+                slots[digest] = slot
+                entries.append((slot[0], slot[1], digest))
+            if entries == self._entries and os.path.exists(self.path):
+                return 0
+
+            manifest = self._manifest_blob(entries)
+            live = _ENC_HEADER.size + sum(size for _, size in slots.values()) + len(manifest)
+            if end + len(manifest) > 2 * live:
+                self._compact(slots, entries, appended)
+            else:
+                self._append(appended, manifest)
+                self._slots = slots
+                self._entries = entries
+                self._manifest = (end, len(manifest))
+                self._end = end + len(manifest)
+            return len(appended)
+
+    def _manifest_blob(self, entries):
+        return self._encrypt(
+            b''.join(_ENC_MANIFEST_ENTRY.pack(*entry) for entry in entries),
+            _ENC_MANIFEST_AAD
+        )
+
+    def _append(self, appended, manifest):
+        """
+        Дописывание новых записей и манифеста, затем переключение
+        заголовка через журнал
+
+        Новый файл пишется целиком через atomic_write: на диске не бывает
+        заголовка без манифеста, на который он указывает.
+        """
+        end = self._end + sum(len(blob) for blob in appended)
+        header = self._header(end, len(manifest))
+        if not os.path.exists(self.path):
+            padding = b'\0' * (self._end - _ENC_HEADER.size)
+            atomic_write(self.path, header + padding + b''.join(appended) + manifest)
+            return
+        with open(self.path, 'r+b') as fd:
+            fd.seek(self._end)
+            fd.write(b''.join(appended) + manifest)
+            fd.truncate()
+            fd.flush()
+            os.fsync(fd.fileno())
+        journal_path = self.path + JOURNAL_SUFFIX
+        atomic_write(journal_path, header + hashlib.sha256(header).digest())
+        self._write_header(header)
+        os.remove(journal_path)
+
+    def _compact(self, slots, entries, appended):
+        """
+        Атомарная перезапись файла только с записями текущей версии
+
+        Зашифрованные записи копируются как есть: в проверяемые данные
+        входит хеш записи, а не ее смещение.
+        """
+        new_blobs = {}
+        position = self._end
+        for blob in appended:
+            new_blobs[position] = blob
+            position += len(blob)
+        parts = []
+        moved = {}
+        offset = _ENC_HEADER.size
+        fd = None
+        try:
+            for digest, (old_offset, size) in slots.items():
+                blob = new_blobs.get(old_offset)
+                if blob is None:
+                    if fd is None:
+                        fd = open(self.path, 'rb')
+                    fd.seek(old_offset)
+                    blob = fd.read(size)
+                parts.append(blob)
+                moved[digest] = (offset, size)
+                offset += size
+        finally:
+            if fd is not None:
+                fd.close()
+        entries = [(moved[digest][0], moved[digest][1], digest) for _, _, digest in entries]
+        manifest = self._manifest_blob(entries)
+        header = self._header(offset, len(manifest))
+        atomic_write(self.path, header + b''.join(parts) + manifest)
+        self._slots = moved
+        self._entries = entries
+        self._manifest = (offset, len(manifest))
+        self._end = offset + len(manifest)
+
+    def _write_header(self, header):
+        with open(self.path, 'r+b') as fd:
+            fd.write(header)
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    def _replay_journal(self):
+        """Переключение заголовка, прерванное сбоем"""
+        journal_path = self.path + JOURNAL_SUFFIX
+        # Недописанный журнал: заголовок еще не менялся
+        if os.path.exists(journal_path + TMP_SUFFIX):
+            os.remove(journal_path + TMP_SUFFIX)
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path, 'rb') as fd:
+            journal = fd.read()
+        header, digest = journal[:-32], journal[-32:]
+        if len(header) == _ENC_HEADER.size and hashlib.sha256(header).digest() == digest:
+            self._parse_header(header)
+            self._write_header(header)
+            print(f"Файл {self.path}: прерванная запись завершена по журналу")
+        os.remove(journal_path)
+
+
+def json_records(data, item_sections=()):
+    """
+    Разбиение JSON-словаря на записи для EncryptedRecordFile
+
+    Каждый ключ верхнего уровня - отдельная запись, а списки из
+    item_sections (экипажи, КП) - по записи на элемент, как блоки
+    RaceVersionStore. Порядок ключей сохраняется.
+
+    Returns:
+        list: Записи (bytes)
+    """
+    def dump(value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    records = []
+    for key, value in data.items():
+        if key in item_sections and isinstance(value, list):
+            records.append(dump({'k': key, 'v': []}))
+            records.extend(dump({'k': key, 'i': item}) for item in value)
+        else:
+            records.append(dump({'k': key, 'v': value}))
+    return records
+
+
+def json_from_records(records):
+    """Сборка словаря из записей json_records"""
+    data = {}
+    for record in records:
+        entry = json.loads(record)
+        if 'i' in entry:
+            data[entry['k']].append(entry['i'])
+        else:
+            data[entry['k']] = entry['v']
+    return data
+
+
+class EncryptedJsonStore(WriteBehindJsonStore):
+    """
+    WriteBehindJsonStore с шифрованием файла по записям (EncryptedRecordFile)
+
+    Каждый ключ хранилища - отдельная запись, поэтому правка одного
+    значения перешифровывает только его.
+    """
+
+    def __init__(self, filename, key, **kwargs):
+        self._file = EncryptedRecordFile(filename, key)
+        super().__init__(filename, **kwargs)
+
+    def store_load(self):
+        self._data = json_from_records(self._file.read_records())
+
+    def _serialize(self):
+        return json_records(self._data)
+
+    def _write_file(self, records):
+        self._file.write_records(records)
+
+
+# Общие хранилища: один экземпляр на файл, чтобы все экраны видели
+# одни и те же данные в памяти, даже если они еще не записаны на диск
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(filename, key=None):
+    """
+    Получение общего хранилища для файла
+
+    Args:
+        filename: Путь к JSON-файлу
+        key: Ключ шифрования файла (None - файл не шифруется)
+
+    Returns:
+        WriteBehindJsonStore: Хранилище, общее для всего приложения
+    """
+    with _stores_lock:
+        store = _stores.get(filename)
+        if store is None:
+            if key is None:
+                store = WriteBehindJsonStore(filename)
+            else:
+                store = EncryptedJsonStore(filename, key)
+            _stores[filename] = store
+        return store
+
+
+# Общие каталоги соревнований: один экземпляр на каталог, иначе
+# индексы в памяти разных экранов разошлись бы
+_catalogs = {}
+
+
+def get_race_catalog(folder=RACES_DIR, key=None):
+    """
+    Получение общего каталога соревнований
+
+    Args:
+        folder: Каталог с файлами соревнований
+        key: Ключ шифрования файлов соревнований (None - без шифрования)
+
+    Returns:
+        RaceCatalog: Каталог, общий для всего приложения
+    """
+    with _stores_lock:
+        catalog = _catalogs.get(folder)
+        if catalog is None:
+            catalog = RaceCatalog(folder, key=key)
+            _catalogs[folder] = catalog
+        return catalog
+
+
+def flush_all():
+    """Запись на диск изменений всех открытых хранилищ"""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        try:
+            store.flush()
+        except OSError as e:
+            print(f"Ошибка записи {store.filename}: {e}")
+
+
+def close_all():
+    """Закрытие всех хранилищ с записью оставшихся изменений"""
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        try:
+            store.close()
+        except OSError as e:
+            print(f"Ошибка записи {store.filename}: {e}")
+
+
+def race_meta(race_data):
+    """
+    Краткие сведения о соревновании для индекса каталога
+
+    Понимает как полный формат соревнования (ключ 'meta'),
+    так и запись 'race' из app_data.json.
+
+    Args:
+        race_data: Словарь с данными соревнования
+
+    Returns:
+        dict: {'name', 'date', 'version'}
+    """
+    meta = race_data.get('meta') or race_data.get('race') or {}
+    return {
+        'name': meta.get('name', ''),
+        'date': meta.get('date', ''),
+        'version': meta.get('version', 0)
+    }
+
+
+class RaceCatalog:
+    """
+    Каталог соревнований на устройстве
+
+    Каждое соревнование хранится в отдельном файле <race_id>.json,
+    а index.json содержит только краткие сведения (название, дата, версия).
+    Список соревнований строится по индексу, данные соревнования читаются
+    с диска только при открытии. Удаление или сохранение одного соревнования
+    не переписывает файлы остальных.
+
+    С ключом файлы соревнований (<race_id>.enc) шифруются по записям
+    (EncryptedRecordFile: раздел, экипаж или КП - запись), индекс
+    остается открытым.
+    """
+
+    def __init__(self, folder=RACES_DIR, key=None):
+        self.folder = folder
+        self.key = key
+        # Открытые шифрованные файлы: race_id -> EncryptedRecordFile
+        self._files = {}
+        os.makedirs(folder, exist_ok=True)
+        self._index_path = os.path.join(folder, RACE_INDEX_FILE)
+        self._lock = threading.RLock()
+        # Открытые соревнования: race_id -> данные
+        self._opened = {}
+
+        recover(self._index_path)
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding='utf-8') as fd:
+                data = fd.read()
+            if data:
+                self._index = json.loads(data).get('races', {})
+
+    def _race_path(self, race_id):
+        extension = '.json' if self.key is None else ENCRYPTED_EXTENSION
+        return os.path.join(self.folder, f'{race_id}{extension}')
+
+    def sidecar_path(self, race_id, name):
+        """
+        Путь к служебному файлу соревнования (удаляется вместе с ним)
+
+        Args:
+            race_id: Идентификатор соревнования
+            name: Назначение файла, например 'replay'
+        """
+        return os.path.join(self.folder, f'{race_id}.{name}.json')
+
+    def _race_file(self, race_id):
+        race_file = self._files.get(race_id)
+        if race_file is None:
+            race_file = EncryptedRecordFile(self._race_path(race_id), self.key)
+            self._files[race_id] = race_file
+        return race_file
+
+    def _save_index(self):
+        data = json.dumps({'races': self._index}, ensure_ascii=False)
+        atomic_write(self._index_path, data)
+
+    def list_races(self):
+        """
+        Список соревнований без загрузки их данных
+
+        Returns:
+            list: Пары (race_id, meta), отсортированные по дате
+        """
+        def sort_key(item):
+            date = item[1].get('date', '')
+            try:
+                return datetime.strptime(date, '%d-%m-%Y'), item[0]
+            except ValueError:
+                return datetime.min, item[0]
+
+        with self._lock:
+            return sorted(
+                ((race_id, dict(meta)) for race_id, meta in self._index.items()),
+                key=sort_key
+            )
+
+    def exists(self, race_id):
+        with self._lock:
+            return race_id in self._index
+
+    def get_meta(self, race_id):
+        """Краткие сведения о соревновании (KeyError, если его нет)"""
+        with self._lock:
+            return dict(self._index[race_id])
+
+    def add_race(self, race_data, race_id=None):
+        """
+        Добавление соревнования в каталог
+
+        Args:
+            race_data: Данные соревнования
+            race_id: Идентификатор (по умолчанию генерируется)
+
+        Returns:
+            str: Идентификатор соревнования
+        """
+        with self._lock:
+            if race_id is None:
+                race_id = uuid.uuid4().hex[:12]
+            elif race_id in self._index:
+                raise KeyError(f'Соревнование {race_id} уже существует')
+            self._opened[race_id] = race_data
+            self._write_race(race_id, race_data)
+            return race_id
+
+    def open_race(self, race_id):
+        """
+        Данные соревнования (читаются с диска при первом открытии)
+
+        Args:
+            race_id: Идентификатор соревнования
+
+        Returns:
+            dict: Данные соревнования
+        """
+        with self._lock:
+            if race_id not in self._index:
+                raise KeyError(race_id)
+            race_data = self._opened.get(race_id)
+            if race_data is None:
+                if self.key is None:
+                    with open(self._race_path(race_id), encoding='utf-8') as fd:
+                        race_data = json.load(fd)
+                else:
+                    race_data = json_from_records(self._race_file(race_id).read_records())
+                self._opened[race_id] = race_data
+            return race_data
+
+    def save_race(self, race_id, race_data=None):
+        """
+        Запись открытого соревнования на диск
+
+        Args:
+            race_id: Идентификатор соревнования
+            race_data: Новые данные (по умолчанию - уже открытые)
+        """
+        with self._lock:
+            if race_id not in self._index:
+                raise KeyError(race_id)
+            if race_data is None:
+                race_data = self.open_race(race_id)
+            self._opened[race_id] = race_data
+            self._write_race(race_id, race_data)
+
+    def _write_race(self, race_id, race_data):
+        if self.key is None:
+            atomic_write(self._race_path(race_id), json.dumps(race_data, ensure_ascii=False))
+        else:
+            self._race_file(race_id).write_records(json_records(race_data, RACE_ITEM_SECTIONS))
+        meta = race_meta(race_data)
+        if self._index.get(race_id) != meta:
+            self._index[race_id] = meta
+            self._save_index()
+
+    def close_race(self, race_id):
+        """Выгрузка данных соревнования из памяти"""
+        with self._lock:
+            self._opened.pop(race_id, None)
+            self._files.pop(race_id, None)
+
+    def delete_race(self, race_id):
+        """
+        Удаление соревнования
+
+        Сначала соревнование удаляется из индекса, затем удаляются его файл
+        и служебные файлы (sidecar_path), поэтому сбой между этими шагами
+        оставляет только лишние файлы,
+        но не битую запись в каталоге.
+        """
+        with self._lock:
+            if race_id not in self._index:
+                raise KeyError(race_id)
+            del self._index[race_id]
+            self._save_index()
+            self._opened.pop(race_id, None)
+            self._files.pop(race_id, None)
+            prefix = f'{race_id}.'
+            paths = [self._race_path(race_id)] + [
+                os.path.join(self.folder, name) for name in os.listdir(self.folder)
+                if name.startswith(prefix) and name.endswith('.json')
+            ]
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def canonical_json(value):
+    """
+    Каноническое представление JSON-значения в байтах
+
+    Одинаковые по содержанию значения дают одинаковые байты
+    независимо от порядка ключей в словарях.
+    """
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':')
+    ).encode('utf-8')
+
+
+def content_hash(data):
+    """Адрес блока в хранилище версий (SHA-256 от содержимого)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class RaceVersionStore:
+    """
+    Хранилище всех версий одного соревнования
+
+    Соревнование разбивается на блоки: каждый раздел верхнего уровня
+    (meta, params, logic_params, checkpoints, ...) и каждый экипаж из members
+    хранятся отдельно под именем, равным хешу их содержимого. Версия - это
+    небольшой манифест со списком хешей блоков, поэтому неизмененные блоки
+    общие для всех версий, и новая версия стоит примерно столько, сколько
+    весят ее изменения.
+
+    Структура каталога:
+        objects/ab/cdef...  - блоки (канонический JSON, сжатый zlib)
+        versions/297.json   - манифест версии 297
+    """
+
+    # Раздел, который хранится поблочно (по блоку на экипаж)
+    ITEMS_SECTION = 'members'
+
+    def __init__(self, folder, cache_size=256):
+        self.folder = folder
+        self._objects_dir = os.path.join(folder, 'objects')
+        self._versions_dir = os.path.join(folder, 'versions')
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._versions_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        # LRU-кеш распакованных блоков: hash -> bytes
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects_dir, digest[:2], digest[2:])
+
+    def _version_path(self, version):
+        return os.path.join(self._versions_dir, f'{version}.json')
+
+    def _put_object(self, data):
+        """Запись блока, если такого еще нет. Возвращает его хеш."""
+        digest = content_hash(data)
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, zlib.compress(data))
+        self._remember(digest, data)
+        return digest
+
+    def _get_object(self, digest):
+        data = self._cache.get(digest)
+        if data is not None:
+            self._cache.move_to_end(digest)
+            return data
+        with open(self._object_path(digest), 'rb') as fd:
+            data = zlib.decompress(fd.read())
+        if content_hash(data) != digest:
+            raise ValueError(f'Блок {digest} поврежден')
+        self._remember(digest, data)
+        return data
+
+    def _remember(self, digest, data):
+        self._cache[digest] = data
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def commit(self, race_data, version=None):
+        """
+        Сохранение версии соревнования
+
+        Args:
+            race_data: Данные соревнования
+            version: Номер версии (по умолчанию meta.version)
+
+        Returns:
+            int: Номер сохраненной версии
+        """
+        if version is None:
+            version = race_data.get('meta', {}).get('version', 0)
+
+        with self._lock:
+            sections = {}
+            for key, value in race_data.items():
+                if key == self.ITEMS_SECTION and isinstance(value, list):
+                    sections[key] = [
+                        self._put_object(canonical_json(item)) for item in value
+                    ]
+                else:
+                    sections[key] = self._put_object(canonical_json(value))
+
+            manifest = {
+                'version': version,
+                'order': list(race_data.keys()),
+                'sections': sections
+            }
+            atomic_write(
+                self._version_path(version),
+                json.dumps(manifest, ensure_ascii=False)
+            )
+        return version
+
+    def versions(self):
+        """Номера сохраненных версий по возрастанию"""
+        result = []
+        for name in os.listdir(self._versions_dir):
+            number, ext = os.path.splitext(name)
+            if ext == '.json' and number.lstrip('-').isdigit():
+                result.append(int(number))
+        return sorted(result)
+
+    def latest(self):
+        """Номер последней версии или None, если версий нет"""
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def has_version(self, version):
+        return os.path.exists(self._version_path(version))
+
+    def checkout(self, version):
+        """
+        Сборка соревнования нужной версии
+
+        Args:
+            version: Номер версии
+
+        Returns:
+            dict: Данные соревнования (новый объект, его можно менять)
+        """
+        with self._lock:
+            with open(self._version_path(version), encoding='utf-8') as fd:
+                manifest = json.load(fd)
+
+            sections = manifest['sections']
+            race_data = {}
+            for key in manifest['order']:
+                digest = sections[key]
+                if isinstance(digest, list):
+                    race_data[key] = [
+                        json.loads(self._get_object(item)) for item in digest
+                    ]
+                else:
+                    race_data[key] = json.loads(self._get_object(digest))
+            return race_data
+
+    def diff(self, from_version, to_version):
+        """Патч для перехода между двумя сохраненными версиями"""
+        return diff_races(self.checkout(from_version), self.checkout(to_version))
+
+
+# Операции патча (списки, чтобы патч был компактным):
+#   ['s', path, value]            - установить значение
+#   ['d', path]                   - удалить ключ словаря
+#   ['a', path, items]            - дописать элементы в конец списка
+#   ['o', path, field, keys, new] - пересобрать список по ключам field:
+#                                   существующие элементы берутся по ключу,
+#                                   новые - из словаря new
+# Элемент пути - ключ словаря (str), индекс списка (int)
+# или [field, value] - элемент списка, у которого item[field] == value.
+
+
+def _list_key_field(old, new):
+    """Поле, по которому можно сопоставить элементы двух списков, или None"""
+    for field in PATCH_KEY_FIELDS:
+        keys_ok = True
+        for items in (old, new):
+            keys = [item.get(field) if isinstance(item, dict) else None for item in items]
+            if None in keys or len(set(keys)) != len(keys):
+                keys_ok = False
+                break
+            if not all(isinstance(key, (str, int)) for key in keys):
+                keys_ok = False
+                break
+        if keys_ok:
+            return field
+    return None
+
+
+def _diff_values(old, new, path, ops):
+    if type(old) is not type(new):
+        ops.append(['s', path, new])
+    elif isinstance(old, dict):
+        for key in old:
+            if key not in new:
+                ops.append(['d', path + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(['s', path + [key], value])
+            elif old[key] != value:
+                _diff_values(old[key], value, path + [key], ops)
+    elif isinstance(old, list):
+        _diff_lists(old, new, path, ops)
+    elif old != new:
+        ops.append(['s', path, new])
+
+
+def _diff_lists(old, new, path, ops):
+    if old == new:
+        return
+    if old and new:
+        field = _list_key_field(old, new)
+        if field is not None:
+            old_by_key = {item[field]: item for item in old}
+            old_keys = [item[field] for item in old]
+            new_keys = [item[field] for item in new]
+            if old_keys != new_keys:
+                added = {
+                    str(item[field]): item for item in new
+                    if item[field] not in old_by_key
+                }
+                ops.append(['o', path, field, new_keys, added])
+            for item in new:
+                key = item[field]
+                if key in old_by_key and old_by_key[key] != item:
+                    _diff_values(old_by_key[key], item, path + [[field, key]], ops)
+            return
+
+    if len(new) > len(old) and new[:len(old)] == old:
+        ops.append(['a', path, new[len(old):]])
+    elif len(new) == len(old) and all(isinstance(item, (dict, list)) for item in old):
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            if old_item != new_item:
+                _diff_values(old_item, new_item, path + [index], ops)
+    else:
+        ops.append(['s', path, new])
+
+
+def diff_races(old_race, new_race):
+    """
+    Структурный патч между двумя версиями соревнования
+
+    Патч содержит только изменения: измененные поля КП и экипажей,
+    новых экипажей, дописанные отметки и т.д.
+
+    Args:
+        old_race: Исходная версия
+        new_race: Новая версия
+
+    Returns:
+        dict: {'from': версия, 'to': версия, 'ops': [...]}
+    """
+    ops = []
+    _diff_values(old_race, new_race, [], ops)
+    return {
+        'from': old_race.get('meta', {}).get('version', 0),
+        'to': new_race.get('meta', {}).get('version', 0),
+        'ops': ops
+    }
+
+
+def _resolve(container, segment):
+    """Переход по одному элементу пути"""
+    if isinstance(segment, list):
+        field, value = segment
+        for item in container:
+            if item.get(field) == value:
+                return item
+        raise KeyError(f'Нет элемента {field}={value}')
+    return container[segment]
+
+
+def _apply_op(race_data, op):
+    kind, path = op[0], op[1]
+    if not path:
+        raise ValueError('Операция патча без пути')
+    parent = race_data
+    for segment in path[:-1]:
+        parent = _resolve(parent, segment)
+    last = path[-1]
+    if isinstance(last, list):
+        target_index = parent.index(_resolve(parent, last))
+    else:
+        target_index = last
+
+    if kind == 's':
+        parent[target_index] = op[2]
+    elif kind == 'd':
+        del parent[target_index]
+    elif kind == 'a':
+        _resolve(parent, last).extend(op[2])
+    elif kind == 'o':
+        field, keys, added = op[2], op[3], op[4]
+        items = _resolve(parent, last)
+        by_key = {item[field]: item for item in items}
+        items[:] = [
+            by_key[key] if key in by_key else added[str(key)]
+            for key in keys
+        ]
+    else:
+        raise ValueError(f'Неизвестная операция патча: {kind}')
+
+
+def apply_patch(race_data, patch):
+    """
+    Применение патча к загруженному соревнованию (на месте)
+
+    Args:
+        race_data: Данные соревнования версии patch['from']
+        patch: Патч из diff_races или decode_patch
+
+    Returns:
+        dict: Те же данные, приведенные к версии patch['to']
+    """
+    version = race_data.get('meta', {}).get('version', 0)
+    if version != patch['from']:
+        raise ValueError(
+            f"Патч для версии {patch['from']}, а загружена версия {version}"
+        )
+    for op in patch['ops']:
+        _apply_op(race_data, op)
+    return race_data
+
+
+def apply_patches(race_data, patches):
+    """Последовательное применение патчей N -> N+1 -> ... -> N+k"""
+    for patch in sorted(patches, key=lambda item: item['from']):
+        apply_patch(race_data, patch)
+    return race_data
+
+
+def encode_patch(patch):
+    """Патч в компактном двоичном виде (сжатый JSON)"""
+    return zlib.compress(canonical_json(patch), 9)
+
+
+def decode_patch(data):
+    """Патч из двоичного вида encode_patch"""
+    return json.loads(zlib.decompress(data))
@@ -39,7 +39,7 @@ version = 1.0.0
 
 # (list) Application requirements
 # comma separated e.g. requirements = sqlite3,kivy
-requirements = python3,kivy==2.0.0,plyer,android,pyjnius
+requirements = python3,kivy==2.0.0,plyer,android,pyjnius,openssl,cryptography
 
 # (str) Custom source folders for requirements
 # Sets custom source for any requirements with recipes
@@ -0,0 +1,41 @@
+"""
+Общие настройки тестов
+
+Модули приложения лежат в корне репозитория и импортируются как есть.
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('KIVY_NO_ARGS', '1')
+os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def race_data():
+    """Данные соревнования из примера в репозитории"""
+    with open(os.path.join(ROOT, 'race_v297.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Хранилище участника во временном каталоге"""
+    import Storage
+    store = Storage.WriteBehindJsonStore(str(tmp_path / 'app_data.json'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    """Каталог соревнований во временном каталоге"""
+    import Storage
+    return Storage.RaceCatalog(str(tmp_path / 'races'))
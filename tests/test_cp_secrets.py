@@ -0,0 +1,104 @@
+"""
+Тесты шифрования подсказок и заданий КП ключом из кода КП
+"""
+
+import hashlib
+import hmac
+import time
+
+import pytest
+
+import Cryptography
+
+CHECKPOINTS = [
+    {'name': 'КП 1', 'code': '10001', 'hint': 'У старого дуба'},
+    {'name': 'КП 2', 'code': '20002', 'task': 'Сосчитать окна'},
+    {'name': 'КП 3', 'code': '30003'},
+]
+
+
+@pytest.fixture(scope='module')
+def cp_secrets():
+    return Cryptography.encrypt_cp_records(CHECKPOINTS)
+
+
+def test_unlock_by_code(cp_secrets):
+    assert Cryptography.unlock_cp(cp_secrets, '10001') == {
+        'name': 'КП 1', 'hint': 'У старого дуба'
+    }
+    assert Cryptography.unlock_cp(cp_secrets, ' 20002 ')['task'] == 'Сосчитать окна'
+    assert Cryptography.unlock_cp(cp_secrets, '30003') == {'name': 'КП 3'}
+
+
+def test_wrong_code(cp_secrets):
+    assert Cryptography.unlock_cp(cp_secrets, '10002') is None
+
+
+def test_kdf_params_travel_with_records(cp_secrets, monkeypatch):
+    """Смена констант KDF в новой версии не ломает уже выданные записи"""
+    monkeypatch.setattr(Cryptography, 'KDF_SCRYPT_N', 2 ** 10)
+    assert Cryptography.unlock_cp(cp_secrets, '10001')['name'] == 'КП 1'
+
+
+def test_record_id_needs_slow_kdf(cp_secrets, monkeypatch):
+    """Каждая попытка кода - один вызов scrypt с полной стоимостью"""
+    calls = []
+    derive_key = Cryptography.derive_key
+
+    def counting(*args, **kwargs):
+        calls.append(kwargs)
+        return derive_key(*args, **kwargs)
+
+    monkeypatch.setattr(Cryptography, 'derive_key', counting)
+    Cryptography.unlock_cp(cp_secrets, '99999')
+    assert len(calls) == 1
+    assert calls[0]['kdf'] == 'scrypt'
+    assert calls[0]['n'] >= 2 ** 14
+
+
+def test_fast_hash_of_code_matches_nothing(cp_secrets):
+    """Идентификаторы записей не считаются быстрым HMAC от кода и соли"""
+    salt = Cryptography._b64decode(cp_secrets['salt'])
+    for cp in CHECKPOINTS:
+        for message in (cp['code'].encode(), b'cp-id:' + cp['code'].encode()):
+            digest = hmac.new(salt, message, hashlib.sha256).digest()
+            record_id = Cryptography._b64encode(digest[:Cryptography.CP_RECORD_ID_SIZE])
+            assert record_id not in cp_secrets['records']
+
+
+def test_enumeration_is_expensive(cp_secrets):
+    """Перебор всех 5-значных кодов занимает не меньше ~15 минут на ядро"""
+    guesses = 3
+    start = time.perf_counter()
+    for code in range(guesses):
+        assert Cryptography.unlock_cp(cp_secrets, f'{code:05d}') is None
+    per_guess = (time.perf_counter() - start) / guesses
+    assert per_guess * 10 ** 5 > 15 * 60
+
+
+def test_race_for_participants_hides_codes():
+    race = {'meta': {'name': 'Тест'}, 'checkpoints': CHECKPOINTS}
+    result = Cryptography.race_for_participants(race)
+    assert all(set(cp) == {'name'} for cp in result['checkpoints'])
+    assert race['checkpoints'][0]['code'] == '10001'
+    assert Cryptography.unlock_cp(result['cp_secrets'], '20002')['name'] == 'КП 2'
+
+
+def test_bloom_filter_ships_no_key():
+    race = {'checkpoints': CHECKPOINTS}
+    result = Cryptography.race_for_participants(race)
+    assert set(result['cp_filter']) == {'m', 'k', 'bits'}
+
+    bloom = Cryptography.CodeBloomFilter.from_dict(result['cp_filter'])
+    cp_secrets = result['cp_secrets']
+    for cp in CHECKPOINTS:
+        assert Cryptography.scanned_cp_secret(cp_secrets, cp['code']) in bloom
+    assert Cryptography.scanned_cp_secret(cp_secrets, '12345') not in bloom
+
+
+def test_bloom_false_positive_rate():
+    secrets = [bytes([i]) * 32 for i in range(40)]
+    bloom = Cryptography.CodeBloomFilter.build(secrets)
+    assert all(secret in bloom for secret in secrets)
+    misses = sum(i.to_bytes(4, 'big') * 8 in bloom for i in range(20000))
+    assert misses < 20000 * Cryptography.BLOOM_FALSE_POSITIVE_RATE * 3
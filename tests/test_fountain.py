@@ -0,0 +1,84 @@
+"""
+Тесты передачи данных серией QR-кодов (фонтанный код)
+"""
+
+import os
+import random
+
+import pytest
+
+import QR_codes
+
+
+def decode(frames):
+    decoder = QR_codes.FountainDecoder()
+    for count, frame in enumerate(frames, 1):
+        if decoder.add_frame(frame):
+            return decoder.payload, count
+    return None, None
+
+
+@pytest.mark.parametrize('size', [1, 255, 256, 257, 5000])
+def test_round_trip_in_order(size):
+    payload = os.urandom(size)
+    encoder = QR_codes.FountainEncoder(payload)
+    frames = (encoder.frame(seed) for seed in range(encoder.block_count * 4 + 20))
+    result, count = decode(frames)
+    assert result == payload
+    assert count <= encoder.block_count * 2 + 10
+
+
+def test_any_frames_in_any_order():
+    """Пропущенные кадры не ждем: подходят любые в любом порядке"""
+    rng = random.Random(32)
+    payload = os.urandom(8000)
+    encoder = QR_codes.FountainEncoder(payload)
+    seeds = [seed for seed in range(1000) if rng.random() > 0.4]
+    rng.shuffle(seeds)
+    result, _ = decode(encoder.frame(seed) for seed in seeds)
+    assert result == payload
+
+
+def test_duplicates_and_foreign_frames_ignored():
+    payload = os.urandom(3000)
+    other = QR_codes.FountainEncoder(os.urandom(3000))
+    encoder = QR_codes.FountainEncoder(payload)
+    decoder = QR_codes.FountainDecoder()
+    for seed in range(200):
+        frame = encoder.frame(seed)
+        decoder.add_frame(frame)
+        decoder.add_frame(frame)
+        decoder.add_frame(other.frame(seed))
+        if decoder.is_complete:
+            break
+    assert decoder.payload == payload
+
+
+def test_progress():
+    encoder = QR_codes.FountainEncoder(os.urandom(2000))
+    decoder = QR_codes.FountainDecoder()
+    assert decoder.progress == 0.0
+    seed = 0
+    while not decoder.add_frame(encoder.frame(seed)):
+        assert 0.0 <= decoder.progress < 1.0
+        seed += 1
+    assert decoder.progress == 1.0
+
+
+def test_frame_header_block_count_capped():
+    """Заголовок чужого кадра не заставляет выделять память под гигантскую серию"""
+    header = QR_codes._FRAME_HEADER.pack(QR_codes.FOUNTAIN_FORMAT, 0, 2 ** 32 - 1, 1, 0)
+    decoder = QR_codes.FountainDecoder()
+    assert not decoder.add_frame(header + b'\0')
+    assert decoder.block_count is None
+
+
+def test_not_fountain_frame_ignored():
+    decoder = QR_codes.FountainDecoder()
+    assert not decoder.add_frame(QR_codes.encode_payload({'a': 1}))
+    assert not decoder.add_frame(b'')
+
+
+def test_too_large_payload_rejected():
+    with pytest.raises(ValueError):
+        QR_codes.FountainEncoder(b'\0' * (QR_codes.FOUNTAIN_MAX_BLOCKS + 1), block_size=1)
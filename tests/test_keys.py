@@ -0,0 +1,59 @@
+"""
+Тесты проверочной записи PIN и ключей сеанса
+"""
+
+import pytest
+
+import Cryptography
+
+
+def test_unlock():
+    verifier = Cryptography.make_secret_verifier('1234')
+    keys = Cryptography.KeyManager()
+    assert not keys.unlock('admin', '4321', verifier)
+    assert not keys.is_unlocked('admin')
+    assert keys.unlock('admin', '1234', verifier)
+    assert keys.is_unlocked('admin')
+
+
+def test_verifier_stores_effective_params():
+    verifier = Cryptography.make_secret_verifier('1234')
+    assert verifier['params']['n'] == Cryptography.KDF_SCRYPT_N
+    assert verifier['params']['r'] == Cryptography.KDF_SCRYPT_R
+    assert verifier['params']['p'] == Cryptography.KDF_SCRYPT_P
+    assert verifier['params']['length'] == 32
+
+    verifier = Cryptography.make_secret_verifier('1234', 'pbkdf2', iterations=1000)
+    assert verifier['params']['iterations'] == 1000
+
+
+def test_constants_change_keeps_pin_and_key(monkeypatch):
+    """Новые KDF_* в обновлении не ломают PIN и не меняют ключ организатора"""
+    verifier = Cryptography.make_secret_verifier('1234')
+    keys = Cryptography.KeyManager()
+    keys.unlock('admin', '1234', verifier)
+    subkey = keys.subkey('admin', 'race:1:audit')
+
+    monkeypatch.setattr(Cryptography, 'KDF_SCRYPT_N', 2 ** 12)
+    monkeypatch.setattr(Cryptography, 'KDF_PBKDF2_ITERATIONS', 10)
+    keys = Cryptography.KeyManager()
+    assert keys.unlock('admin', '1234', verifier)
+    assert keys.subkey('admin', 'race:1:audit') == subkey
+
+
+def test_legacy_verifier_without_params():
+    verifier = Cryptography.make_secret_verifier('1234')
+    legacy = dict(verifier, params={})
+    assert Cryptography.verifier_params(legacy) == verifier['params']
+    assert Cryptography.KeyManager().unlock('admin', '1234', legacy)
+
+
+def test_subkeys_and_invalidate():
+    keys = Cryptography.KeyManager()
+    keys.set_key('race', b'k' * 32)
+    storage = keys.subkey('race', 'storage')
+    assert storage == keys.subkey('race', 'storage')
+    assert storage != keys.subkey('race', 'audit')
+    keys.invalidate('race')
+    with pytest.raises(KeyError):
+        keys.subkey('race', 'storage')
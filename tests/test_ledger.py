@@ -0,0 +1,251 @@
+"""
+Тесты приема сдач организатором: подписи экипажей, идемпотентность,
+подтверждения
+"""
+
+import pytest
+
+import Cryptography
+import Member
+import QR_codes
+
+
+class DictStore(dict):
+    """Хранилище участника в памяти (интерфейс JsonStore)"""
+
+    def exists(self, key):
+        return key in self
+
+    def get(self, key):
+        return self[key]
+
+    def put(self, key, **values):
+        self[key] = values
+
+    def delete(self, key):
+        del self[key]
+
+
+@pytest.fixture
+def race_id(catalog, race_data):
+    return catalog.add_race(race_data)
+
+
+def register(catalog, race_id, crew_index, member_catalog):
+    """Телефон участника: сканирует блок соревнования и QR своего экипажа"""
+    dictionary = Member.registration_dictionary(catalog, race_id)
+    crew = catalog.open_race(race_id)['members'][crew_index]
+    store = DictStore()
+    Member.handle_scanned(dictionary.race_block, store, member_catalog)
+    Member.handle_scanned(
+        Member.crew_registration_qr(catalog, race_id, dictionary, crew), store, member_catalog
+    )
+    return Member.load_submitter(store), store
+
+
+@pytest.fixture
+def member_catalog(tmp_path):
+    import Storage
+    return Storage.RaceCatalog(str(tmp_path / 'member_races'))
+
+
+@pytest.fixture
+def ledger(catalog, race_id):
+    return Member.ResultLedger(Member.race_results_key(catalog, race_id))
+
+
+def test_race_block_has_no_results_key(catalog, race_id):
+    key = Member.race_results_key(catalog, race_id)
+    block = Member.registration_dictionary(catalog, race_id).race_block
+    assert 'results_key' not in QR_codes.decode_payload(block)['meta']
+    assert key.hex().encode() not in block
+    assert Member.race_results_key(catalog, race_id) == key
+
+
+def test_legacy_meta_key_replaced(catalog, race_data):
+    race_data['meta']['results_key'] = '00' * Member.RESULTS_KEY_SIZE
+    race_id = catalog.add_race(race_data)
+    key = Member.race_results_key(catalog, race_id)
+    assert key != bytes(Member.RESULTS_KEY_SIZE)
+    assert 'results_key' not in catalog.open_race(race_id)['meta']
+
+
+def test_submit_and_ack(catalog, race_id, member_catalog, ledger):
+    submitter, store = register(catalog, race_id, 0, member_catalog)
+    submitter.take_cp('КП 1')
+    submitter.take_cp('КП 2')
+
+    crew_id, added, head = ledger.ingest(submitter.build_submission())
+    assert (crew_id, added) == (str(submitter.crew_id), 2)
+    assert [entry['cp'] for entry in ledger.results(crew_id)] == ['КП 1', 'КП 2']
+
+    assert 'полностью' in Member.handle_scanned(ledger.build_ack(crew_id), store, member_catalog)
+    assert Member.load_submitter(store).pending_count == 0
+
+
+def test_reingest_is_idempotent(catalog, race_id, member_catalog, ledger):
+    submitter, _ = register(catalog, race_id, 0, member_catalog)
+    submitter.take_cp('КП 1')
+    first = submitter.build_submission()
+    submitter.take_cp('КП 2')
+    second = submitter.build_submission()
+
+    assert ledger.ingest(first)[1] == 1
+    assert ledger.ingest(first)[1] == 0
+    # Вторая сдача перекрывается с первой (подтверждение не сканировали)
+    assert ledger.ingest(second)[1] == 1
+    assert ledger.ingest(second)[1] == 0
+    assert len(ledger.results(submitter.crew_id)) == 2
+
+
+def test_forged_submission_for_other_crew_rejected(catalog, race_id, member_catalog, ledger):
+    """Участник экипажа A не может сдать результаты за экипаж B"""
+    attacker, _ = register(catalog, race_id, 0, member_catalog)
+    victim, _ = register(catalog, race_id, 1, member_catalog)
+    assert attacker.key != victim.key
+
+    forged = Cryptography.CheckpointChain(attacker.key, victim.crew_id)
+    for cp in ('КП 1', 'КП 2', 'КП 3'):
+        forged.extend({'id': forged.length + 1, 'cp': cp, 'time': '10:00:00'})
+    submission = dict(forged.submission(), seq=1)
+    signed = Cryptography.sign_payload(attacker.key, QR_codes.encode_payload(submission))
+    with pytest.raises(ValueError):
+        ledger.ingest(signed)
+    assert ledger.results(victim.crew_id) == []
+
+    # Настоящая сдача экипажа B принимается: позиции не заняты подделкой
+    victim.take_cp('КП 5')
+    assert ledger.ingest(victim.build_submission())[1] == 1
+
+
+def test_forged_ack_rejected(catalog, race_id, member_catalog):
+    attacker, _ = register(catalog, race_id, 0, member_catalog)
+    victim, victim_store = register(catalog, race_id, 1, member_catalog)
+    victim.take_cp('КП 1')
+    ack = {'crew': str(victim.crew_id), 'ack': victim.chain.head.hex()}
+    forged = Cryptography.sign_payload(attacker.key, QR_codes.encode_payload(ack))
+    assert Member.apply_ack(forged, victim_store) is None
+    assert Member.load_submitter(victim_store).pending_count == 1
+
+
+def test_tampered_submission_rejected(catalog, race_id, member_catalog, ledger):
+    submitter, _ = register(catalog, race_id, 0, member_catalog)
+    submitter.take_cp('КП 1')
+    signed = bytearray(submitter.build_submission())
+    signed[-1] ^= 1
+    with pytest.raises(ValueError):
+        ledger.ingest(bytes(signed))
+
+
+@pytest.mark.parametrize('payload', [
+    {'crew': '7'},
+    {'crew': ['7'], 'base': '', 'base_length': 0, 'entries': [], 'head': '', 'length': 0, 'seq': 1},
+    {'crew': '7', 'base': '', 'base_length': -1, 'entries': [], 'head': '', 'length': 0, 'seq': 1},
+    {'crew': '7', 'base': '', 'base_length': 0, 'entries': [1], 'head': '', 'length': 1, 'seq': 1},
+    [1, 2],
+])
+def test_malformed_submission_rejected(payload, ledger):
+    with pytest.raises(ValueError):
+        ledger.ingest(Cryptography.sign_payload(b'k' * 32, QR_codes.encode_payload(payload)))
+
+
+def test_ledger_persists(catalog, race_id, member_catalog, tmp_path):
+    key = Member.race_results_key(catalog, race_id)
+    path = str(tmp_path / 'results.json')
+    submitter, _ = register(catalog, race_id, 0, member_catalog)
+    submitter.take_cp('КП 1')
+    Member.ResultLedger(key, path=path).ingest(submitter.build_submission())
+
+    reloaded = Member.ResultLedger(key, path=path)
+    assert len(reloaded.results(submitter.crew_id)) == 1
+    submitter.take_cp('КП 2')
+    assert reloaded.ingest(submitter.build_submission())[1] == 1
+
+
+def test_cp_scan_feeds_submission(catalog, race_id, member_catalog, ledger):
+    """Код с листа КП записывается в цепочку и уходит в сдачу"""
+    submitter, store = register(catalog, race_id, 0, member_catalog)
+    assert 'КП 3' in Member.handle_scanned('КП 3'.encode('utf-8'), store, member_catalog)
+    assert Member.load_submitter(store).pending_count == 1
+
+    crew_id, added, _ = ledger.ingest(Member.load_submitter(store).build_submission())
+    assert added == 1
+    assert ledger.results(crew_id)[0]['cp'] == 'КП 3'
+
+
+def test_unknown_code_not_taken(catalog, race_id, member_catalog):
+    _, store = register(catalog, race_id, 0, member_catalog)
+    with pytest.raises(ValueError):
+        Member.handle_scanned(b'KP 999', store, member_catalog)
+    assert Member.load_submitter(store).pending_count == 0
+
+
+def test_find_encrypted_checkpoint():
+    race = Cryptography.race_for_participants({'checkpoints': [
+        {'name': 'КП 1', 'code': '10001', 'hint': 'У дуба'},
+        {'name': 'КП 2', 'code': '20002'},
+    ]})
+    assert Member.find_checkpoint(race, '10001') == {'name': 'КП 1', 'hint': 'У дуба'}
+    assert Member.find_checkpoint(race, '20002')['name'] == 'КП 2'
+    assert Member.find_checkpoint(race, '30003') is None
+
+
+def test_replay_rejection_is_distinct_and_audited(catalog, race_id, member_catalog, tmp_path):
+    """Отказ защиты от повтора отличается от дубликата и пишется в журнал"""
+    audit_path = str(tmp_path / 'audit.log')
+    audit = Cryptography.AuditLog(audit_path, b'a' * 32)
+    ledger = Member.ResultLedger(
+        Member.race_results_key(catalog, race_id), Cryptography.ReplayGuard(), audit=audit
+    )
+    submitter, _ = register(catalog, race_id, 0, member_catalog)
+    submitter.take_cp('КП 1')
+    first = submitter.build_submission()
+    assert ledger.ingest(first)[1] == 1
+    # Дубликат: 0 новых записей, без ошибки
+    assert ledger.ingest(first)[1] == 0
+
+    # Нумерация сдач началась заново (например, после переустановки)
+    submitter.sequence = 0
+    submitter.take_cp('КП 2')
+    with pytest.raises(Member.ReplayRejected):
+        ledger.ingest(submitter.build_submission())
+    assert len(ledger.results(submitter.crew_id)) == 1
+
+    with open(audit_path, encoding='utf-8') as fd:
+        actions = [line.split('"action":"')[1].split('"')[0] for line in fd]
+    assert actions == ['cp_scan', 'replay_rejected']
+    assert Cryptography.verify_audit_log(audit_path, b'a' * 32)[0]
+
+
+def test_ingest_many_out_of_order_and_saved_once(catalog, race_id, member_catalog,
+                                                 tmp_path, monkeypatch):
+    """Пачка сдач: порядок на входе не важен, файлы пишутся один раз"""
+    import Storage
+    key = Member.race_results_key(catalog, race_id)
+    submissions = []
+    for crew_index in range(3):
+        submitter, _ = register(catalog, race_id, crew_index, member_catalog)
+        for cp in ('КП 1', 'КП 2', 'КП 3'):
+            submitter.take_cp(cp)
+            submissions.append(submitter.build_submission())
+
+    writes = []
+    atomic_write = Storage.atomic_write
+
+    def counting(path, data, fsync=True):
+        writes.append(path)
+        atomic_write(path, data, fsync)
+
+    monkeypatch.setattr(Storage, 'atomic_write', counting)
+    ledger = Member.ResultLedger(
+        key, Cryptography.ReplayGuard(str(tmp_path / 'replay.json')),
+        str(tmp_path / 'results.json')
+    )
+    results = ledger.ingest_many(reversed(submissions))
+    assert sum(added for _, added, _ in results) == 9
+    assert sorted(writes) == sorted([str(tmp_path / 'replay.json'), str(tmp_path / 'results.json')])
+
+    reloaded = Member.ResultLedger(key, path=str(tmp_path / 'results.json'))
+    assert sum(len(reloaded.results(crew['номер']))
+               for crew in catalog.open_race(race_id)['members'][:3]) == 9
+    assert all(added == 0 for _, added, _ in reloaded.ingest_many(submissions))
@@ -0,0 +1,67 @@
+"""
+Тесты функционала участника: регистрация по QR и сдача результатов
+"""
+
+import os
+
+import pytest
+
+import Cryptography
+import Member
+import QR_codes
+
+
+def crew_qr(race, crew, **fields):
+    return QR_codes.RaceDictionary(race).encode_crew(dict(crew, **fields))
+
+
+def test_registration(race_data, store, catalog):
+    race_block = QR_codes.encode_payload({k: v for k, v in race_data.items() if k != 'members'})
+    crew = race_data['members'][0]
+    key = os.urandom(Member.RESULTS_KEY_SIZE)
+
+    assert 'Загружено' in Member.handle_scanned(race_block, store, catalog)
+    message = Member.handle_scanned(crew_qr(race_data, crew, results_key=key.hex()), store, catalog)
+    assert str(crew['номер']) in message
+
+    submitter = Member.load_submitter(store)
+    assert submitter.key == key
+    assert submitter.crew_id == crew['номер']
+
+
+def test_crew_before_race_rejected(race_data, store, catalog):
+    with pytest.raises(ValueError):
+        Member.handle_scanned(crew_qr(race_data, race_data['members'][0]), store, catalog)
+
+
+@pytest.mark.parametrize('payload', [
+    {'meta': 1},
+    {'meta': [1, 2]},
+    {'name': 'без meta'},
+    [1, 2, 3],
+    'строка',
+    None,
+])
+def test_malformed_race_rejected(payload, store, catalog):
+    with pytest.raises(ValueError):
+        Member.handle_scanned(QR_codes.encode_payload(payload), store, catalog)
+
+
+@pytest.mark.parametrize('crew', [
+    ['номер', '7'],
+    {'name': 'без номера'},
+    {'номер': ['7']},
+    {'номер': '7', 'results_key': 'не hex'},
+    {'номер': '7', 'results_key': 12345},
+])
+def test_malformed_crew_rejected(crew, race_data, store, catalog):
+    race = {k: v for k, v in race_data.items() if k != 'members'}
+    Member.handle_scanned(QR_codes.encode_payload(race), store, catalog)
+    with pytest.raises(ValueError):
+        Member.handle_scanned(QR_codes.RaceDictionary(race).encode_crew(crew), store, catalog)
+
+
+@pytest.mark.parametrize('data', [b'', b'\x00', b'hello', bytes([QR_codes.CREW_FORMAT])])
+def test_unknown_qr_rejected(data, store, catalog):
+    with pytest.raises(ValueError):
+        Member.handle_scanned(data, store, catalog)
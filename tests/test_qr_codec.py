@@ -0,0 +1,146 @@
+"""
+Тесты двоичного кодека данных для QR-кодов
+"""
+
+import json
+import random
+
+import pytest
+
+import QR_codes
+
+
+SAMPLE = {
+    'crew': '7',
+    'phone': '+79991234567',
+    'start': '09:30',
+    'finish': '17:45:10',
+    'date': '01-06-2024',
+    'created': '2024-06-01 08:00:00',
+    'score': 1.5,
+    'lat': 55.751244,
+    'penalty': -3,
+    'flags': [True, False, None],
+    'entries': [{'cp': 'K1', 'time': '10:00'}, {'cp': 'K1', 'time': '10:05'}],
+}
+
+
+@pytest.mark.parametrize('data', [SAMPLE, [], {}, '', 0, -1, 2 ** 63, 'ЧЧ:ММ'])
+def test_round_trip(data):
+    assert QR_codes.decode_payload(QR_codes.encode_payload(data)) == data
+
+
+def test_race_round_trip(race_data):
+    race = race_data
+    payload = QR_codes.encode_payload(race)
+    assert QR_codes.decode_payload(payload) == race
+    assert len(payload) < len(json.dumps(race, ensure_ascii=False).encode('utf-8'))
+
+
+def test_crew_round_trip(race_data):
+    race = race_data
+    dictionary = QR_codes.RaceDictionary(race)
+    crew = race['members'][0]
+    payload = dictionary.encode_crew(crew)
+    receiver = QR_codes.RaceDictionary.from_race_block(dictionary.race_block)
+    assert receiver.decode_crew(payload) == crew
+
+
+def test_crew_for_other_race_rejected(race_data):
+    race = race_data
+    dictionary = QR_codes.RaceDictionary(race)
+    other = dict(race, meta=dict(race.get('meta', {}), version=999))
+    payload = QR_codes.RaceDictionary(other).encode_crew(race['members'][0])
+    with pytest.raises(ValueError):
+        dictionary.decode_crew(payload)
+
+
+@pytest.mark.parametrize('payload', [b'', b'\x00', bytes([QR_codes.PAYLOAD_FORMAT]) + b'\xff' * 8])
+def test_garbage_rejected(payload):
+    with pytest.raises(ValueError):
+        QR_codes.decode_payload(payload)
+
+
+def test_truncated_body_rejected():
+    body = QR_codes._decompress(QR_codes.encode_payload(SAMPLE)[1:], QR_codes._ZDICT)
+    for end in range(len(body)):
+        payload = bytes([QR_codes.PAYLOAD_FORMAT]) + QR_codes._compress(body[:end], QR_codes._ZDICT)
+        with pytest.raises(ValueError):
+            QR_codes.decode_payload(payload)
+
+
+def test_long_varint_rejected():
+    body = bytes([QR_codes._T_INT]) + b'\xff' * 20 + b'\x01'
+    payload = bytes([QR_codes.PAYLOAD_FORMAT]) + QR_codes._compress(body, QR_codes._ZDICT)
+    with pytest.raises(ValueError):
+        QR_codes.decode_payload(payload)
+
+
+def test_mutated_body_raises_only_value_error(race_data):
+    """Поврежденные данные дают ValueError, а не IndexError/OverflowError/..."""
+    rng = random.Random(31)
+    bodies = [
+        QR_codes._decompress(QR_codes.encode_payload(data)[1:], QR_codes._ZDICT)
+        for data in (SAMPLE, race_data)
+    ]
+    for _ in range(2000):
+        body = bytearray(rng.choice(bodies))
+        for _ in range(rng.randint(1, 4)):
+            body[rng.randrange(len(body))] = rng.randrange(256)
+        payload = bytes([QR_codes.PAYLOAD_FORMAT]) + QR_codes._compress(bytes(body), QR_codes._ZDICT)
+        try:
+            QR_codes.decode_payload(payload)
+        except ValueError:
+            pass
+
+
+def test_mutated_payload_raises_only_value_error():
+    rng = random.Random(310)
+    payload = QR_codes.encode_payload(SAMPLE)
+    for _ in range(2000):
+        mutated = bytearray(payload)
+        mutated[rng.randrange(1, len(mutated))] = rng.randrange(256)
+        try:
+            QR_codes.decode_payload(bytes(mutated))
+        except ValueError:
+            pass
+
+
+@pytest.mark.parametrize('data, text', [
+    (b'AB', 'BB8'),
+    (b'Hello!!', '%69 VD92EX0'),
+    (b'base-45', 'UJCLQE7W581'),
+    (b'', ''),
+])
+def test_base45_vectors(data, text):
+    """Примеры из RFC 9285"""
+    assert QR_codes.base45_encode(data) == text
+    assert QR_codes.base45_decode(text) == data
+
+
+def test_base45_round_trip():
+    rng = random.Random(45)
+    for size in list(range(10)) + [255, 2000]:
+        data = bytes(rng.randrange(256) for _ in range(size))
+        assert QR_codes.base45_decode(QR_codes.base45_encode(data)) == data
+
+
+@pytest.mark.parametrize('text', ['A', 'abc', 'GGW', 'ZZ', '::::'])
+def test_base45_invalid_rejected(text):
+    with pytest.raises(ValueError):
+        QR_codes.base45_decode(text)
+
+
+def test_qr_text_round_trip():
+    payload = QR_codes.encode_payload(SAMPLE)
+    text = QR_codes.qr_text(payload)
+    assert text.startswith(QR_codes.QR_TEXT_PREFIX)
+    assert QR_codes.qr_data(text) == payload
+    assert QR_codes.qr_data(text.encode('ascii')) == payload
+
+
+def test_qr_text_plain_code():
+    """Код КП на печатном листе передается как есть"""
+    assert QR_codes.qr_text('12345') == '12345'
+    assert QR_codes.qr_data('12345') == b'12345'
+    assert QR_codes.qr_data('FQ:не base45') == 'FQ:не base45'.encode('utf-8')
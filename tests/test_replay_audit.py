@@ -0,0 +1,150 @@
+"""
+Тесты защиты от повторного приема и журнала действий
+"""
+
+import pytest
+
+import Cryptography
+
+
+def test_replay_in_order_and_duplicates():
+    guard = Cryptography.ReplayGuard()
+    assert guard.accept('7', 1)
+    assert guard.accept('7', 2)
+    assert not guard.accept('7', 2)
+    assert not guard.accept('7', 1)
+    # Номера разных экипажей независимы
+    assert guard.accept('8', 1)
+
+
+def test_replay_out_of_order_within_window():
+    guard = Cryptography.ReplayGuard(window=8)
+    assert guard.accept('7', 5)
+    assert guard.accept('7', 3)
+    assert guard.accept('7', 4)
+    assert not guard.accept('7', 3)
+    assert guard.accept('7', 12)
+    # 3 вышел за окно из 8 номеров ниже 12
+    assert not guard.accept('7', 3)
+    assert guard.accept('7', 6)
+
+
+@pytest.mark.parametrize('sequence', [-1, 1.5, '3', None])
+def test_replay_implausible_sequence(sequence):
+    assert not Cryptography.ReplayGuard().accept('7', sequence)
+
+
+def test_replay_jump_bounded():
+    guard = Cryptography.ReplayGuard(max_jump=100)
+    assert guard.accept('7', 1)
+    assert not guard.accept('7', 1000)
+    assert guard.accept('7', 101)
+
+
+def test_replay_large_shift_clears_window():
+    guard = Cryptography.ReplayGuard(window=8, max_jump=1000)
+    assert guard.accept('7', 1)
+    assert guard.accept('7', 500)
+    assert guard.accept('7', 499)
+
+
+def test_replay_same_code_by_fingerprint():
+    guard = Cryptography.ReplayGuard()
+    nonce = Cryptography.ReplayGuard.fingerprint(b'qr')
+    assert guard.accept('7', 1, nonce)
+    assert not guard.accept('7', 2, nonce)
+
+
+def test_replay_state_persists(tmp_path):
+    path = str(tmp_path / 'replay.json')
+    guard = Cryptography.ReplayGuard(path)
+    assert guard.accept('7', 1, b'n1')
+    reloaded = Cryptography.ReplayGuard(path)
+    assert not reloaded.accept('7', 1)
+    assert not reloaded.accept('7', 2, b'n1')
+    assert reloaded.accept('7', 2)
+
+
+KEY = b'a' * 32
+
+
+@pytest.fixture
+def audit_path(tmp_path):
+    path = str(tmp_path / 'audit.log')
+    log = Cryptography.AuditLog(path, KEY, batch_size=4)
+    for number in range(10):
+        log.record('cp_scan', crew=str(number % 3), cp=f'КП {number}')
+    log.close()
+    return path
+
+
+def read_lines(path):
+    with open(path, 'rb') as fd:
+        return fd.read().splitlines(keepends=True)
+
+
+def write_lines(path, lines):
+    with open(path, 'wb') as fd:
+        fd.write(b''.join(lines))
+
+
+def test_audit_log_verifies(audit_path):
+    assert Cryptography.verify_audit_log(audit_path, KEY) == (True, 10, None)
+
+
+def test_audit_log_edit_detected(audit_path):
+    lines = read_lines(audit_path)
+    lines[4] = lines[4].replace('КП 4'.encode(), 'КП 9'.encode())
+    write_lines(audit_path, lines)
+    assert Cryptography.verify_audit_log(audit_path, KEY) == (False, 4, 5)
+
+
+def test_audit_log_deletion_and_reorder_detected(audit_path):
+    lines = read_lines(audit_path)
+    write_lines(audit_path, lines[:3] + lines[4:])
+    assert not Cryptography.verify_audit_log(audit_path, KEY)[0]
+    write_lines(audit_path, lines[:3] + [lines[4], lines[3]] + lines[5:])
+    assert not Cryptography.verify_audit_log(audit_path, KEY)[0]
+
+
+def test_audit_log_truncation_detected_by_head(audit_path):
+    log = Cryptography.AuditLog(audit_path, KEY)
+    head = log.head.hex()
+    write_lines(audit_path, read_lines(audit_path)[:-2])
+    assert Cryptography.verify_audit_log(audit_path, KEY)[0]
+    assert not Cryptography.verify_audit_log(audit_path, KEY, expected_head=head)[0]
+
+
+def test_audit_log_rewritten_without_key_detected(audit_path):
+    """Без ключа организатора журнал не пересчитать заново"""
+    lines = read_lines(audit_path)
+    prev = b'\0' * 32
+    forged = []
+    for line in lines:
+        body = line[65:-1].replace('КП'.encode(), 'ЛУ'.encode())
+        prev = Cryptography._audit_hash(b'b' * 32, prev, body)
+        forged.append(prev.hex().encode() + b' ' + body + b'\n')
+    write_lines(audit_path, forged)
+    assert not Cryptography.verify_audit_log(audit_path, KEY)[0]
+
+
+def test_audit_log_torn_tail_cut_and_continued(audit_path):
+    with open(audit_path, 'ab') as fd:
+        fd.write(b'0123 {"action":"cp_sc')
+    log = Cryptography.AuditLog(audit_path, KEY)
+    assert log.count == 10
+    log.record('skp', crew='1', stage=2)
+    log.close()
+    assert Cryptography.verify_audit_log(audit_path, KEY) == (True, 11, None)
+
+
+def test_shared_audit_logs(tmp_path):
+    path = str(tmp_path / 'shared.log')
+    log = Cryptography.get_audit_log(path, KEY)
+    assert Cryptography.get_audit_log(path) is log
+    log.record('stage_move', crew='1')
+    Cryptography.flush_audit_logs()
+    assert Cryptography.verify_audit_log(path, KEY) == (True, 1, None)
+    Cryptography.close_audit_logs()
+    assert Cryptography.get_audit_log(path, KEY) is not log
+    Cryptography.close_audit_logs()
@@ -0,0 +1,136 @@
+"""
+Тесты шифрованного файла записей и восстановления после сбоя
+"""
+
+import os
+
+import pytest
+
+import Storage
+
+KEY = bytes(range(32))
+RECORDS = [b'meta', b'crew 1', b'crew 2', b'cp 1']
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'race.enc')
+
+
+def test_round_trip(path):
+    Storage.EncryptedRecordFile(path, KEY).write_records(RECORDS)
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS
+
+
+def test_only_changed_records_encrypted(path):
+    records = Storage.EncryptedRecordFile(path, KEY)
+    assert records.write_records(RECORDS) == len(RECORDS)
+    changed = RECORDS[:1] + [b'crew 1 v2'] + RECORDS[2:]
+    assert records.write_records(changed) == 1
+    assert records.write_records(changed[::-1]) == 0
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == changed[::-1]
+
+
+def test_compaction_keeps_data(path):
+    records = Storage.EncryptedRecordFile(path, KEY)
+    for version in range(20):
+        records.write_records(RECORDS + [f'version {version}'.encode()])
+    assert os.path.getsize(path) <= 2 * records.live_size
+    assert Storage.EncryptedRecordFile(path, KEY).read_records()[-1] == b'version 19'
+
+
+def test_json_records_round_trip(race_data):
+    records = Storage.json_records(race_data, Storage.RACE_ITEM_SECTIONS)
+    assert Storage.json_from_records(records) == race_data
+
+
+def test_wrong_key_rejected(path):
+    Storage.EncryptedRecordFile(path, KEY).write_records(RECORDS)
+    with pytest.raises(ValueError):
+        Storage.EncryptedRecordFile(path, bytes(32))
+
+
+def test_tampered_record_detected(path):
+    Storage.EncryptedRecordFile(path, KEY).write_records(RECORDS)
+    with open(path, 'r+b') as fd:
+        fd.seek(Storage._ENC_HEADER.size + 20)
+        byte = fd.read(1)
+        fd.seek(-1, os.SEEK_CUR)
+        fd.write(bytes([byte[0] ^ 1]))
+    with pytest.raises(ValueError):
+        Storage.EncryptedRecordFile(path, KEY).read_records()
+
+
+def test_crash_before_header_switch_keeps_old_version(path, monkeypatch):
+    records = Storage.EncryptedRecordFile(path, KEY)
+    records.write_records(RECORDS)
+
+    def crash(*args, **kwargs):
+        raise OSError('сбой')
+
+    monkeypatch.setattr(Storage, 'atomic_write', crash)
+    with pytest.raises(OSError):
+        records.write_records(RECORDS + [b'new'])
+    monkeypatch.undo()
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS
+
+
+def test_journal_replayed_after_crash(path, monkeypatch):
+    """Сбой после записи журнала: заголовок переключается при открытии"""
+    records = Storage.EncryptedRecordFile(path, KEY)
+    records.write_records(RECORDS)
+
+    def crash(self, header):
+        raise OSError('сбой')
+
+    monkeypatch.setattr(Storage.EncryptedRecordFile, '_write_header', crash)
+    with pytest.raises(OSError):
+        records.write_records(RECORDS + [b'new'])
+    monkeypatch.undo()
+    assert os.path.exists(path + Storage.JOURNAL_SUFFIX)
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS + [b'new']
+    assert not os.path.exists(path + Storage.JOURNAL_SUFFIX)
+
+
+def test_torn_journal_ignored(path):
+    records = Storage.EncryptedRecordFile(path, KEY)
+    records.write_records(RECORDS)
+    with open(path + Storage.JOURNAL_SUFFIX, 'wb') as fd:
+        fd.write(b'\0' * 40)
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS
+
+
+def test_crash_during_first_write(path, monkeypatch):
+    """Сбой при создании файла не делает его навсегда нечитаемым"""
+    def crash(*args, **kwargs):
+        raise OSError('сбой')
+
+    monkeypatch.setattr(Storage, 'atomic_write', crash)
+    with pytest.raises(OSError):
+        Storage.EncryptedRecordFile(path, KEY).write_records(RECORDS)
+    monkeypatch.undo()
+    records = Storage.EncryptedRecordFile(path, KEY)
+    assert records.read_records() == []
+    records.write_records(RECORDS)
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS
+
+
+@pytest.mark.parametrize('tail', [b'', b'garbage after crash'])
+def test_empty_manifest_header_opens_empty(path, tail):
+    """Файл прежних версий: заголовок (0, 0) без манифеста"""
+    records = Storage.EncryptedRecordFile(path, KEY)
+    with open(path, 'wb') as fd:
+        fd.write(records._header(0, 0) + tail)
+    reopened = Storage.EncryptedRecordFile(path, KEY)
+    assert reopened.read_records() == []
+    reopened.write_records(RECORDS)
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS
+
+
+def test_torn_header_opens_empty(path):
+    with open(path, 'wb') as fd:
+        fd.write(Storage._ENC_MAGIC + b'\0' * 10)
+    records = Storage.EncryptedRecordFile(path, KEY)
+    assert records.read_records() == []
+    records.write_records(RECORDS)
+    assert Storage.EncryptedRecordFile(path, KEY).read_records() == RECORDS